@@ -1,16 +1,28 @@
+import asyncio
+import ipaddress
+
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from pydantic import BaseModel
 from typing import Optional, List
 
-from app.models.db import get_session
+from app.models.db import get_async_session
 from app.models.arp_ban_target import ArpBanTarget
 from app.models.arp_ban_log import ArpBanLog
 from app.repositories.arp_ban_target_repo import ArpBanTargetRepository
 from app.repositories.arp_ban_log_repo import ArpBanLogRepository
 from app.repositories.device_repo import DeviceRepository
+from app.repositories.unit_of_work import unit_of_work
+from app.schemas.device import DeviceBulkFilter
+from app.services.device_cache import DeviceCache
 from app.services.arp_ban_service import ArpBanService
-from app.utils.network import get_primary_network_cidr, expand_cidr_for_arp_ban, get_network_info
+from app.utils.network import (
+    arp_ban_address_range,
+    get_gateway_ip_cached,
+    get_local_ip_cached,
+    get_network_info,
+    get_primary_network_cidr_cached
+)
 
 router = APIRouter()
 
@@ -28,47 +40,69 @@ async def get_arp_ban_status():
     return {
         "running": ArpBanService.is_running(),
         "target_count": len(ArpBanService.get_targets()),
-        "targets": ArpBanService.get_targets()
+        "targets": ArpBanService.get_targets(),
+        "sync": ArpBanService.get_sync_state(),
+        "reconcile": ArpBanService.get_reconcile_state()
     }
 
 
+@router.post("/reconcile")
+async def reconcile_arp_ban():
+    """立即对比期望状态与 Ban 实例的实际状态并修复偏差"""
+    return await ArpBanService.reconcile()
+
+
 @router.get("/network-info")
 async def get_network_info_api():
     """获取网络信息"""
     return get_network_info()
 
 
+# available-hosts 每页最多返回的地址数
+MAX_AVAILABLE_HOSTS_PAGE = 1024
+
+
 @router.get("/available-hosts")
-async def get_available_hosts(session: Session = Depends(get_session)):
+async def get_available_hosts(offset: int = 0, limit: Optional[int] = None):
     """
     获取网段内所有可用主机（基于网段生成，不管是否在线）
+
+    网段按下标惰性计算，不展开整个网段；大网段通过 offset/limit 分页，
+    limit 默认且最大为 MAX_AVAILABLE_HOSTS_PAGE。
     
     Returns:
         {
             "cidr": "192.168.1.0/24",
             "total": 252,
+            "offset": 0,
+            "limit": 1024,
+            "has_more": false,
             "hosts": [...],
             "whitelist": ["192.168.1.1", "192.168.1.10"]
         }
     """
-    # 1. 获取当前网段
-    cidr = get_primary_network_cidr()
-    
-    # 2. 获取白名单（网关和本机）
-    from app.utils.network import get_gateway_ip, get_local_ip_from_socket
-    gateway_ip = get_gateway_ip()
-    local_ip = get_local_ip_from_socket()
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="offset 不能为负数")
+    limit = min(limit or MAX_AVAILABLE_HOSTS_PAGE, MAX_AVAILABLE_HOSTS_PAGE)
+    if limit <= 0:
+        raise HTTPException(status_code=400, detail="limit 必须大于 0")
+
+    # 1. 获取当前网段和白名单（网关和本机），检测结果有缓存，网关检测会调用外部命令，放到线程中执行
+    cidr = await asyncio.to_thread(get_primary_network_cidr_cached)
+    gateway_ip = await asyncio.to_thread(get_gateway_ip_cached)
+    local_ip = get_local_ip_cached()
     whitelist = [gateway_ip, local_ip]
     
-    # 3. 展开所有 IP（排除 .1 和 .254）
-    all_ips = expand_cidr_for_arp_ban(cidr)
+    # 2. 计算当前页的 IP（排除 .1 和 .254）
+    address_range = arp_ban_address_range(cidr)
+    page_ips = address_range.slice(offset, limit)
     
-    # 4. 尝试从数据库匹配设备信息（可选，增强显示）
-    device_repo = DeviceRepository(session)
+    # 3. 匹配设备信息（可选，增强显示），从进程内设备缓存读取，未命中的 IP 合并为一次查询
+    devices = await asyncio.to_thread(DeviceCache.get_many, page_ips)
     hosts = []
     
-    for ip in all_ips:
-        device = device_repo.get_by_ip(ip)
+    for ip in page_ips:
+        device = devices.get(ip)
         # 判断在线状态：如果有最近被发现的记录且没有离线记录
         is_online = False
         if device:
@@ -76,9 +110,6 @@ async def get_available_hosts(session: Session = Depends(get_session)):
             has_offline = device.nmap_offline_at or device.bettercap_offline_at
             is_online = bool(has_recent_seen and not has_offline)
         
-        # 判断是否在白名单
-        is_whitelist = ip in whitelist
-        
         hosts.append({
             "ip": ip,
             "mac": device.mac if device else None,
@@ -86,37 +117,35 @@ async def get_available_hosts(session: Session = Depends(get_session)):
             "vendor": device.vendor if device else None,
             "online": is_online,  # 仅供参考
             "last_seen": device.lastSeenAt.isoformat() if device and device.lastSeenAt else None,
-            "is_whitelist": is_whitelist  # 新增：是否在白名单
+            "is_whitelist": ip in whitelist  # 是否在白名单
         })
     
     return {
         "cidr": cidr,
-        "total": len(hosts),
+        "total": len(address_range),
+        "offset": offset,
+        "limit": limit,
+        "has_more": offset + len(hosts) < len(address_range),
         "hosts": hosts,
-        "whitelist": whitelist,  # 新增：白名单列表
-        "gateway_ip": gateway_ip,  # 新增：网关IP
-        "local_ip": local_ip  # 新增：本机IP
+        "whitelist": whitelist,
+        "gateway_ip": gateway_ip,
+        "local_ip": local_ip
     }
 
 
 @router.get("/targets")
-async def list_targets(session: Session = Depends(get_session)):
+async def list_targets(session: AsyncSession = Depends(get_async_session)):
     """获取所有目标设备"""
-    repo = ArpBanTargetRepository(session)
-    targets = repo.get_all()
+    targets = await session.run_sync(lambda s: ArpBanTargetRepository(s).get_all())
     return {"targets": targets}
 
 
 @router.post("/targets")
-async def add_target(req: AddTargetRequest, session: Session = Depends(get_session)):
+async def add_target(req: AddTargetRequest, session: AsyncSession = Depends(get_async_session)):
     """添加目标设备"""
-    repo = ArpBanTargetRepository(session)
-    log_repo = ArpBanLogRepository(session)
-    
     # 检查是否在白名单（网关、本机等受保护设备）
-    from app.utils.network import get_gateway_ip, get_local_ip_from_socket
-    gateway_ip = get_gateway_ip()
-    local_ip = get_local_ip_from_socket()
+    gateway_ip = await asyncio.to_thread(get_gateway_ip_cached)
+    local_ip = get_local_ip_cached()
     whitelist = [gateway_ip, local_ip]
     
     if req.ip in whitelist:
@@ -127,7 +156,7 @@ async def add_target(req: AddTargetRequest, session: Session = Depends(get_sessi
         )
     
     # 检查是否已存在
-    existing = repo.get_by_ip(req.ip)
+    existing = await session.run_sync(lambda s: ArpBanTargetRepository(s).get_by_ip(req.ip))
     if existing:
         raise HTTPException(status_code=400, detail=f"IP {req.ip} 已在目标列表中")
     
@@ -138,54 +167,183 @@ async def add_target(req: AddTargetRequest, session: Session = Depends(get_sessi
         hostname=req.hostname,
         note=req.note
     )
-    repo.create(target)
+    await session.run_sync(lambda s: ArpBanTargetRepository(s).create(target))
     
     # 记录日志
-    log_repo.create(ArpBanLog(
+    await session.run_sync(lambda s: ArpBanLogRepository(s).create(ArpBanLog(
         action="add",
         ip=req.ip,
         message=f"添加目标设备: {req.ip}",
         operator="admin"
-    ))
+    )))
     
-    # 如果 ARP Ban 正在运行，动态更新目标
-    if ArpBanService.is_running():
-        all_targets = repo.get_all()
-        target_ips = [t.ip for t in all_targets]
-        await ArpBanService.update_targets(target_ips)
+    # 如果 ARP Ban 正在运行，合并短时间内的变更后在后台推送到 Bettercap
+    sync = ArpBanService.request_target_sync()
     
-    return {"success": True, "target": target}
+    return {"success": True, "target": target, "sync": sync}
+
+
+# 单次批量操作最多涉及的 IP 数（防止误传大网段）
+MAX_BULK_TARGETS = 4096
+
+
+class BulkTargetsRequest(BaseModel):
+    """批量添加/移除目标：ips、cidrs、filter 可组合使用，结果取并集"""
+    ips: List[str] = []
+    cidrs: List[str] = []  # 按 ARP Ban 可选地址展开（排除 .1 和 .254）
+    filter: Optional[DeviceBulkFilter] = None  # 按设备筛选（关键字、厂商、标签、网段、在线状态）
+    note: Optional[str] = None  # 添加时写入每个目标的备注
+
+
+def _resolve_bulk_ips(session, req: BulkTargetsRequest) -> tuple:
+    """
+    解析批量请求涉及的 IP
+
+    Returns:
+        (按出现顺序去重的 IP 列表, 无效输入列表, ip -> 设备)
+    """
+    ips: List[str] = []
+    invalid: List[dict] = []
+    devices = {}
+
+    for ip in req.ips:
+        try:
+            ips.append(str(ipaddress.ip_address(ip)))
+        except ValueError:
+            invalid.append({"ip": ip, "reason": "无效的 IP"})
+
+    for cidr in req.cidrs:
+        try:
+            address_range = arp_ban_address_range(cidr)
+        except ValueError:
+            invalid.append({"ip": cidr, "reason": "无效的 CIDR"})
+            continue
+        if len(address_range) > MAX_BULK_TARGETS:
+            raise HTTPException(status_code=400, detail=f"网段 {cidr} 过大，单次最多 {MAX_BULK_TARGETS} 个 IP")
+        ips.extend(address_range)
+
+    if req.filter:
+        f = req.filter
+        if not f.has_criteria() and not f.all:
+            raise HTTPException(status_code=400, detail="筛选条件为空会匹配全部设备，确需选择全部设备时请指定 filter.all=true")
+        try:
+            matched = DeviceRepository(session).find(
+                keyword=f.keyword, ips=f.ips, vendor=f.vendor, tags=f.tags, cidr=f.cidr, online=f.online
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"无效的 CIDR: {f.cidr}")
+        for d in matched:
+            devices[d.ip] = d
+            ips.append(d.ip)
+
+    ips = list(dict.fromkeys(ips))
+    if len(ips) > MAX_BULK_TARGETS:
+        raise HTTPException(status_code=400, detail=f"单次最多操作 {MAX_BULK_TARGETS} 个 IP，当前 {len(ips)} 个")
+    return ips, invalid, devices
+
+
+@router.post("/targets/bulk")
+async def bulk_add_targets(req: BulkTargetsRequest, session: AsyncSession = Depends(get_async_session)):
+    """
+    批量添加目标设备
+
+    白名单（网关、本机）只检测一次；目标和操作日志在一个事务中写入，
+    ARP Ban 运行时只触发一次目标同步。已存在和受保护的 IP 跳过并在结果中说明。
+    """
+    gateway_ip = await asyncio.to_thread(get_gateway_ip_cached)
+    local_ip = get_local_ip_cached()
+    whitelist = {gateway_ip: "网关", local_ip: "本机"}
+
+    def add(s):
+        ips, skipped, devices = _resolve_bulk_ips(s, req)
+        existing = ArpBanTargetRepository(s).get_by_ips(ips)
+        # 补充设备信息（按筛选条件得到的设备已加载）
+        devices.update(DeviceRepository(s).get_by_ips(ip for ip in ips if ip not in devices))
+
+        targets = []
+        for ip in ips:
+            if ip in whitelist:
+                skipped.append({"ip": ip, "reason": f"该IP是{whitelist[ip]}，禁止Ban"})
+            elif ip in existing:
+                skipped.append({"ip": ip, "reason": "已在目标列表中"})
+            else:
+                d = devices.get(ip)
+                targets.append(ArpBanTarget(
+                    ip=ip,
+                    mac=d.mac if d else None,
+                    hostname=d.hostname if d else None,
+                    note=req.note
+                ))
+
+        with unit_of_work(s):
+            ArpBanTargetRepository(s).create_many(targets)
+            ArpBanLogRepository(s).create_many([ArpBanLog(
+                action="add",
+                ip=t.ip,
+                message=f"批量添加目标设备: {t.ip}",
+                operator="admin"
+            ) for t in targets])
+        return [t.ip for t in targets], skipped
+
+    added, skipped = await session.run_sync(add)
+
+    sync = ArpBanService.request_target_sync() if added else ArpBanService.get_sync_state()
+    return {"success": True, "added": added, "added_count": len(added), "skipped": skipped, "sync": sync}
+
+
+@router.delete("/targets/bulk")
+async def bulk_remove_targets(req: BulkTargetsRequest, session: AsyncSession = Depends(get_async_session)):
+    """
+    批量移除目标设备
+
+    目标删除和操作日志在一个事务中完成，ARP Ban 运行时只触发一次目标同步。
+    不在目标列表中的 IP 跳过并在结果中说明。
+    """
+    def remove(s):
+        ips, skipped, _ = _resolve_bulk_ips(s, req)
+        existing = ArpBanTargetRepository(s).get_by_ips(ips)
+        removed = [ip for ip in ips if ip in existing]
+        skipped.extend({"ip": ip, "reason": "不在目标列表中"} for ip in ips if ip not in existing)
+
+        with unit_of_work(s):
+            ArpBanTargetRepository(s).delete_by_ips(removed)
+            ArpBanLogRepository(s).create_many([ArpBanLog(
+                action="remove",
+                ip=ip,
+                message=f"批量移除目标设备: {ip}",
+                operator="admin"
+            ) for ip in removed])
+        return removed, skipped
+
+    removed, skipped = await session.run_sync(remove)
+
+    sync = ArpBanService.request_target_sync() if removed else ArpBanService.get_sync_state()
+    return {"success": True, "removed": removed, "removed_count": len(removed), "skipped": skipped, "sync": sync}
 
 
 @router.delete("/targets/{ip}")
-async def remove_target(ip: str, session: Session = Depends(get_session)):
+async def remove_target(ip: str, session: AsyncSession = Depends(get_async_session)):
     """移除目标设备"""
-    repo = ArpBanTargetRepository(session)
-    log_repo = ArpBanLogRepository(session)
-    
     # 检查是否存在
-    target = repo.get_by_ip(ip)
+    target = await session.run_sync(lambda s: ArpBanTargetRepository(s).get_by_ip(ip))
     if not target:
         raise HTTPException(status_code=404, detail=f"目标 {ip} 不存在")
     
     # 删除目标
-    repo.delete_by_ip(ip)
+    await session.run_sync(lambda s: ArpBanTargetRepository(s).delete_by_ip(ip))
     
     # 记录日志
-    log_repo.create(ArpBanLog(
+    await session.run_sync(lambda s: ArpBanLogRepository(s).create(ArpBanLog(
         action="remove",
         ip=ip,
         message=f"移除目标设备: {ip}",
         operator="admin"
-    ))
+    )))
     
-    # 如果 ARP Ban 正在运行，动态更新目标
-    if ArpBanService.is_running():
-        all_targets = repo.get_all()
-        target_ips = [t.ip for t in all_targets]
-        await ArpBanService.update_targets(target_ips)
+    # 如果 ARP Ban 正在运行，合并短时间内的变更后在后台推送到 Bettercap
+    sync = ArpBanService.request_target_sync()
     
-    return {"success": True, "message": f"已移除目标 {ip}"}
+    return {"success": True, "message": f"已移除目标 {ip}", "sync": sync}
 
 
 class StartBanRequest(BaseModel):
@@ -194,7 +352,7 @@ class StartBanRequest(BaseModel):
 
 
 @router.post("/start")
-async def start_ban(req: StartBanRequest = None, session: Session = Depends(get_session)):
+async def start_ban(req: StartBanRequest = None):
     """启动 ARP Ban"""
     try:
         # 获取白名单配置
@@ -210,7 +368,7 @@ async def start_ban(req: StartBanRequest = None, session: Session = Depends(get_
 
 
 @router.post("/stop")
-async def stop_ban(session: Session = Depends(get_session)):
+async def stop_ban():
     """停止 ARP Ban"""
     try:
         await ArpBanService.stop_arp_ban()
@@ -220,9 +378,8 @@ async def stop_ban(session: Session = Depends(get_session)):
 
 
 @router.get("/logs")
-async def get_logs(limit: int = 100, session: Session = Depends(get_session)):
+async def get_logs(limit: int = 100, session: AsyncSession = Depends(get_async_session)):
     """获取操作日志"""
-    repo = ArpBanLogRepository(session)
-    logs = repo.get_recent(limit)
+    logs = await session.run_sync(lambda s: ArpBanLogRepository(s).get_recent(limit))
     return {"logs": logs}
 
@@ -3,6 +3,7 @@
 处理登录、登出和token验证
 """
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from datetime import timedelta
 from app.utils.auth import (
@@ -34,7 +35,8 @@ class VerifyResponse(BaseModel):
 @router.post("/login", response_model=LoginResponse)
 async def login(request: LoginRequest):
     """用户登录"""
-    user = authenticate_user(request.username, request.password)
+    # 数据库查询和 bcrypt 校验都是阻塞操作，放到线程池中执行
+    user = await run_in_threadpool(authenticate_user, request.username, request.password)
     
     if not user:
         raise HTTPException(
@@ -86,7 +88,7 @@ async def change_password(
     from app.utils.auth import get_user_from_db, verify_password, change_user_password
     
     # 获取用户信息
-    user = get_user_from_db(current_user["username"])
+    user = await run_in_threadpool(get_user_from_db, current_user["username"])
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -94,7 +96,7 @@ async def change_password(
         )
     
     # 验证旧密码
-    if not verify_password(request.old_password, user.hashed_password):
+    if not await run_in_threadpool(verify_password, request.old_password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="旧密码错误"
@@ -108,7 +110,7 @@ async def change_password(
         )
     
     # 修改密码
-    success = change_user_password(current_user["username"], request.new_password)
+    success = await run_in_threadpool(change_user_password, current_user["username"], request.new_password)
     
     if not success:
         raise HTTPException(
@@ -1,12 +1,25 @@
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session
 
 from app.models.db import get_session
 from app.models.device import Device
+from app.repositories.device_address_history_repo import DeviceAddressHistoryRepository
 from app.repositories.device_repo import DeviceRepository
-from app.schemas.device import DeviceCreate, DeviceRead, DeviceUpdate
+from app.repositories.device_tag_repo import DeviceTagRepository, normalize_tags
+from app.repositories.unit_of_work import unit_of_work
+from app.schemas.device import (
+    DeviceCreate,
+    DeviceRead,
+    DeviceUpdate,
+    DeviceBulkOperation,
+    DeviceBulkRequest,
+    DeviceBulkItemResult,
+    DeviceBulkResponse,
+)
+from app.services.device_io_service import EXPORT_FORMATS, detect_format, import_devices, iter_export
 import json
 
 
@@ -28,54 +41,33 @@ def deserialize_tags(tags: Optional[list[str]]) -> Optional[str]:
     return json.dumps(tags, ensure_ascii=False)
 
 
-@router.get("/", response_model=List[DeviceRead])
-def list_devices(keyword: Optional[str] = None, session: Session = Depends(get_session)):
-    repo = DeviceRepository(session)
-    devices = repo.list(keyword)
-    result: List[DeviceRead] = []
-    for d in devices:
-        # 计算综合在线状态：任一扫描工具发现在线即为在线
-        nmap_online = bool(d.nmap_last_seen and not d.nmap_offline_at)
-        bettercap_online = bool(d.bettercap_last_seen and not d.bettercap_offline_at)
-        is_online = nmap_online or bettercap_online
-        
-        result.append(
-            DeviceRead(
-                id=d.id,
-                ip=d.ip,
-                mac=d.mac,
-                hostname=d.hostname,
-                vendor=d.vendor,
-                os=d.os,
-                tags=serialize_tags(d.tags),
-                note=d.note,
-                firstSeenAt=d.firstSeenAt,
-                lastSeenAt=d.lastSeenAt,
-                offline_at=d.offline_at,
-                lastScanTaskId=d.lastScanTaskId,
-                # 双状态
-                nmap_last_seen=d.nmap_last_seen,
-                nmap_offline_at=d.nmap_offline_at,
-                bettercap_last_seen=d.bettercap_last_seen,
-                bettercap_offline_at=d.bettercap_offline_at,
-                is_online=is_online
-            )
-        )
-    return result
+def _set_device_tags(session: Session, d: Device, tags: Optional[list[str]]) -> None:
+    """同时更新 Device.tags（接口返回用）和规范化标签表（筛选/统计用）"""
+    tags = normalize_tags(tags)
+    d.tags = deserialize_tags(tags)
+    DeviceTagRepository(session).set_tags(d.id, tags)
 
 
-@router.get("/{device_id}", response_model=DeviceRead)
-def get_device(device_id: int, session: Session = Depends(get_session)):
-    repo = DeviceRepository(session)
-    d = repo.get(device_id)
-    if not d:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    # 计算综合在线状态
+def _apply_update(session: Session, d: Device, payload: DeviceUpdate) -> None:
+    """把更新请求中非空的字段写入设备"""
+    if payload.mac is not None:
+        d.mac = payload.mac
+    if payload.hostname is not None:
+        d.hostname = payload.hostname
+    if payload.vendor is not None:
+        d.vendor = payload.vendor
+    if payload.tags is not None:
+        _set_device_tags(session, d, payload.tags)
+    if payload.note is not None:
+        d.note = payload.note
+
+
+def _to_device_read(d: Device) -> DeviceRead:
+    # 计算综合在线状态：任一扫描工具发现在线即为在线
     nmap_online = bool(d.nmap_last_seen and not d.nmap_offline_at)
     bettercap_online = bool(d.bettercap_last_seen and not d.bettercap_offline_at)
     is_online = nmap_online or bettercap_online
-    
+
     return DeviceRead(
         id=d.id,
         ip=d.ip,
@@ -98,6 +90,79 @@ def get_device(device_id: int, session: Session = Depends(get_session)):
     )
 
 
+@router.get("/", response_model=List[DeviceRead])
+def list_devices(
+    keyword: Optional[str] = None,
+    tag: Optional[List[str]] = Query(None),
+    tag_match: Literal["any", "all"] = "any",
+    session: Session = Depends(get_session)
+):
+    """
+    设备列表
+
+    - tag: 按标签筛选，可重复传入多个
+    - tag_match: any（带有任一标签）或 all（同时带有全部标签）
+    """
+    repo = DeviceRepository(session)
+    devices = repo.list(keyword, tags=tag, match_all_tags=(tag_match == "all"))
+    return [_to_device_read(d) for d in devices]
+
+
+@router.get("/tags")
+def list_device_tags(session: Session = Depends(get_session)):
+    """各标签的设备数量"""
+    counts = DeviceTagRepository(session).counts()
+    return [{"tag": tag, "count": count} for tag, count in counts]
+
+
+@router.get("/export")
+def export_devices(format: str = "csv"):
+    """流式导出设备清单（csv 或 ndjson），数据库游标逐批读取，内存占用恒定"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format 必须是 {', '.join(EXPORT_FORMATS)} 之一")
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        iter_export(format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="devices.{format}"'}
+    )
+
+
+@router.post("/import")
+def import_devices_file(file: UploadFile = File(...), format: Optional[str] = None):
+    """
+    流式导入设备清单（csv 或 ndjson）
+
+    按 IP 合并：已存在的设备只覆盖文件中非空的字段，不存在的新建。
+    文件逐行解析、按批合并提交，不会整体读入内存。
+    """
+    fmt = format or detect_format(file.filename, file.content_type)
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="无法识别文件格式，请通过 format 参数指定 csv 或 ndjson")
+    return import_devices(file.file, fmt)
+
+
+@router.get("/{device_id}", response_model=DeviceRead)
+def get_device(device_id: int, session: Session = Depends(get_session)):
+    repo = DeviceRepository(session)
+    d = repo.get(device_id)
+    if not d:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return _to_device_read(d)
+
+
+@router.get("/{device_id}/address-history")
+def get_device_address_history(device_id: int, limit: int = 100, session: Session = Depends(get_session)):
+    """设备的 IP 变更记录（按 MAC 识别到换地址时记录），最新的在前"""
+    if not DeviceRepository(session).get(device_id):
+        raise HTTPException(status_code=404, detail="Device not found")
+    records = DeviceAddressHistoryRepository(session).list_for_device(device_id, limit)
+    return [
+        {"mac": r.mac, "old_ip": r.old_ip, "new_ip": r.new_ip, "changed_at": r.changed_at}
+        for r in records
+    ]
+
+
 @router.post("/", response_model=DeviceRead)
 def create_device(payload: DeviceCreate, session: Session = Depends(get_session)):
     repo = DeviceRepository(session)
@@ -109,11 +174,14 @@ def create_device(payload: DeviceCreate, session: Session = Depends(get_session)
         mac=payload.mac,
         hostname=payload.hostname,
         vendor=payload.vendor,
-        tags=deserialize_tags(payload.tags),
+        tags=deserialize_tags(normalize_tags(payload.tags) if payload.tags is not None else None),
         note=payload.note,
     )
-    d = repo.create(d)
-    return DeviceRead.model_validate(d, from_attributes=True)
+    with unit_of_work(session):
+        d = repo.create(d)
+        if payload.tags:
+            DeviceTagRepository(session).set_tags(d.id, payload.tags)
+    return _to_device_read(d)
 
 
 @router.put("/{device_id}", response_model=DeviceRead)
@@ -123,19 +191,10 @@ def update_device(device_id: int, payload: DeviceUpdate, session: Session = Depe
     if not d:
         raise HTTPException(status_code=404, detail="Device not found")
 
-    if payload.mac is not None:
-        d.mac = payload.mac
-    if payload.hostname is not None:
-        d.hostname = payload.hostname
-    if payload.vendor is not None:
-        d.vendor = payload.vendor
-    if payload.tags is not None:
-        d.tags = deserialize_tags(payload.tags)
-    if payload.note is not None:
-        d.note = payload.note
+    _apply_update(session, d, payload)
 
     d = repo.update(d)
-    return DeviceRead.model_validate(d, from_attributes=True)
+    return _to_device_read(d)
 
 
 @router.delete("/{device_id}")
@@ -144,7 +203,105 @@ def delete_device(device_id: int, session: Session = Depends(get_session)):
     d = repo.get(device_id)
     if not d:
         raise HTTPException(status_code=404, detail="Device not found")
+    DeviceTagRepository(session).delete_for_device(d.id)
     repo.delete(d)
     return {"success": True}
 
 
+def _apply_bulk_operation(repo: DeviceRepository, d: Device, op: DeviceBulkOperation) -> None:
+    """对单台设备执行批量操作（只修改会话中的对象，不提交）"""
+    if op.action == "delete":
+        DeviceTagRepository(repo.session).delete_for_device(d.id)
+        repo.remove(d)
+        return
+
+    if op.action == "update":
+        if op.fields is None:
+            raise ValueError("update 操作需要提供 fields")
+        _apply_update(repo.session, d, op.fields)
+    elif op.action in ("add_tags", "remove_tags"):
+        if not op.tags:
+            raise ValueError(f"{op.action} 操作需要提供 tags")
+        current = serialize_tags(d.tags) or []
+        if op.action == "add_tags":
+            current.extend(t for t in op.tags if t not in current)
+        else:
+            current = [t for t in current if t not in op.tags]
+        _set_device_tags(repo.session, d, current)
+    repo.add(d)
+
+
+@router.post("/bulk", response_model=DeviceBulkResponse)
+def bulk_devices(payload: DeviceBulkRequest, session: Session = Depends(get_session)):
+    """
+    批量修改/打标签/删除设备
+
+    - operations: 按 id 或 ip 指定的操作列表
+    - filter + apply: 对筛选出的所有设备执行同一个操作（filter 不带任何条件时需指定 all=true）
+    整批操作在一个事务中执行，只提交一次；单项失败不影响其他项，结果逐项返回。
+    """
+    if not payload.operations and not (payload.filter and payload.apply):
+        raise HTTPException(status_code=400, detail="需要提供 operations 或 filter + apply")
+
+    repo = DeviceRepository(session)
+    items: List[tuple] = []  # (操作, 设备或 None, 错误)
+
+    if payload.operations:
+        by_id = repo.get_many(op.id for op in payload.operations if op.id is not None)
+        by_ip = repo.get_by_ips(op.ip for op in payload.operations if op.id is None and op.ip)
+        for op in payload.operations:
+            if op.id is not None:
+                d = by_id.get(op.id)
+            elif op.ip:
+                d = by_ip.get(op.ip)
+            else:
+                items.append((op, None, "需要提供 id 或 ip"))
+                continue
+            items.append((op, d, None if d else "Device not found"))
+
+    if payload.filter and payload.apply:
+        f = payload.filter
+        if not f.has_criteria() and not f.all:
+            raise HTTPException(status_code=400, detail="筛选条件为空会匹配全部设备，确需对全部设备操作时请指定 filter.all=true")
+        try:
+            devices = repo.find(
+                keyword=f.keyword, ips=f.ips, vendor=f.vendor, tags=f.tags, cidr=f.cidr, online=f.online
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"无效的 CIDR: {f.cidr}")
+        items.extend((payload.apply, d, None) for d in devices)
+
+    results: List[DeviceBulkItemResult] = []
+    deleted_ids = set()
+    for index, (op, d, error) in enumerate(items):
+        if error is None and d.id in deleted_ids:
+            error = "Device not found"
+        if error is None:
+            try:
+                _apply_bulk_operation(repo, d, op)
+                if op.action == "delete":
+                    deleted_ids.add(d.id)
+            except ValueError as e:
+                error = str(e)
+        results.append(DeviceBulkItemResult(
+            index=index,
+            id=d.id if d else op.id,
+            ip=d.ip if d else op.ip,
+            action=op.action,
+            success=error is None,
+            error=error
+        ))
+
+    try:
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise HTTPException(status_code=500, detail=f"批量操作提交失败: {str(e)}")
+
+    succeeded = sum(1 for r in results if r.success)
+    return DeviceBulkResponse(
+        total=len(results),
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        results=results
+    )
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import Session, select
+
+from app.models.db import get_session
+from app.models.device import Device
+from app.repositories.device_presence_repo import DevicePresenceRepository
+from app.repositories.device_repo import DeviceRepository
+from app.services.presence_service import summarize_presence
+
+
+router = APIRouter(prefix="/api/presence", tags=["presence"])
+
+
+def _resolve_window(start: Optional[datetime], end: Optional[datetime], days: int):
+    end = end or datetime.now()
+    start = start or end - timedelta(days=days)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start 必须早于 end")
+    return start, end
+
+
+@router.get("/uptime")
+def list_uptime(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    days: int = 7,
+    source: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    """所有设备在时间窗内的在线率与上线次数（默认最近7天）"""
+    start, end = _resolve_window(start, end, days)
+    sessions = DevicePresenceRepository(session).get_overlapping(start, end, source=source)
+
+    by_device = {}
+    for s in sessions:
+        by_device.setdefault(s.device_id, []).append(s)
+
+    devices = {}
+    if by_device:
+        devices = {
+            d.id: d for d in session.exec(select(Device).where(Device.id.in_(list(by_device.keys()))))
+        }
+
+    items = []
+    for device_id, device_sessions in by_device.items():
+        summary = summarize_presence(device_sessions, start, end)
+        device = devices.get(device_id)
+        items.append({
+            "device_id": device_id,
+            "ip": device.ip if device else None,
+            "hostname": device.hostname if device else None,
+            "uptime_seconds": summary["uptime_seconds"],
+            "uptime_percent": summary["uptime_percent"],
+            "session_count": summary["session_count"]
+        })
+    items.sort(key=lambda x: x["uptime_percent"], reverse=True)
+
+    return {"start": start, "end": end, "source": source, "devices": items}
+
+
+@router.get("/online-at")
+def get_online_at(
+    at: datetime,
+    source: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    """查询某一时间点在线的设备"""
+    device_ids = DevicePresenceRepository(session).get_online_device_ids(at, source)
+    devices = []
+    if device_ids:
+        devices = list(session.exec(select(Device).where(Device.id.in_(device_ids)).order_by(Device.ip)))
+
+    return {
+        "at": at,
+        "source": source,
+        "count": len(devices),
+        "devices": [
+            {"id": d.id, "ip": d.ip, "mac": d.mac, "hostname": d.hostname, "vendor": d.vendor}
+            for d in devices
+        ]
+    }
+
+
+@router.get("/devices/{device_id}")
+def get_device_presence(
+    device_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    days: int = 7,
+    source: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    """单台设备在时间窗内的在线区间、在线率和上线次数"""
+    if not DeviceRepository(session).get(device_id):
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    start, end = _resolve_window(start, end, days)
+    sessions = DevicePresenceRepository(session).get_overlapping(
+        start, end, device_id=device_id, source=source
+    )
+    summary = summarize_presence(sessions, start, end)
+
+    return {"device_id": device_id, "start": start, "end": end, "source": source, **summary}
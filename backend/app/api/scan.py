@@ -3,9 +3,10 @@ from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 import asyncio
 
-from app.models.db import get_session
+from app.models.db import get_session, get_async_session
 from app.services.scan_service import (
     scan_ping, 
     scan_nmap, 
@@ -56,7 +57,7 @@ async def start_scan(req: ScanRequest):
                     detail="使用 bettercap 时必须提供 bettercap_url"
                 )
         
-        task_id = start_scan_task(
+        task_id = await start_scan_task(
             cidrs=req.cidrs,
             scan_tool=req.scan_tool,
             nmap_args=req.nmap_args,
@@ -86,23 +87,23 @@ async def start_scan(req: ScanRequest):
 
 
 @router.get("/status/{task_id}")
-async def get_scan_status(task_id: str):
+async def get_scan_status(task_id: str, session: AsyncSession = Depends(get_async_session)):
     """
     查询扫描任务状态
     
     返回任务的实时状态、进度和结果
     """
-    task_status = get_task_status(task_id)
+    task_status = await get_task_status(session, task_id)
     if not task_status:
         raise HTTPException(status_code=404, detail="任务不存在")
     return task_status
 
 
 @router.get("/tasks")
-async def list_scan_tasks(limit: int = 50):
+async def list_scan_tasks(limit: int = 50, session: AsyncSession = Depends(get_async_session)):
     """
     获取最近的扫描任务列表
     """
-    return get_recent_tasks(limit)
+    return await get_recent_tasks(session, limit)
 
 
@@ -1,17 +1,17 @@
 import asyncio
 import json
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.models.db import get_session
+from app.models.db import get_async_session
 from app.models.scheduled_task import ScheduledTask
 from app.repositories.scheduled_task_repo import ScheduledTaskRepository
 from app.repositories.task_execution_repo import TaskExecutionRepository
-from app.repositories.app_config_repo import AppConfigRepository
+from app.services.config_cache import ConfigCache
 from app.services.scheduler_service import (
     validate_cron_expression,
     reload_task,
@@ -52,10 +52,9 @@ class TaskUpdate(BaseModel):
 
 
 @router.get("/")
-async def list_tasks(session: Session = Depends(get_session)):
+async def list_tasks(session: AsyncSession = Depends(get_async_session)):
     """获取所有定时任务"""
-    repo = ScheduledTaskRepository(session)
-    tasks = repo.get_all()
+    tasks = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_all())
     return [
         {
             "id": t.id,
@@ -75,17 +74,15 @@ async def list_tasks(session: Session = Depends(get_session)):
 
 
 @router.post("/")
-async def create_task(req: TaskCreate, session: Session = Depends(get_session)):
+async def create_task(req: TaskCreate, session: AsyncSession = Depends(get_async_session)):
     """创建定时任务"""
     # 验证 cron 表达式
     if not validate_cron_expression(req.cron_expression):
         raise HTTPException(status_code=400, detail="Invalid cron expression")
     
-    repo = ScheduledTaskRepository(session)
-    
     # 检查 Bettercap 任务唯一性：如果是 Bettercap 且启用，检查是否已有其他启用的 Bettercap 任务
     if req.scan_tool == "bettercap" and req.enabled:
-        existing_tasks = repo.get_all()
+        existing_tasks = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_all())
         for t in existing_tasks:
             if t.scan_tool == "bettercap" and t.enabled:
                 raise HTTPException(
@@ -95,9 +92,7 @@ async def create_task(req: TaskCreate, session: Session = Depends(get_session)):
     
     # 如果是 Bettercap 任务，检查配置是否存在
     if req.scan_tool == "bettercap":
-        config_repo = AppConfigRepository(session)
-        config = config_repo.get_by_key("bettercap_config")
-        if not config:
+        if not await ConfigCache.aget_json("bettercap_config"):
             raise HTTPException(
                 status_code=400,
                 detail="请先在「设置」页面配置 Bettercap 全局参数后再创建任务"
@@ -114,7 +109,7 @@ async def create_task(req: TaskCreate, session: Session = Depends(get_session)):
         created_at=datetime.now(),
         updated_at=datetime.now()
     )
-    task = repo.create(task)
+    task = await session.run_sync(lambda s: ScheduledTaskRepository(s).create(task))
     
     # 如果启用，添加到调度器
     if task.enabled:
@@ -127,11 +122,10 @@ async def create_task(req: TaskCreate, session: Session = Depends(get_session)):
 async def update_task(
     task_id: int, 
     req: TaskUpdate, 
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """更新定时任务"""
-    repo = ScheduledTaskRepository(session)
-    task = repo.get_by_id(task_id)
+    task = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_by_id(task_id))
     
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -147,7 +141,7 @@ async def update_task(
     
     if will_be_bettercap == "bettercap" and will_be_enabled:
         # 检查是否已有其他启用的 Bettercap 任务
-        existing_tasks = repo.get_all()
+        existing_tasks = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_all())
         for t in existing_tasks:
             if t.id != task_id and t.scan_tool == "bettercap" and t.enabled:
                 raise HTTPException(
@@ -171,7 +165,7 @@ async def update_task(
     if req.enabled is not None:
         task.enabled = req.enabled
     
-    repo.update(task)
+    await session.run_sync(lambda s: ScheduledTaskRepository(s).update(task))
     
     # 重新加载调度
     reload_task(task_id)
@@ -180,34 +174,31 @@ async def update_task(
 
 
 @router.delete("/{task_id}")
-async def delete_task(task_id: int, session: Session = Depends(get_session)):
+async def delete_task(task_id: int, session: AsyncSession = Depends(get_async_session)):
     """删除定时任务"""
-    repo = ScheduledTaskRepository(session)
-    
-    if not repo.get_by_id(task_id):
+    if not await session.run_sync(lambda s: ScheduledTaskRepository(s).get_by_id(task_id)):
         raise HTTPException(status_code=404, detail="Task not found")
     
-    # 从调度器中移除
-    remove_task(task_id)
+    # 从调度器中移除，并释放任务日志
+    remove_task(task_id, drop_logs=True)
     
     # 删除任务
-    repo.delete(task_id)
+    await session.run_sync(lambda s: ScheduledTaskRepository(s).delete(task_id))
     
     return {"success": True}
 
 
 @router.post("/{task_id}/toggle")
-async def toggle_task(task_id: int, session: Session = Depends(get_session)):
+async def toggle_task(task_id: int, session: AsyncSession = Depends(get_async_session)):
     """启用/禁用任务"""
-    repo = ScheduledTaskRepository(session)
-    task = repo.get_by_id(task_id)
+    task = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_by_id(task_id))
     
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
     # 如果要启用 Bettercap 任务，检查唯一性
     if not task.enabled and task.scan_tool == "bettercap":
-        existing_tasks = repo.get_all()
+        existing_tasks = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_all())
         for t in existing_tasks:
             if t.id != task_id and t.scan_tool == "bettercap" and t.enabled:
                 raise HTTPException(
@@ -217,7 +208,7 @@ async def toggle_task(task_id: int, session: Session = Depends(get_session)):
     
     # 切换状态
     task.enabled = not task.enabled
-    repo.update(task)
+    await session.run_sync(lambda s: ScheduledTaskRepository(s).update(task))
     
     # 重新加载调度
     reload_task(task_id)
@@ -226,10 +217,9 @@ async def toggle_task(task_id: int, session: Session = Depends(get_session)):
 
 
 @router.post("/{task_id}/trigger")
-async def trigger_task(task_id: int, session: Session = Depends(get_session)):
+async def trigger_task(task_id: int, session: AsyncSession = Depends(get_async_session)):
     """手动触发任务执行"""
-    repo = ScheduledTaskRepository(session)
-    task = repo.get_by_id(task_id)
+    task = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_by_id(task_id))
     
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -244,18 +234,18 @@ async def trigger_task(task_id: int, session: Session = Depends(get_session)):
 async def get_task_executions(
     task_id: int, 
     limit: int = 50,
-    session: Session = Depends(get_session)
+    cursor: Optional[int] = None,
+    session: AsyncSession = Depends(get_async_session)
 ):
-    """获取任务执行历史"""
+    """获取任务执行历史（Bettercap 任务可传入上次返回的 next_cursor，只获取新增日志）"""
     # 验证任务是否存在
-    task_repo = ScheduledTaskRepository(session)
-    task = task_repo.get_by_id(task_id)
+    task = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_by_id(task_id))
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
     # 如果是 Bettercap 任务，返回友好格式的实时日志（作为"历史"）
     if task.scan_tool == "bettercap":
-        logs = get_bettercap_task_logs(task_id, log_type="friendly")
+        logs = await asyncio.to_thread(get_bettercap_task_logs, task_id, log_type="friendly", cursor=cursor)
         status = get_scheduler_status()
         is_running = task_id in status.get("bettercap_tasks", [])
         
@@ -271,13 +261,14 @@ async def get_task_executions(
             "new_count": 0,
             "error_message": None,
             "duration": None,
-            "logs": logs,  # 添加友好格式的日志
+            "logs": logs.lines,  # 添加友好格式的日志
+            "next_cursor": logs.next_cursor,
+            "truncated": logs.truncated,
             "scan_tool": "bettercap"
         }]
     
     # Nmap 任务：获取执行历史
-    exec_repo = TaskExecutionRepository(session)
-    executions = exec_repo.get_by_task_id(task_id, limit)
+    executions = await session.run_sync(lambda s: TaskExecutionRepository(s).get_by_task_id(task_id, limit))
     
     return [
         {
@@ -303,18 +294,24 @@ async def get_task_executions(
 @router.get("/{task_id}/logs")
 async def get_task_logs(
     task_id: int,
-    session: Session = Depends(get_session)
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    session: AsyncSession = Depends(get_async_session)
 ):
-    """获取任务日志（Bettercap 持续监控日志或 Nmap 最后一次执行日志）"""
+    """
+    获取任务日志（Bettercap 持续监控日志或 Nmap 最后一次执行日志）
+    
+    Bettercap 任务按游标增量读取：传入上次返回的 next_cursor 只返回之后的新日志，
+    truncated 为 true 表示游标之后有日志已被淘汰
+    """
     # 验证任务是否存在
-    task_repo = ScheduledTaskRepository(session)
-    task = task_repo.get_by_id(task_id)
+    task = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_by_id(task_id))
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
     if task.scan_tool == "bettercap":
         # Bettercap 任务：返回持续监控的实时日志
-        logs = get_bettercap_task_logs(task_id)
+        logs = await asyncio.to_thread(get_bettercap_task_logs, task_id, cursor=cursor, limit=limit)
         status = get_scheduler_status()
         is_running = task_id in status.get("bettercap_tasks", [])
         return {
@@ -322,13 +319,16 @@ async def get_task_logs(
             "task_name": task.name,
             "scan_tool": "bettercap",
             "log_type": "continuous",
-            "logs": logs,
+            "logs": logs.lines,
+            "next_cursor": logs.next_cursor,
+            "truncated": logs.truncated,
             "is_running": is_running
         }
     else:
         # Nmap 任务：返回最后一次执行记录的输出
-        exec_repo = TaskExecutionRepository(session)
-        executions = exec_repo.get_by_task_id(task_id, limit=1)
+        executions = await session.run_sync(
+            lambda s: TaskExecutionRepository(s).get_by_task_id(task_id, limit=1)
+        )
         
         if not executions:
             return {
@@ -382,14 +382,13 @@ async def get_task_logs(
 
 
 @router.get("/{task_id}/bettercap-status")
-async def get_bettercap_task_status(task_id: int, session: Session = Depends(get_session)):
+async def get_bettercap_task_status(task_id: int, session: AsyncSession = Depends(get_async_session)):
     """获取 Bettercap 任务的实际运行状态（从 Bettercap API 读取）"""
     import httpx
-    from app.repositories.app_config_repo import AppConfigRepository
+    from app.services.bettercap_service import BettercapClientManager
     
     # 获取任务信息
-    task_repo = ScheduledTaskRepository(session)
-    task = task_repo.get_by_id(task_id)
+    task = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_by_id(task_id))
     
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
@@ -398,10 +397,9 @@ async def get_bettercap_task_status(task_id: int, session: Session = Depends(get
         raise HTTPException(status_code=400, detail="只支持 Bettercap 任务")
     
     # 获取 Bettercap 配置
-    config_repo = AppConfigRepository(session)
-    config = config_repo.get_by_key("bettercap_config")
+    config_dict = await ConfigCache.aget_json("bettercap_config")
     
-    if not config:
+    if not config_dict:
         # 配置不存在时返回错误状态
         return {
             "task_id": task_id,
@@ -412,78 +410,69 @@ async def get_bettercap_task_status(task_id: int, session: Session = Depends(get
             "error": "Bettercap 未配置，请先在设置页面配置"
         }
     
-    config_dict = json.loads(config.value)
-    # 使用scan_url（扫描实例），向后兼容url字段
-    bettercap_url = config_dict.get('scan_url', config_dict.get('url', 'http://127.0.0.1:8081'))
-    username = config_dict.get('username', 'user')
-    password = config_dict.get('password', 'pass')
-    
-    # 查询 Bettercap 实际运行状态
+    # 查询 Bettercap 实际运行状态（复用扫描实例客户端的连接池）
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(
-                f"{bettercap_url}/api/session",
-                auth=(username, password)
-            )
-            
-            if response.status_code != 200:
-                return {
-                    "task_id": task_id,
-                    "task_enabled": task.enabled,
-                    "bettercap_connected": False,
-                    "probe_mode": None,
-                    "error": f"Bettercap API 返回错误: {response.status_code}"
-                }
-            
-            session_data = response.json()
-            modules = session_data.get('modules', [])
-            
-            # 检查哪些模块在运行
-            probe_running = False
-            recon_running = False
-            
-            for module in modules:
-                if isinstance(module, dict):
-                    name = module.get('name', '')
-                    running = module.get('running', False)
-                    
-                    if name == 'net.probe' and running:
-                        probe_running = True
-                    elif name == 'net.recon' and running:
-                        recon_running = True
-            
-            # 判断模式
-            if probe_running and recon_running:
-                actual_mode = 'active'
-                mode_display = '主动探测'
-            elif recon_running and not probe_running:
-                actual_mode = 'passive'
-                mode_display = '被动侦察'
-            elif not recon_running and not probe_running:
-                actual_mode = None
-                mode_display = '未运行'
-            else:
-                actual_mode = 'unknown'
-                mode_display = '未知状态'
-            
-            # 获取探测参数
-            env = session_data.get('env', {})
-            probe_throttle = env.get('net.probe.throttle', None)
-            
+        client = await BettercapClientManager.get_scan_client()
+        response = await client.request("GET", "/api/session", timeout=5.0)
+        
+        if response.status_code != 200:
             return {
                 "task_id": task_id,
                 "task_enabled": task.enabled,
-                "bettercap_connected": True,
-                "probe_mode": actual_mode,
-                "mode_display": mode_display,
-                "modules": {
-                    "net_probe": probe_running,
-                    "net_recon": recon_running
-                },
-                "probe_throttle": probe_throttle,
-                "configured_mode": config_dict.get('probe_mode', 'active')
+                "bettercap_connected": False,
+                "probe_mode": None,
+                "error": f"Bettercap API 返回错误: {response.status_code}"
             }
-            
+        
+        session_data = response.json()
+        modules = session_data.get('modules', [])
+        
+        # 检查哪些模块在运行
+        probe_running = False
+        recon_running = False
+        
+        for module in modules:
+            if isinstance(module, dict):
+                name = module.get('name', '')
+                running = module.get('running', False)
+                
+                if name == 'net.probe' and running:
+                    probe_running = True
+                elif name == 'net.recon' and running:
+                    recon_running = True
+        
+        # 判断模式
+        if probe_running and recon_running:
+            actual_mode = 'active'
+            mode_display = '主动探测'
+        elif recon_running and not probe_running:
+            actual_mode = 'passive'
+            mode_display = '被动侦察'
+        elif not recon_running and not probe_running:
+            actual_mode = None
+            mode_display = '未运行'
+        else:
+            actual_mode = 'unknown'
+            mode_display = '未知状态'
+        
+        # 获取探测参数
+        env = session_data.get('env', {})
+        probe_throttle = env.get('net.probe.throttle', None)
+        
+        return {
+            "task_id": task_id,
+            "task_enabled": task.enabled,
+            "bettercap_connected": True,
+            "probe_mode": actual_mode,
+            "mode_display": mode_display,
+            "modules": {
+                "net_probe": probe_running,
+                "net_recon": recon_running
+            },
+            "probe_throttle": probe_throttle,
+            "configured_mode": config_dict.get('probe_mode', 'active')
+        }
+        
     except httpx.TimeoutException:
         return {
             "task_id": task_id,
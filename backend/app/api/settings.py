@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
-from sqlmodel import Session
-from app.models.db import engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models.db import async_engine
 from app.repositories.app_config_repo import AppConfigRepository
+from app.services.config_cache import ConfigCache
 from pydantic import BaseModel
 import json
 
@@ -33,19 +34,16 @@ def get_bettercap_config():
         "probe_mode": "active"
     }
     
-    with Session(engine) as session:
-        repo = AppConfigRepository(session)
-        config = repo.get_by_key("bettercap_config")
-        if config:
-            saved_config = json.loads(config.value)
-            # 合并配置，确保新字段有默认值
-            merged_config = {**default_config, **saved_config}
-            # 确保url字段与scan_url保持同步（向后兼容）
-            if "scan_url" in merged_config:
-                merged_config["url"] = merged_config["scan_url"]
-            return merged_config
-        # 返回默认配置
-        return default_config
+    saved_config = ConfigCache.get_json("bettercap_config")
+    if saved_config:
+        # 合并配置，确保新字段有默认值
+        merged_config = {**default_config, **saved_config}
+        # 确保url字段与scan_url保持同步（向后兼容）
+        if "scan_url" in merged_config:
+            merged_config["url"] = merged_config["scan_url"]
+        return merged_config
+    # 返回默认配置
+    return default_config
 
 
 @router.post("/bettercap")
@@ -63,17 +61,19 @@ async def save_bettercap_config(config: BettercapConfig):
     
     logger = logging.getLogger(__name__)
     
-    with Session(engine) as session:
-        repo = AppConfigRepository(session)
-        repo.upsert(
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        await session.run_sync(lambda s: AppConfigRepository(s).upsert(
             "bettercap_config",
             json.dumps(config.dict()),
             "Bettercap REST API 配置"
-        )
+        ))
+        
+        # 关闭旧配置的客户端连接池，下次使用时按新配置创建
+        from app.services.bettercap_service import BettercapClientManager
+        await BettercapClientManager.invalidate()
         
         # 查找所有启用的 Bettercap 任务
-        task_repo = ScheduledTaskRepository(session)
-        all_tasks = task_repo.get_all()
+        all_tasks = await session.run_sync(lambda s: ScheduledTaskRepository(s).get_all())
         bettercap_tasks = [t for t in all_tasks if t.scan_tool == 'bettercap' and t.enabled]
         
         if bettercap_tasks:
@@ -109,13 +109,12 @@ async def save_bettercap_config(config: BettercapConfig):
             
             if restarted_tasks:
                 # 记录系统事件日志
-                event_repo = SystemEventLogRepository(session)
-                event_repo.create(
+                await session.run_sync(lambda s: SystemEventLogRepository(s).create(
                     event_type="bettercap_config_restart",
                     message=f"Bettercap配置更新，重启了{len(restarted_tasks)}个任务",
                     details=json.dumps({"restarted_tasks": restarted_tasks, "task_count": len(restarted_tasks)}),
                     severity="info"
-                )
+                ))
                 return {
                     "message": "配置已保存并重启任务",
                     "restarted_tasks": restarted_tasks,
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import Session
+
+from app.models.db import get_session
+from app.repositories.network_stats_repo import NetworkStatsRepository
+from app.services.stats_rollup_service import GRANULARITIES
+
+
+router = APIRouter(prefix="/api/stats", tags=["stats"])
+
+# 各粒度的默认查询时间窗
+DEFAULT_WINDOWS = {
+    "minute": timedelta(hours=6),
+    "hour": timedelta(days=7),
+    "day": timedelta(days=90),
+}
+
+
+@router.get("/timeseries")
+def get_timeseries(
+    granularity: str = "hour",
+    subnet: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    session: Session = Depends(get_session)
+):
+    """
+    获取网段活动时间序列（在线数、新设备数、离线次数）
+
+    数据来自扫描时增量维护的预聚合时间桶，不会在请求时重新统计设备表。
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity 必须是 {', '.join(GRANULARITIES)} 之一")
+
+    end = end or datetime.now()
+    start = start or end - DEFAULT_WINDOWS[granularity]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start 必须早于 end")
+
+    buckets = NetworkStatsRepository(session).get_series(granularity, start, end, subnet)
+
+    series = {}
+    for b in buckets:
+        series.setdefault(b.subnet, []).append({
+            "t": b.bucket_start,
+            "online": b.online_count,
+            "new": b.new_count,
+            "offline": b.offline_count
+        })
+
+    return {
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "series": [{"subnet": k, "points": v} for k, v in series.items()]
+    }
+
+
+@router.get("/db-writer")
+def get_db_writer_stats():
+    """数据库写线程状态：已执行任务数、批次数、失败数、最大批量和当前排队数"""
+    from app.services.db_writer import DbWriter
+    return DbWriter.get_stats()
+
+
+@router.get("/device-cache")
+def get_device_cache_stats():
+    """进程内设备缓存状态：命中/未命中/负缓存命中次数、加载和失效次数、当前条目数"""
+    from app.services.device_cache import DeviceCache
+    return DeviceCache.get_stats()
+
+
+@router.get("/ingest")
+def get_ingest_stats():
+    """Bettercap 设备事件写入缓冲状态：队列深度、合并数、批次大小和写入延迟，以及写线程状态"""
+    from app.services.db_writer import DbWriter
+    from app.services.endpoint_event_buffer import EndpointEventBuffer
+    return {
+        "endpoint_events": EndpointEventBuffer.get_stats(),
+        "db_writer": DbWriter.get_stats()
+    }
+
+
+@router.get("/config-cache")
+def get_config_cache_stats():
+    """进程内配置缓存状态：命中/未命中/加载/失效次数、各配置键的版本号"""
+    from app.services.config_cache import ConfigCache
+    return ConfigCache.get_stats()
+
+
+@router.get("/task-logs")
+def get_task_log_stats():
+    """持续任务日志存储状态：缓冲数、内存中的总行数、淘汰/落盘/恢复的行数和文件轮转次数"""
+    from app.services.task_log_store import TaskLogStore
+    return TaskLogStore.get_stats()
+
+
+@router.get("/retention")
+def get_retention_report():
+    """最近一次数据保留任务的报告：各表删除/压缩的行数和回收的字节数"""
+    from app.services.retention_service import get_last_report
+    return get_last_report() or {"message": "数据保留任务尚未执行"}
+
+
+@router.post("/retention/run")
+def run_retention_now():
+    """立即执行一次数据保留任务（同步执行，返回报告）"""
+    from app.services.retention_service import run_retention
+    return run_retention()
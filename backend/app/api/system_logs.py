@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Optional
-from app.models.db import get_session
+from app.models.db import get_async_session
 from app.repositories.system_event_log_repo import SystemEventLogRepository
 
 router = APIRouter(prefix="/system-logs", tags=["系统日志"])
@@ -13,16 +13,15 @@ async def get_system_logs(
     days: int = 30,
     event_type: Optional[str] = None,
     severity: Optional[str] = None,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """获取系统事件日志"""
-    repo = SystemEventLogRepository(session)
-    logs = repo.get_recent(
+    logs = await session.run_sync(lambda s: SystemEventLogRepository(s).get_recent(
         limit=limit,
         days=days,
         event_type=event_type,
         severity=severity
-    )
+    ))
     
     return {
         "logs": logs,
@@ -35,11 +34,10 @@ async def get_system_logs(
 @router.get("/stats")
 async def get_system_logs_stats(
     days: int = 30,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """获取日志统计信息"""
-    repo = SystemEventLogRepository(session)
-    stats = repo.get_stats(days=days)
+    stats = await session.run_sync(lambda s: SystemEventLogRepository(s).get_stats(days=days))
     return stats
 
 
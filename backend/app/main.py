@@ -11,6 +11,8 @@ from app.api.auth import router as auth_router
 from app.models.db import init_db
 from app.services.scheduler_service import start_scheduler, stop_scheduler
 from app.api.ip_requests import router as ip_requests_router
+from app.api.presence import router as presence_router
+from app.api.stats import router as stats_router
 
 # 配置日志
 logging.basicConfig(
@@ -87,6 +89,8 @@ def create_app() -> FastAPI:
     app.include_router(arp_ban_router, prefix="/api/arp-ban", tags=["网络管控"])
     app.include_router(system_logs_router, prefix="/api")
     app.include_router(ip_requests_router)
+    app.include_router(presence_router)
+    app.include_router(stats_router)
 
     @app.on_event("startup")
     def _on_startup():
@@ -96,9 +100,17 @@ def create_app() -> FastAPI:
         logger.info(f"Process ID: {os.getpid()}")
         logger.info(f"Worker Info: Single worker mode (recommended for state consistency)")
         logger.info("=" * 60)
-        init_db()
+        init_db()  # 包含版本化的表结构/数据迁移
         logger.info("Database initialized")
         
+        # 一次性转换为增量 VACUUM 模式（完整 VACUUM 独占数据库，只在启动时、开始处理请求前执行）
+        from app.services.retention_service import convert_to_incremental_vacuum
+        convert_to_incremental_vacuum()
+        
+        # 启动数据库单写线程（所有后台写入经由它串行、合并提交）
+        from app.services.db_writer import DbWriter
+        DbWriter.start()
+        
         # 初始化默认用户
         from app.utils.auth import init_default_user
         init_default_user()
@@ -111,9 +123,21 @@ def create_app() -> FastAPI:
         logger.info("Scheduler startup completed")
 
     @app.on_event("shutdown")
-    def _on_shutdown():
+    async def _on_shutdown():
         logger.info("Application shutting down...")
         stop_scheduler()
+        # 缓冲中尚未写入的设备上线/离线事件先交给写线程
+        from app.services.endpoint_event_buffer import EndpointEventBuffer
+        EndpointEventBuffer.flush()
+        from app.services.db_writer import DbWriter
+        DbWriter.stop()
+        # 任务日志中尚未落盘的行写入文件
+        from app.services.task_log_store import TaskLogStore
+        TaskLogStore.flush()
+        from app.services.bettercap_service import BettercapClientManager
+        await BettercapClientManager.invalidate()
+        from app.models.db import async_engine
+        await async_engine.dispose()
         logger.info("Shutdown completed")
 
     return app
@@ -1,3 +1,4 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 from datetime import datetime
 from typing import Optional
@@ -6,11 +7,14 @@ from typing import Optional
 class ArpBanLog(SQLModel, table=True):
     """ARP Ban 操作日志"""
     __tablename__ = "arp_ban_log"
+    __table_args__ = (
+        Index("ix_arp_ban_log_action_created", "action", "created_at"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     action: str = Field(description="操作类型: start/stop/add/remove")
     ip: Optional[str] = Field(default=None, description="相关 IP")
     message: str = Field(description="日志信息")
     operator: str = Field(default="admin", description="操作人")
-    created_at: datetime = Field(default_factory=datetime.now, description="创建时间")
+    created_at: datetime = Field(default_factory=datetime.now, index=True, description="创建时间")
 
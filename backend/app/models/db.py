@@ -1,6 +1,9 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 import os
 
 # Import all models to ensure they are registered
@@ -14,6 +17,11 @@ from app.models.arp_ban_log import ArpBanLog
 from app.models.system_event_log import SystemEventLog
 from app.models.user import User
 from app.models.ip_request import IPRequest
+from app.models.device_presence import DevicePresenceSession
+from app.models.network_stats import NetworkStatsBucket
+from app.models.device_tag import DeviceTag
+from app.models.device_address_history import DeviceAddressHistory
+from app.models.schema_version import SchemaVersion
 
 
 DB_URL = os.getenv("DATABASE_URL", "sqlite:///./ip_daemon.db")
@@ -29,9 +37,51 @@ engine = create_engine(
     pool_recycle=3600   # 每小时回收连接
 )
 
+# SQLite 连接参数：WAL 模式下读写互不阻塞，synchronous=NORMAL 在 WAL 下仍能保证崩溃一致性
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))  # 每个连接的页缓存（KB）
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 内存映射读取大小（字节）
+SQLITE_BUSY_TIMEOUT_MS = 30000
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        # 只对新建的数据库生效；已有数据库由保留任务首次运行时转换
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+# 异步引擎：供 async 路由和协程中的后台任务读写数据库，不阻塞事件循环
+# SQLite 默认使用 aiosqlite 驱动，其他数据库需通过 ASYNC_DATABASE_URL 指定异步驱动
+ASYNC_DB_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    DB_URL.replace("sqlite://", "sqlite+aiosqlite://", 1) if DB_URL.startswith("sqlite://") else DB_URL
+)
+async_engine = create_async_engine(
+    ASYNC_DB_URL,
+    echo=False,
+    connect_args={"timeout": 30} if ASYNC_DB_URL.startswith("sqlite") else {},
+    pool_pre_ping=True,
+    pool_recycle=3600
+)
+
+if DB_URL.startswith("sqlite"):
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+if ASYNC_DB_URL.startswith("sqlite"):
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
 
 def init_db() -> None:
     SQLModel.metadata.create_all(engine)
+    # 已有数据库：补齐新增的列和索引，执行尚未应用的迁移
+    from app.models.migrations import run_migrations
+    run_migrations(engine)
 
 
 def get_session() -> Generator[Session, None, None]:
@@ -39,3 +89,14 @@ def get_session() -> Generator[Session, None, None]:
         yield session
 
 
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    异步会话依赖
+
+    查询可直接使用 session.exec()，也可以通过 session.run_sync(lambda s: XxxRepository(s).method())
+    复用现有的同步仓储。expire_on_commit=False：提交后返回的对象仍可直接序列化。
+    """
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
@@ -0,0 +1,20 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Index
+from sqlmodel import SQLModel, Field
+
+
+class DeviceAddressHistory(SQLModel, table=True):
+    """设备地址变更记录（同一 MAC 的设备出现在新 IP 时记录一条）"""
+    __tablename__ = "device_address_history"
+    __table_args__ = (
+        Index("ix_address_history_device_changed", "device_id", "changed_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: int  # 关联的设备ID
+    mac: Optional[str] = Field(default=None, index=True)  # 变更时的 MAC 地址
+    old_ip: str  # 原 IP
+    new_ip: str  # 新 IP
+    changed_at: datetime = Field(default_factory=datetime.now)
@@ -0,0 +1,21 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Index
+from sqlmodel import SQLModel, Field
+
+
+class DevicePresenceSession(SQLModel, table=True):
+    """设备在线区间（一次上线到离线为一个区间，ended_at 为空表示仍在线）"""
+    __tablename__ = "device_presence_sessions"
+    __table_args__ = (
+        Index("ix_presence_device_started", "device_id", "started_at"),
+        Index("ix_presence_source_ended", "source", "ended_at"),
+        Index("ix_presence_started_ended", "started_at", "ended_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: int  # 关联的设备ID
+    source: str  # 检测来源：nmap / bettercap
+    started_at: datetime  # 上线时间
+    ended_at: Optional[datetime] = None  # 离线时间（为空表示仍在线）
@@ -0,0 +1,17 @@
+from typing import Optional
+
+from sqlalchemy import Index
+from sqlmodel import SQLModel, Field
+
+
+class DeviceTag(SQLModel, table=True):
+    """设备标签（规范化存储，用于按标签筛选和统计）"""
+    __tablename__ = "device_tags"
+    __table_args__ = (
+        Index("ix_device_tags_device_tag", "device_id", "tag", unique=True),
+        Index("ix_device_tags_tag_device", "tag", "device_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: int  # 关联的设备ID
+    tag: str  # 标签
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
@@ -12,6 +13,10 @@ class IPRequestStatus:
 
 
 class IPRequest(SQLModel, table=True):
+  __table_args__ = (
+    Index("ix_iprequest_status_created", "status", "created_at"),
+  )
+
   id: Optional[int] = Field(default=None, primary_key=True)
   ip: str = Field(index=True, description="申请的IP地址")
   purpose: str = Field(description="用途")
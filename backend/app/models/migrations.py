@@ -0,0 +1,123 @@
+"""
+数据库迁移
+
+create_all 只会创建缺失的表，已有数据库中的表不会获得后来新增的列和索引。
+这里按版本号顺序执行迁移步骤，已执行的版本记录在 schema_version 表中，每个步骤只执行一次。
+
+新增迁移：在 MIGRATIONS 末尾追加 (版本号, 名称, 函数)，版本号递增，不要修改已发布的步骤。
+"""
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, SQLModel, select, func
+
+from app.models.schema_version import SchemaVersion
+from app.repositories.unit_of_work import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+Migration = Callable[[Session], None]
+
+
+def _add_missing_columns(session: Session) -> None:
+    """为已有的表补齐模型中新增的列（按可空列添加，有标量默认值的回填默认值）"""
+    connection = session.connection()
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present or column.primary_key:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            if column.default is not None and column.default.is_scalar:
+                connection.execute(
+                    table.update().where(column.is_(None)).values({column.name: column.default.arg})
+                )
+            logger.info(f"[Migration] {table.name} 新增列 {column.name}")
+
+
+def _create_missing_indexes(session: Session, table_names: List[str] = None) -> None:
+    """创建模型中声明但数据库中不存在的索引（建索引时即按现有数据构建）"""
+    connection = session.connection()
+    for table in SQLModel.metadata.sorted_tables:
+        if table_names is not None and table.name not in table_names:
+            continue
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    if connection.dialect.name == "sqlite":
+        # 更新统计信息，让查询规划器使用新索引
+        connection.execute(text("ANALYZE"))
+
+
+def _migration_sync_schema(session: Session) -> None:
+    """基线：补齐版本化之前各次改动新增的列和索引"""
+    _add_missing_columns(session)
+    _create_missing_indexes(session)
+
+
+def _migration_hot_query_indexes(session: Session) -> None:
+    """执行记录、扫描任务、ARP Ban 日志、IP 申请的常用查询索引"""
+    _create_missing_indexes(session, ["taskexecution", "scan_tasks", "arp_ban_log", "iprequest"])
+
+
+def _migration_backfill_device_tags(session: Session) -> None:
+    """把 Device.tags 中的 JSON 标签回填到 device_tags 标签表"""
+    from app.repositories.device_tag_repo import DeviceTagRepository
+
+    migrated = DeviceTagRepository(session).backfill_from_json()
+    if migrated:
+        logger.info(f"[Migration] 已回填 {migrated} 条设备标签")
+
+
+def _migration_system_log_stats_index(session: Session) -> None:
+    """系统日志统计的覆盖索引"""
+    _create_missing_indexes(session, ["system_event_logs"])
+
+
+MIGRATIONS: List[Tuple[int, str, Migration]] = [
+    (1, "sync_schema", _migration_sync_schema),
+    (2, "hot_query_indexes", _migration_hot_query_indexes),
+    (3, "backfill_device_tags", _migration_backfill_device_tags),
+    (4, "system_log_stats_index", _migration_system_log_stats_index),
+]
+
+
+def get_schema_version(session: Session) -> int:
+    """当前已执行到的迁移版本（未执行过任何迁移时为 0）"""
+    return session.exec(select(func.max(SchemaVersion.version))).one() or 0
+
+
+def run_migrations(engine: Engine) -> int:
+    """
+    执行所有尚未应用的迁移（启动时调用）
+
+    每个版本在单独的事务中执行并记录到 schema_version，失败时回滚该版本并停止，
+    下次启动时从失败的版本重新执行。
+
+    Returns:
+        执行后的版本号
+    """
+    with Session(engine) as session:
+        current = get_schema_version(session)
+
+    for version, name, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"[Migration] 执行迁移 {version}: {name}")
+        try:
+            with Session(engine) as session:
+                with unit_of_work(session):
+                    migration(session)
+                    session.add(SchemaVersion(version=version, name=name))
+        except Exception as e:
+            logger.error(f"[Migration] 迁移 {version} ({name}) 失败: {e}")
+            break
+        current = version
+
+    return current
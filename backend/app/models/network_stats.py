@@ -0,0 +1,23 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Index
+from sqlmodel import SQLModel, Field
+
+
+class NetworkStatsBucket(SQLModel, table=True):
+    """网段活动统计的预聚合时间桶（分钟/小时/天）"""
+    __tablename__ = "network_stats_buckets"
+    __table_args__ = (
+        Index("ix_stats_granularity_subnet_bucket", "granularity", "subnet", "bucket_start", unique=True),
+        Index("ix_stats_granularity_bucket", "granularity", "bucket_start"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    granularity: str  # minute / hour / day
+    subnet: str  # 网段，如 192.168.1.0/24
+    bucket_start: datetime  # 时间桶起点
+    online_count: int = Field(default=0)  # 桶内观测到的最大在线设备数
+    new_count: int = Field(default=0)  # 新发现设备数
+    offline_count: int = Field(default=0)  # 上线 -> 离线的次数
+    updated_at: datetime = Field(default_factory=datetime.now)
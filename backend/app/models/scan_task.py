@@ -24,7 +24,7 @@ class ScanTask(SQLModel, table=True):
     progress: int = Field(default=0)  # 0-100
     
     # 时间信息
-    created_at: datetime = Field(default_factory=datetime.now)
+    created_at: datetime = Field(default_factory=datetime.now, index=True)
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
     
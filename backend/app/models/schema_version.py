@@ -0,0 +1,12 @@
+from datetime import datetime
+
+from sqlmodel import SQLModel, Field
+
+
+class SchemaVersion(SQLModel, table=True):
+    """已执行的数据库迁移（每个版本一行）"""
+    __tablename__ = "schema_version"
+
+    version: int = Field(primary_key=True)  # 迁移版本号
+    name: str  # 迁移名称
+    applied_at: datetime = Field(default_factory=datetime.now)
@@ -1,3 +1,4 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 from datetime import datetime
 from typing import Optional
@@ -6,6 +7,10 @@ from typing import Optional
 class SystemEventLog(SQLModel, table=True):
     """系统事件日志模型（记录Bettercap重启等系统事件）"""
     __tablename__ = "system_event_logs"
+    __table_args__ = (
+        # 覆盖统计查询（按时间范围过滤后按类型、严重程度分组）
+        Index("ix_system_event_logs_created_type_severity", "created_at", "event_type", "severity"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     event_type: str = Field(index=True)  # 事件类型：bettercap_restart, bettercap_start, scheduler_start等
@@ -1,11 +1,16 @@
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
 class TaskExecution(SQLModel, table=True):
     """定时任务执行记录"""
+    __table_args__ = (
+        Index("ix_task_execution_task_started", "task_id", "started_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     task_id: int = Field(index=True)  # 关联的任务ID
     started_at: datetime = Field(default_factory=datetime.now)  # 开始时间
@@ -2,6 +2,9 @@ from datetime import datetime
 from sqlmodel import Session, select
 from app.models.app_config import AppConfig
 from typing import Optional
+from app.repositories.unit_of_work import commit
+# 注册提交钩子：配置变更提交后失效 ConfigCache 并通知监听器
+import app.services.config_cache  # noqa: F401
 
 
 class AppConfigRepository:
@@ -17,7 +20,7 @@ class AppConfigRepository:
         ).first()
     
     def upsert(self, key: str, value: str, description: str = None) -> AppConfig:
-        """创建或更新配置"""
+        """创建或更新配置（提交后自动失效 ConfigCache 中的该键）"""
         config = self.get_by_key(key)
         if config:
             config.value = value
@@ -33,8 +36,7 @@ class AppConfigRepository:
                 updated_at=datetime.now()
             )
             self.session.add(config)
-        self.session.commit()
-        self.session.refresh(config)
+        commit(self.session, config, flush=True)
         return config
     
     def delete(self, key: str) -> bool:
@@ -42,7 +44,7 @@ class AppConfigRepository:
         config = self.get_by_key(key)
         if config:
             self.session.delete(config)
-            self.session.commit()
+            commit(self.session)
             return True
         return False
 
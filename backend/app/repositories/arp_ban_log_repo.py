@@ -1,6 +1,7 @@
 from sqlmodel import Session, select
 from app.models.arp_ban_log import ArpBanLog
 from typing import List
+from app.repositories.unit_of_work import commit
 
 
 class ArpBanLogRepository:
@@ -12,10 +13,15 @@ class ArpBanLogRepository:
     def create(self, log: ArpBanLog) -> ArpBanLog:
         """创建日志"""
         self.session.add(log)
-        self.session.commit()
-        self.session.refresh(log)
+        commit(self.session, log, flush=True)
         return log
     
+    def create_many(self, logs: List[ArpBanLog]) -> List[ArpBanLog]:
+        """批量创建日志（一次提交）"""
+        self.session.add_all(logs)
+        commit(self.session, *logs, flush=True)
+        return logs
+    
     def get_recent(self, limit: int = 100) -> List[ArpBanLog]:
         """获取最近的日志"""
         return list(
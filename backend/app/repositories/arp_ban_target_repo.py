@@ -1,6 +1,10 @@
-from sqlmodel import Session, select
+from sqlmodel import Session, select, delete
 from app.models.arp_ban_target import ArpBanTarget
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional
+from app.repositories.unit_of_work import commit
+
+# IN 查询每批的参数个数（低于 SQLite 的变量数上限）
+_IN_CHUNK_SIZE = 500
 
 
 class ArpBanTargetRepository:
@@ -23,18 +27,32 @@ class ArpBanTargetRepository:
             select(ArpBanTarget).where(ArpBanTarget.ip == ip)
         ).first()
     
+    def get_by_ips(self, ips: Iterable[str]) -> Dict[str, ArpBanTarget]:
+        """批量按 IP 获取目标（ip -> 目标）"""
+        ip_list = list(set(ips))
+        result: Dict[str, ArpBanTarget] = {}
+        for i in range(0, len(ip_list), _IN_CHUNK_SIZE):
+            chunk = ip_list[i:i + _IN_CHUNK_SIZE]
+            for t in self.session.exec(select(ArpBanTarget).where(ArpBanTarget.ip.in_(chunk))):
+                result[t.ip] = t
+        return result
+    
     def create(self, target: ArpBanTarget) -> ArpBanTarget:
         """创建目标"""
         self.session.add(target)
-        self.session.commit()
-        self.session.refresh(target)
+        commit(self.session, target, flush=True)
         return target
     
+    def create_many(self, targets: List[ArpBanTarget]) -> List[ArpBanTarget]:
+        """批量创建目标（一次提交）"""
+        self.session.add_all(targets)
+        commit(self.session, *targets, flush=True)
+        return targets
+    
     def update(self, target: ArpBanTarget) -> ArpBanTarget:
         """更新目标"""
         self.session.add(target)
-        self.session.commit()
-        self.session.refresh(target)
+        commit(self.session, target)
         return target
     
     def delete(self, target_id: int) -> bool:
@@ -42,7 +60,7 @@ class ArpBanTargetRepository:
         target = self.session.get(ArpBanTarget, target_id)
         if target:
             self.session.delete(target)
-            self.session.commit()
+            commit(self.session)
             return True
         return False
     
@@ -51,7 +69,16 @@ class ArpBanTargetRepository:
         target = self.get_by_ip(ip)
         if target:
             self.session.delete(target)
-            self.session.commit()
+            commit(self.session)
             return True
         return False
-
+    
+    def delete_by_ips(self, ips: Iterable[str]) -> int:
+        """根据 IP 批量删除目标，返回删除数量"""
+        ip_list = list(set(ips))
+        deleted = 0
+        for i in range(0, len(ip_list), _IN_CHUNK_SIZE):
+            chunk = ip_list[i:i + _IN_CHUNK_SIZE]
+            deleted += self.session.exec(delete(ArpBanTarget).where(ArpBanTarget.ip.in_(chunk))).rowcount
+        commit(self.session)
+        return deleted
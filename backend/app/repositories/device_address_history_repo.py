@@ -0,0 +1,49 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlmodel import Session, select, update
+
+from app.models.device_address_history import DeviceAddressHistory
+
+
+class DeviceAddressHistoryRepository:
+    """设备地址变更记录仓储（写入不提交，与设备变更一起由调用方提交）"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def add(
+        self,
+        device_id: int,
+        mac: Optional[str],
+        old_ip: str,
+        new_ip: str,
+        changed_at: datetime
+    ) -> DeviceAddressHistory:
+        record = DeviceAddressHistory(
+            device_id=device_id,
+            mac=mac,
+            old_ip=old_ip,
+            new_ip=new_ip,
+            changed_at=changed_at
+        )
+        self.session.add(record)
+        return record
+
+    def list_for_device(self, device_id: int, limit: int = 100) -> List[DeviceAddressHistory]:
+        """设备的地址变更记录，最新的在前"""
+        statement = (
+            select(DeviceAddressHistory)
+            .where(DeviceAddressHistory.device_id == device_id)
+            .order_by(DeviceAddressHistory.changed_at.desc())
+            .limit(limit)
+        )
+        return list(self.session.exec(statement))
+
+    def reassign_device(self, from_device_id: int, to_device_id: int) -> None:
+        """合并设备时把记录转移到保留的设备上"""
+        self.session.exec(
+            update(DeviceAddressHistory)
+            .where(DeviceAddressHistory.device_id == from_device_id)
+            .values(device_id=to_device_id)
+        )
@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlmodel import Session, select, update
+
+from app.models.device_presence import DevicePresenceSession
+
+
+class DevicePresenceRepository:
+    """设备在线区间仓储
+
+    open/close 只把变更加入会话，由调用方（设备更新）统一提交。
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def get_open_sessions(
+        self,
+        source: str,
+        device_ids: Optional[Iterable[int]] = None
+    ) -> Dict[int, DevicePresenceSession]:
+        """获取指定来源下仍未结束的区间（device_id -> 区间）"""
+        statement = select(DevicePresenceSession).where(
+            DevicePresenceSession.source == source,
+            DevicePresenceSession.ended_at.is_(None)
+        )
+        if device_ids is not None:
+            ids = list(device_ids)
+            if not ids:
+                return {}
+            statement = statement.where(DevicePresenceSession.device_id.in_(ids))
+        return {s.device_id: s for s in self.session.exec(statement)}
+
+    def open(self, device_id: int, source: str, started_at: datetime) -> DevicePresenceSession:
+        """开始一个新的在线区间"""
+        presence = DevicePresenceSession(device_id=device_id, source=source, started_at=started_at)
+        self.session.add(presence)
+        return presence
+
+    def close(self, presence: DevicePresenceSession, ended_at: datetime) -> DevicePresenceSession:
+        """结束在线区间"""
+        presence.ended_at = ended_at
+        self.session.add(presence)
+        return presence
+
+    def reassign_device(self, from_device_id: int, to_device_id: int, ended_at: datetime) -> None:
+        """合并设备时把区间转移到保留的设备上（被合并设备未结束的区间先以 ended_at 收尾）"""
+        self.session.exec(
+            update(DevicePresenceSession)
+            .where(
+                DevicePresenceSession.device_id == from_device_id,
+                DevicePresenceSession.ended_at.is_(None)
+            )
+            .values(ended_at=ended_at)
+        )
+        self.session.exec(
+            update(DevicePresenceSession)
+            .where(DevicePresenceSession.device_id == from_device_id)
+            .values(device_id=to_device_id)
+        )
+
+    def get_overlapping(
+        self,
+        start: datetime,
+        end: datetime,
+        device_id: Optional[int] = None,
+        source: Optional[str] = None
+    ) -> List[DevicePresenceSession]:
+        """获取与 [start, end) 时间窗有交集的区间"""
+        statement = select(DevicePresenceSession).where(
+            DevicePresenceSession.started_at < end,
+            (DevicePresenceSession.ended_at.is_(None)) | (DevicePresenceSession.ended_at > start)
+        )
+        if device_id is not None:
+            statement = statement.where(DevicePresenceSession.device_id == device_id)
+        if source:
+            statement = statement.where(DevicePresenceSession.source == source)
+        statement = statement.order_by(DevicePresenceSession.device_id, DevicePresenceSession.started_at)
+        return list(self.session.exec(statement))
+
+    def get_online_device_ids(self, at: datetime, source: Optional[str] = None) -> List[int]:
+        """获取时间点 at 在线的设备ID列表"""
+        statement = select(DevicePresenceSession.device_id).where(
+            DevicePresenceSession.started_at <= at,
+            (DevicePresenceSession.ended_at.is_(None)) | (DevicePresenceSession.ended_at > at)
+        )
+        if source:
+            statement = statement.where(DevicePresenceSession.source == source)
+        return sorted(set(self.session.exec(statement.distinct())))
@@ -1,16 +1,28 @@
-from typing import List, Optional
+import ipaddress
+from typing import Dict, Iterable, List, Optional
 
+from sqlalchemy import and_, not_, or_
 from sqlmodel import select
 from sqlmodel import Session
 
 from app.models.device import Device
+from app.repositories.device_tag_repo import DeviceTagRepository
+from app.repositories.unit_of_work import commit
+
+# IN 查询每批的参数个数（低于 SQLite 的变量数上限）
+_IN_CHUNK_SIZE = 500
 
 
 class DeviceRepository:
     def __init__(self, session: Session):
         self.session = session
 
-    def list(self, keyword: Optional[str] = None) -> List[Device]:
+    def list(
+        self,
+        keyword: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        match_all_tags: bool = False
+    ) -> List[Device]:
         statement = select(Device)
         if keyword:
             like = f"%{keyword}%"
@@ -19,29 +31,123 @@ class DeviceRepository:
                 | (Device.hostname.like(like))
                 | (Device.mac.like(like))
             )
+        if tags:
+            tag_ids = DeviceTagRepository(self.session).device_ids_query(tags, match_all_tags)
+            statement = statement.where(Device.id.in_(tag_ids))
         return list(self.session.exec(statement))
 
+    def find(
+        self,
+        keyword: Optional[str] = None,
+        ips: Optional[List[str]] = None,
+        vendor: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        cidr: Optional[str] = None,
+        online: Optional[bool] = None
+    ) -> List[Device]:
+        """
+        按 IP 列表、关键字、厂商、标签、网段和在线状态组合筛选设备
+
+        online 为综合在线状态（任一扫描工具在线即为在线）。CIDR 无效时抛出 ValueError。
+        """
+        network = ipaddress.ip_network(cidr, strict=False) if cidr else None
+        statement = select(Device)
+        if keyword:
+            like = f"%{keyword}%"
+            statement = statement.where(
+                (Device.ip.like(like))
+                | (Device.hostname.like(like))
+                | (Device.mac.like(like))
+            )
+        if vendor:
+            statement = statement.where(Device.vendor.like(f"%{vendor}%"))
+        if tags:
+            statement = statement.where(Device.id.in_(DeviceTagRepository(self.session).device_ids_query(tags)))
+        if online is not None:
+            is_online = or_(
+                and_(Device.nmap_last_seen.is_not(None), Device.nmap_offline_at.is_(None)),
+                and_(Device.bettercap_last_seen.is_not(None), Device.bettercap_offline_at.is_(None))
+            )
+            statement = statement.where(is_online if online else not_(is_online))
+
+        if ips is None:
+            devices = list(self.session.exec(statement))
+        else:
+            ip_list = list(set(ips))
+            devices = []
+            for i in range(0, len(ip_list), _IN_CHUNK_SIZE):
+                chunk = ip_list[i:i + _IN_CHUNK_SIZE]
+                devices.extend(self.session.exec(statement.where(Device.ip.in_(chunk))))
+
+        if network is not None:
+            devices = [d for d in devices if _ip_in_network(d.ip, network)]
+        return devices
+
     def get(self, device_id: int) -> Optional[Device]:
         return self.session.get(Device, device_id)
 
+    def get_many(self, device_ids: Iterable[int]) -> Dict[int, Device]:
+        """批量按 ID 获取设备（id -> 设备）"""
+        ids = list(set(device_ids))
+        result: Dict[int, Device] = {}
+        for i in range(0, len(ids), _IN_CHUNK_SIZE):
+            chunk = ids[i:i + _IN_CHUNK_SIZE]
+            for d in self.session.exec(select(Device).where(Device.id.in_(chunk))):
+                result[d.id] = d
+        return result
+
     def get_by_ip(self, ip: str) -> Optional[Device]:
         statement = select(Device).where(Device.ip == ip)
         return self.session.exec(statement).first()
 
+    def get_by_ips(self, ips: Iterable[str]) -> Dict[str, Device]:
+        """批量按 IP 获取设备（ip -> 设备）"""
+        ip_list = list(set(ips))
+        result: Dict[str, Device] = {}
+        for i in range(0, len(ip_list), _IN_CHUNK_SIZE):
+            chunk = ip_list[i:i + _IN_CHUNK_SIZE]
+            for d in self.session.exec(select(Device).where(Device.ip.in_(chunk))):
+                result[d.ip] = d
+        return result
+
+    def get_by_macs(self, macs: Iterable[str]) -> Dict[str, List[Device]]:
+        """批量按 MAC 获取设备（大写 MAC -> 设备列表，同一 MAC 可能对应多条记录）"""
+        mac_list = list({m.upper() for m in macs if m})
+        # 同时匹配大小写两种写法，仍可使用 mac 列上的索引
+        variants = mac_list + [m.lower() for m in mac_list]
+        result: Dict[str, List[Device]] = {}
+        for i in range(0, len(variants), _IN_CHUNK_SIZE):
+            chunk = variants[i:i + _IN_CHUNK_SIZE]
+            for d in self.session.exec(select(Device).where(Device.mac.in_(chunk))):
+                result.setdefault(d.mac.upper(), []).append(d)
+        return result
+
     def create(self, device: Device) -> Device:
         self.session.add(device)
-        self.session.commit()
-        self.session.refresh(device)
+        commit(self.session, device, flush=True)
         return device
 
     def update(self, device: Device) -> Device:
         self.session.add(device)
-        self.session.commit()
-        self.session.refresh(device)
+        commit(self.session, device)
         return device
 
     def delete(self, device: Device) -> None:
         self.session.delete(device)
-        self.session.commit()
+        commit(self.session)
+
+    def add(self, device: Device) -> Device:
+        """加入会话但不提交（批量操作最后统一提交）"""
+        self.session.add(device)
+        return device
+
+    def remove(self, device: Device) -> None:
+        """标记删除但不提交（批量操作最后统一提交）"""
+        self.session.delete(device)
 
 
+def _ip_in_network(ip: str, network) -> bool:
+    try:
+        return ipaddress.ip_address(ip) in network
+    except ValueError:
+        return False
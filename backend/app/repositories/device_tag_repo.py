@@ -0,0 +1,79 @@
+import json
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select, delete
+
+from app.models.device import Device
+from app.models.device_tag import DeviceTag
+from app.repositories.unit_of_work import commit
+
+
+def normalize_tags(tags: Optional[Iterable[str]]) -> List[str]:
+    """去除空白和重复标签，保持原有顺序"""
+    result: List[str] = []
+    for tag in tags or []:
+        tag = str(tag).strip()
+        if tag and tag not in result:
+            result.append(tag)
+    return result
+
+
+class DeviceTagRepository:
+    """设备标签仓储（写入不提交，与设备变更一起由调用方提交）"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def set_tags(self, device_id: int, tags: Optional[Iterable[str]]) -> None:
+        """用给定标签替换设备的全部标签"""
+        self.session.exec(delete(DeviceTag).where(DeviceTag.device_id == device_id))
+        for tag in normalize_tags(tags):
+            self.session.add(DeviceTag(device_id=device_id, tag=tag))
+
+    def delete_for_device(self, device_id: int) -> None:
+        self.session.exec(delete(DeviceTag).where(DeviceTag.device_id == device_id))
+
+    def device_ids_query(self, tags: List[str], match_all: bool = False):
+        """返回带有指定标签的设备ID子查询（match_all 为 True 时需同时带有全部标签）"""
+        tags = normalize_tags(tags)
+        statement = select(DeviceTag.device_id).where(DeviceTag.tag.in_(tags))
+        if match_all and len(tags) > 1:
+            statement = statement.group_by(DeviceTag.device_id).having(
+                func.count(DeviceTag.tag) == len(tags)
+            )
+        return statement
+
+    def counts(self) -> List[Tuple[str, int]]:
+        """每个标签的设备数量，按数量降序"""
+        statement = (
+            select(DeviceTag.tag, func.count(DeviceTag.device_id))
+            .group_by(DeviceTag.tag)
+            .order_by(func.count(DeviceTag.device_id).desc(), DeviceTag.tag)
+        )
+        return [(tag, count) for tag, count in self.session.exec(statement)]
+
+    def backfill_from_json(self) -> int:
+        """
+        把 Device.tags 中的 JSON 标签迁移到标签表（仅在标签表为空时执行）
+
+        Returns:
+            迁移的标签行数
+        """
+        if self.session.exec(select(DeviceTag.id).limit(1)).first() is not None:
+            return 0
+
+        migrated = 0
+        statement = select(Device.id, Device.tags).where(Device.tags.is_not(None))
+        for device_id, tags_json in self.session.exec(statement).all():
+            try:
+                tags = json.loads(tags_json) if tags_json else []
+            except ValueError:
+                continue
+            if not isinstance(tags, list):
+                continue
+            for tag in normalize_tags(tags):
+                self.session.add(DeviceTag(device_id=device_id, tag=tag))
+                migrated += 1
+        commit(self.session)
+        return migrated
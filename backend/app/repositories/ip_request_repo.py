@@ -3,6 +3,7 @@ from __future__ import annotations
 from typing import List, Optional
 from sqlmodel import Session, select
 from app.models.ip_request import IPRequest
+from app.repositories.unit_of_work import commit
 
 
 class IPRequestRepository:
@@ -11,8 +12,7 @@ class IPRequestRepository:
 
   def create(self, obj: IPRequest) -> IPRequest:
     self.session.add(obj)
-    self.session.commit()
-    self.session.refresh(obj)
+    commit(self.session, obj, flush=True)
     return obj
 
   def list(self, status: Optional[str] = None) -> List[IPRequest]:
@@ -28,8 +28,7 @@ class IPRequestRepository:
   def update(self, obj: IPRequest) -> IPRequest:
     obj.mark_updated()
     self.session.add(obj)
-    self.session.commit()
-    self.session.refresh(obj)
+    commit(self.session, obj)
     return obj
 
 
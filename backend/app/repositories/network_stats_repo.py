@@ -0,0 +1,62 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlmodel import Session, select, delete
+
+from app.models.network_stats import NetworkStatsBucket
+
+
+class NetworkStatsRepository:
+    """网段统计时间桶仓储（写入不提交，由调用方统一提交）"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def get_buckets(
+        self,
+        granularity: str,
+        bucket_start: datetime,
+        subnets: Iterable[str]
+    ) -> Dict[str, NetworkStatsBucket]:
+        """获取指定时间桶下多个网段的统计行（subnet -> 行）"""
+        subnets = list(subnets)
+        if not subnets:
+            return {}
+        statement = select(NetworkStatsBucket).where(
+            NetworkStatsBucket.granularity == granularity,
+            NetworkStatsBucket.bucket_start == bucket_start,
+            NetworkStatsBucket.subnet.in_(subnets)
+        )
+        return {b.subnet: b for b in self.session.exec(statement)}
+
+    def add(self, bucket: NetworkStatsBucket) -> NetworkStatsBucket:
+        self.session.add(bucket)
+        return bucket
+
+    def get_series(
+        self,
+        granularity: str,
+        start: datetime,
+        end: datetime,
+        subnet: Optional[str] = None
+    ) -> List[NetworkStatsBucket]:
+        """按时间范围读取统计桶"""
+        statement = select(NetworkStatsBucket).where(
+            NetworkStatsBucket.granularity == granularity,
+            NetworkStatsBucket.bucket_start >= start,
+            NetworkStatsBucket.bucket_start < end
+        )
+        if subnet:
+            statement = statement.where(NetworkStatsBucket.subnet == subnet)
+        statement = statement.order_by(NetworkStatsBucket.subnet, NetworkStatsBucket.bucket_start)
+        return list(self.session.exec(statement))
+
+    def delete_before(self, granularity: str, cutoff: datetime) -> int:
+        """删除早于 cutoff 的统计桶，返回删除数量"""
+        result = self.session.exec(
+            delete(NetworkStatsBucket).where(
+                NetworkStatsBucket.granularity == granularity,
+                NetworkStatsBucket.bucket_start < cutoff
+            )
+        )
+        return result.rowcount or 0
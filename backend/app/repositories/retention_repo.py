@@ -0,0 +1,37 @@
+from typing import Dict, List, Optional
+
+from sqlalchemy import text, update
+from sqlmodel import Session, select, delete
+
+
+class RetentionRepository:
+    """数据保留仓储：按批次删除过期行、清空大字段（不提交，由调用方提交）"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def delete_batch(self, model, conditions: List, batch_size: int) -> int:
+        """删除最多 batch_size 条满足条件的行（集合式 DELETE，不把行加载到 Python），返回删除数量"""
+        ids = select(model.id).where(*conditions).limit(batch_size)
+        result = self.session.exec(delete(model).where(model.id.in_(ids)))
+        return result.rowcount or 0
+
+    def clear_column_batch(self, model, column_name: str, conditions: List, batch_size: int) -> int:
+        """把最多 batch_size 条满足条件的行的 column_name 置空，返回修改数量"""
+        column = getattr(model, column_name)
+        ids = select(model.id).where(column.is_not(None), *conditions).limit(batch_size)
+        result = self.session.exec(
+            update(model).where(model.id.in_(ids)).values({column_name: None})
+        )
+        return result.rowcount or 0
+
+    def get_page_stats(self) -> Optional[Dict[str, int]]:
+        """SQLite 页统计（page_size、page_count、freelist_count、auto_vacuum），其他数据库返回 None"""
+        connection = self.session.connection()
+        if connection.dialect.name != "sqlite":
+            return None
+        return {
+            name: connection.execute(text(f"PRAGMA {name}")).scalar()
+            for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+        }
+
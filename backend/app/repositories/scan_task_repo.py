@@ -1,6 +1,7 @@
 from typing import List, Optional
 from sqlmodel import Session, select
 from app.models.scan_task import ScanTask
+from app.repositories.unit_of_work import commit
 
 
 class ScanTaskRepository:
@@ -10,8 +11,7 @@ class ScanTaskRepository:
     def create(self, task: ScanTask) -> ScanTask:
         """创建新的扫描任务"""
         self.session.add(task)
-        self.session.commit()
-        self.session.refresh(task)
+        commit(self.session, task, flush=True)
         return task
     
     def get_by_task_id(self, task_id: str) -> Optional[ScanTask]:
@@ -27,8 +27,7 @@ class ScanTaskRepository:
     def update(self, task: ScanTask) -> ScanTask:
         """更新任务"""
         self.session.add(task)
-        self.session.commit()
-        self.session.refresh(task)
+        commit(self.session, task)
         return task
     
     def delete(self, task_id: str) -> bool:
@@ -36,7 +35,7 @@ class ScanTaskRepository:
         task = self.get_by_task_id(task_id)
         if task:
             self.session.delete(task)
-            self.session.commit()
+            commit(self.session)
             return True
         return False
 
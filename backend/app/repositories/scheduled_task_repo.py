@@ -3,6 +3,7 @@ from sqlmodel import Session, select
 from datetime import datetime
 
 from app.models.scheduled_task import ScheduledTask
+from app.repositories.unit_of_work import commit
 
 
 class ScheduledTaskRepository:
@@ -26,16 +27,14 @@ class ScheduledTaskRepository:
     def create(self, task: ScheduledTask) -> ScheduledTask:
         """创建任务"""
         self.session.add(task)
-        self.session.commit()
-        self.session.refresh(task)
+        commit(self.session, task, flush=True)
         return task
 
     def update(self, task: ScheduledTask) -> ScheduledTask:
         """更新任务"""
         task.updated_at = datetime.now()
         self.session.add(task)
-        self.session.commit()
-        self.session.refresh(task)
+        commit(self.session, task)
         return task
 
     def delete(self, task_id: int) -> bool:
@@ -43,7 +42,7 @@ class ScheduledTaskRepository:
         task = self.get_by_id(task_id)
         if task:
             self.session.delete(task)
-            self.session.commit()
+            commit(self.session)
             return True
         return False
 
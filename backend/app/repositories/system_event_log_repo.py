@@ -1,7 +1,8 @@
-from sqlmodel import Session, select
+from sqlmodel import Session, select, delete, func
 from app.models.system_event_log import SystemEventLog
 from datetime import datetime, timedelta
 from typing import Optional, List
+from app.repositories.unit_of_work import commit
 
 
 class SystemEventLogRepository:
@@ -27,8 +28,26 @@ class SystemEventLogRepository:
             severity=severity
         )
         self.session.add(log)
-        self.session.commit()
-        self.session.refresh(log)
+        commit(self.session, log, flush=True)
+        return log
+    
+    def add(
+        self,
+        event_type: str,
+        message: str,
+        event_category: str = "system",
+        details: Optional[str] = None,
+        severity: str = "info"
+    ) -> SystemEventLog:
+        """创建系统事件日志，加入会话但不提交（用于写线程批量提交）"""
+        log = SystemEventLog(
+            event_type=event_type,
+            event_category=event_category,
+            message=message,
+            details=details,
+            severity=severity
+        )
+        self.session.add(log)
         return log
     
     def get_recent(
@@ -57,41 +76,32 @@ class SystemEventLogRepository:
         return list(results.all())
     
     def cleanup_old_logs(self, days: int = 30) -> int:
-        """清理指定天数前的旧日志，返回删除的数量"""
+        """清理指定天数前的旧日志，返回删除的数量（定期清理由 retention_service 分批执行）"""
         cutoff_date = datetime.now() - timedelta(days=days)
-        
-        statement = select(SystemEventLog).where(
-            SystemEventLog.created_at < cutoff_date
+        result = self.session.exec(
+            delete(SystemEventLog).where(SystemEventLog.created_at < cutoff_date)
         )
-        
-        old_logs = self.session.exec(statement).all()
-        count = len(old_logs)
-        
-        for log in old_logs:
-            self.session.delete(log)
-        
-        self.session.commit()
-        return count
+        commit(self.session)
+        return result.rowcount or 0
     
     def get_stats(self, days: int = 30) -> dict:
-        """获取日志统计信息"""
+        """获取日志统计信息（在数据库中分组计数，只扫描 (created_at, event_type, severity) 索引）"""
         cutoff_date = datetime.now() - timedelta(days=days)
         
-        statement = select(SystemEventLog).where(
-            SystemEventLog.created_at >= cutoff_date
+        statement = (
+            select(SystemEventLog.event_type, SystemEventLog.severity, func.count())
+            .where(SystemEventLog.created_at >= cutoff_date)
+            .group_by(SystemEventLog.event_type, SystemEventLog.severity)
         )
         
-        all_logs = self.session.exec(statement).all()
-        
-        total = len(all_logs)
+        total = 0
         by_severity = {}
         by_type = {}
         
-        for log in all_logs:
-            # 按严重程度统计
-            by_severity[log.severity] = by_severity.get(log.severity, 0) + 1
-            # 按事件类型统计
-            by_type[log.event_type] = by_type.get(log.event_type, 0) + 1
+        for event_type, severity, count in self.session.exec(statement).all():
+            total += count
+            by_severity[severity] = by_severity.get(severity, 0) + count
+            by_type[event_type] = by_type.get(event_type, 0) + count
         
         return {
             "total": total,
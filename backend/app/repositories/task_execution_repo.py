@@ -3,6 +3,7 @@ from sqlmodel import Session, select
 from datetime import datetime
 
 from app.models.task_execution import TaskExecution
+from app.repositories.unit_of_work import commit
 
 
 class TaskExecutionRepository:
@@ -22,14 +23,12 @@ class TaskExecutionRepository:
     def create(self, execution: TaskExecution) -> TaskExecution:
         """创建执行记录"""
         self.session.add(execution)
-        self.session.commit()
-        self.session.refresh(execution)
+        commit(self.session, execution, flush=True)
         return execution
 
     def update(self, execution: TaskExecution) -> TaskExecution:
         """更新执行记录"""
         self.session.add(execution)
-        self.session.commit()
-        self.session.refresh(execution)
+        commit(self.session, execution)
         return execution
 
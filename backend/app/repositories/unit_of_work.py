@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlmodel import Session
+
+# 记录在 session.info 中的工作单元嵌套层数
+_DEPTH_KEY = "unit_of_work_depth"
+
+
+@contextmanager
+def unit_of_work(session: Session) -> Iterator[Session]:
+    """
+    工作单元：块内仓储的写方法只修改会话、不再逐次 commit/refresh，退出时统一提交一次
+
+    - 块内抛出异常时回滚整个工作单元
+    - 可以嵌套，只有最外层负责提交或回滚
+    - 块内 create 会 flush 以分配主键，其余写操作推迟到提交时执行
+
+    用法:
+        with unit_of_work(session):
+            repo.update(a)
+            repo.create(b)
+    """
+    depth = session.info.get(_DEPTH_KEY, 0)
+    session.info[_DEPTH_KEY] = depth + 1
+    try:
+        yield session
+        if depth == 0:
+            session.commit()
+    except BaseException:
+        if depth == 0:
+            session.rollback()
+        raise
+    finally:
+        session.info[_DEPTH_KEY] = depth
+
+
+def in_unit_of_work(session: Session) -> bool:
+    """会话当前是否处于工作单元中"""
+    return session.info.get(_DEPTH_KEY, 0) > 0
+
+
+def commit(session: Session, *instances, flush: bool = False) -> None:
+    """
+    仓储写方法的提交入口
+
+    不在工作单元中时保持原有行为：立即提交并 refresh 传入的对象；
+    在工作单元中时不提交，flush=True 时刷新到数据库（用于需要主键的 create）。
+    """
+    if in_unit_of_work(session):
+        if flush:
+            session.flush()
+        return
+    session.commit()
+    for instance in instances:
+        session.refresh(instance)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel
 
@@ -48,3 +48,52 @@ class DeviceRead(BaseModel):
         from_attributes = True
 
 
+
+
+class DeviceBulkOperation(BaseModel):
+    """批量操作中的单项操作（按 id 或 ip 定位设备；用于筛选条件时忽略 id/ip）"""
+    action: Literal["update", "add_tags", "remove_tags", "delete"]
+    id: Optional[int] = None
+    ip: Optional[str] = None
+    fields: Optional[DeviceUpdate] = None  # action=update 时使用
+    tags: Optional[List[str]] = None  # action=add_tags/remove_tags 时使用
+
+
+class DeviceBulkFilter(BaseModel):
+    """批量操作的设备筛选条件（多个条件同时生效；不带任何条件时必须显式指定 all=true 才匹配全部设备）"""
+    keyword: Optional[str] = None
+    ips: Optional[List[str]] = None
+    cidr: Optional[str] = None
+    vendor: Optional[str] = None
+    tags: Optional[List[str]] = None  # 带有任一标签
+    online: Optional[bool] = None
+    all: bool = False  # 确认对全部设备操作（仅在没有其他条件时需要）
+
+    def has_criteria(self) -> bool:
+        """是否带有任一筛选条件（空字符串、空列表不算）"""
+        return bool(
+            self.keyword or self.ips is not None or self.cidr or self.vendor or self.tags
+            or self.online is not None
+        )
+
+
+class DeviceBulkRequest(BaseModel):
+    operations: List[DeviceBulkOperation] = []
+    filter: Optional[DeviceBulkFilter] = None
+    apply: Optional[DeviceBulkOperation] = None  # 对筛选出的每台设备执行的操作
+
+
+class DeviceBulkItemResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    ip: Optional[str] = None
+    action: str
+    success: bool
+    error: Optional[str] = None
+
+
+class DeviceBulkResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[DeviceBulkItemResult]
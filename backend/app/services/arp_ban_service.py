@@ -2,20 +2,35 @@ import asyncio
 import logging
 from typing import Optional, List
 from datetime import datetime
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 import httpx
 
-from app.models.db import engine
+from app.models.db import async_engine
 from app.models.arp_ban_target import ArpBanTarget
 from app.models.arp_ban_log import ArpBanLog
 from app.repositories.arp_ban_target_repo import ArpBanTargetRepository
 from app.repositories.arp_ban_log_repo import ArpBanLogRepository
 from app.repositories.app_config_repo import AppConfigRepository
+from app.repositories.unit_of_work import unit_of_work
 from app.services.bettercap_service import BettercapClientManager
+from app.services.config_cache import ConfigCache
+from app.utils.cidr import compress_addresses
 import json
 
 logger = logging.getLogger(__name__)
 
+# 目标同步的合并窗口（秒）：窗口内的多次增删只推送一次
+TARGET_SYNC_DEBOUNCE_SECONDS = 0.5
+# 持续有新变更时，最多推迟这么久也要推送一次（秒）
+TARGET_SYNC_MAX_DELAY_SECONDS = 3.0
+
+# 持久化的期望运行状态（AppConfig 键）：{"running", "whitelist", "updated_at"}
+ARP_BAN_STATE_KEY = "arp_ban_state"
+# 期望状态与 Ban 实例实际状态的对账间隔（秒）
+ARP_BAN_RECONCILE_INTERVAL = 60
+# arp.ban 由 arp.spoof 模块实现，会话 API 中按该模块判断是否在运行
+ARP_SPOOF_MODULE = "arp.spoof"
+
 
 class ArpBanService:
     """ARP Ban 服务管理"""
@@ -23,6 +38,29 @@ class ArpBanService:
     _running: bool = False
     _task: Optional[asyncio.Task] = None
     _current_targets: List[str] = []
+    _whitelist: List[str] = []  # 启动时确定的受保护 IP，推送目标时精确扣除
+    
+    # 目标同步（合并短时间内的多次增删，按差异推送到 Bettercap）
+    _sync_task: Optional[asyncio.Task] = None
+    _sync_dirty: bool = False
+    _sync_state = {
+        "requests": 0,  # 收到的同步请求数
+        "pushes": 0,  # 实际推送到 Bettercap 的次数
+        "skipped": 0,  # 目标未变化而跳过的次数
+        "last_synced_at": None,
+        "last_error": None
+    }
+    
+    # 启动/停止/对账互斥，避免对账看到启动到一半的状态
+    _state_lock = asyncio.Lock()
+    _reconcile_task: Optional[asyncio.Task] = None
+    _reconcile_state = {
+        "checks": 0,
+        "repairs": 0,  # 发现偏差并修复的次数
+        "last_checked_at": None,
+        "last_action": None,
+        "last_error": None
+    }
     
     @classmethod
     def is_running(cls) -> bool:
@@ -34,6 +72,70 @@ class ArpBanService:
         """获取当前目标列表"""
         return cls._current_targets.copy()
     
+    @classmethod
+    def build_targets_value(cls, target_ips: List[str]) -> str:
+        """
+        arp.spoof.targets 的取值：连续地址压缩为 CIDR 块并扣除白名单，
+        命令长度随连续段数增长而不是随目标数增长
+        """
+        return ','.join(compress_addresses(target_ips, exclude=cls._whitelist))
+    
+    @classmethod
+    def get_sync_state(cls) -> dict:
+        """目标同步状态：是否有待推送的变更及推送统计"""
+        return {
+            **cls._sync_state,
+            "pending": cls._sync_task is not None and not cls._sync_task.done()
+        }
+    
+    @classmethod
+    def request_target_sync(cls) -> dict:
+        """
+        请求把数据库中的目标列表同步到 Bettercap（立即返回，不等待推送）
+        
+        合并窗口内的多次请求只读取一次目标、推送一次；ARP Ban 未运行时不做任何事。
+        
+        Returns:
+            当前同步状态
+        """
+        if not cls._running:
+            return cls.get_sync_state()
+        cls._sync_state["requests"] += 1
+        cls._sync_dirty = True
+        if cls._sync_task is None or cls._sync_task.done():
+            cls._sync_task = asyncio.create_task(cls._run_target_sync())
+        return cls.get_sync_state()
+    
+    @classmethod
+    async def _run_target_sync(cls):
+        """等待变更平静下来（或达到最长延迟）后读取目标并推送"""
+        loop = asyncio.get_running_loop()
+        while cls._sync_dirty:
+            started = loop.time()
+            # 合并窗口：窗口内又有新请求就继续等待，但总等待不超过最长延迟
+            while cls._sync_dirty and loop.time() - started < TARGET_SYNC_MAX_DELAY_SECONDS:
+                cls._sync_dirty = False
+                await asyncio.sleep(TARGET_SYNC_DEBOUNCE_SECONDS)
+            cls._sync_dirty = False
+            try:
+                async with AsyncSession(async_engine) as session:
+                    targets = await session.run_sync(lambda s: ArpBanTargetRepository(s).get_all())
+                await cls.update_targets([t.ip for t in targets])
+                cls._sync_state["last_synced_at"] = datetime.now()
+                cls._sync_state["last_error"] = None
+            except Exception as e:
+                cls._sync_state["last_error"] = str(e)
+                logger.error(f"[ARP Ban] 同步目标失败: {e}")
+    
+    @classmethod
+    def _save_desired_state(cls, session, running: bool) -> None:
+        """持久化期望运行状态（重启后由对账恢复）"""
+        AppConfigRepository(session).upsert(ARP_BAN_STATE_KEY, json.dumps({
+            "running": running,
+            "whitelist": cls._whitelist if running else [],
+            "updated_at": datetime.now().isoformat()
+        }), "ARP Ban 期望运行状态")
+    
     @classmethod
     async def start_arp_ban(cls, gateway_ip: str = None, whitelist_ips: List[str] = None):
         """
@@ -43,15 +145,19 @@ class ArpBanService:
             gateway_ip: 用户指定的网关IP，如果为None则自动检测
             whitelist_ips: 用户指定的白名单IP列表
         """
+        async with cls._state_lock:
+            await cls._start_arp_ban(gateway_ip, whitelist_ips)
+    
+    @classmethod
+    async def _start_arp_ban(cls, gateway_ip: str = None, whitelist_ips: List[str] = None):
         if cls._running:
             logger.warning("ARP Ban 已在运行中")
             return
         
         try:
-            with Session(engine) as session:
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
                 # 获取目标列表
-                target_repo = ArpBanTargetRepository(session)
-                targets = target_repo.get_all()
+                targets = await session.run_sync(lambda s: ArpBanTargetRepository(s).get_all())
                 
                 if not targets:
                     logger.warning("没有目标设备，无法启动 ARP Ban")
@@ -61,15 +167,12 @@ class ArpBanService:
                 cls._current_targets = target_ips
                 
                 # 获取 Bettercap 配置
-                config_repo = AppConfigRepository(session)
-                config = config_repo.get_by_key("bettercap_config")
+                config_dict = await ConfigCache.aget_json("bettercap_config")
                 
-                if not config:
+                if not config_dict:
                     logger.error("Bettercap 配置不存在")
                     raise ValueError("Bettercap 未配置，请先在设置页面配置")
                 
-                config_dict = json.loads(config.value)
-                
                 # 日志：准备启动
                 logger.info("=" * 60)
                 logger.info(f"[ARP Ban] 准备启动")
@@ -89,7 +192,7 @@ class ArpBanService:
                 
                 # 使用用户指定的网关，如果没有则自动检测
                 if not gateway_ip:
-                    gateway_ip = get_gateway_ip()
+                    gateway_ip = await asyncio.to_thread(get_gateway_ip)
                     logger.info(f"[ARP Ban] 自动检测网关: {gateway_ip}")
                 else:
                     logger.info(f"[ARP Ban] 使用用户指定网关: {gateway_ip}")
@@ -106,11 +209,14 @@ class ArpBanService:
                 
                 # 去重
                 whitelist_items = list(set(whitelist_items))
-                logger.info(f"[ARP Ban] 受保护的设备（仅供参考）: {whitelist_items}")
-                logger.info(f"[ARP Ban] 注意：白名单不传递给Bettercap，仅在应用层保护")
+                cls._whitelist = whitelist_items
+                logger.info(f"[ARP Ban] 受保护的设备: {whitelist_items}")
+                logger.info(f"[ARP Ban] 注意：白名单不传递给Bettercap，在生成目标时扣除")
                 
-                # 设置目标（无需whitelist参数）
-                targets_str = ','.join(target_ips)
+                # 设置目标（压缩为 CIDR 块并扣除白名单）
+                targets_str = cls.build_targets_value(target_ips)
+                if not targets_str:
+                    raise ValueError("目标设备均在白名单中，无法启动 ARP Ban")
                 logger.info(f"[ARP Ban] 执行命令: set arp.spoof.targets {targets_str}")
                 await client.execute_command(f"set arp.spoof.targets {targets_str}")
                 logger.info(f"[ARP Ban] ✓ 目标设置成功")
@@ -127,13 +233,17 @@ class ArpBanService:
                 logger.info(f"[ARP Ban] 白名单设备数: {len(whitelist_items)}")
                 logger.info("=" * 60)
                 
-                # 记录日志
-                log_repo = ArpBanLogRepository(session)
-                log_repo.create(ArpBanLog(
-                    action="start",
-                    message=f"启动 ARP Ban，目标: {len(target_ips)} 个设备",
-                    operator="admin"
-                ))
+                # 记录日志并持久化期望状态
+                def save(s):
+                    with unit_of_work(s):
+                        ArpBanLogRepository(s).create(ArpBanLog(
+                            action="start",
+                            message=f"启动 ARP Ban，目标: {len(target_ips)} 个设备",
+                            operator="admin"
+                        ))
+                        cls._save_desired_state(s, True)
+                
+                await session.run_sync(save)
                 
         except httpx.HTTPStatusError as e:
             logger.error("=" * 60)
@@ -165,6 +275,11 @@ class ArpBanService:
     @classmethod
     async def stop_arp_ban(cls):
         """停止 ARP Ban"""
+        async with cls._state_lock:
+            await cls._stop_arp_ban()
+    
+    @classmethod
+    async def _stop_arp_ban(cls):
         if not cls._running:
             logger.warning("[ARP Ban] 未在运行，无需停止")
             return
@@ -173,7 +288,10 @@ class ArpBanService:
             logger.info("=" * 60)
             logger.info("[ARP Ban] 准备停止")
             
-            with Session(engine) as session:
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                # 先持久化期望状态：即使下面的命令失败，对账也会继续尝试停止
+                await session.run_sync(lambda s: cls._save_desired_state(s, False))
+                
                 # 使用Ban专用客户端
                 logger.info("[ARP Ban] 获取Bettercap Ban客户端实例...")
                 client = await BettercapClientManager.get_ban_client()
@@ -196,12 +314,11 @@ class ArpBanService:
                 logger.info("=" * 60)
                 
                 # 记录日志
-                log_repo = ArpBanLogRepository(session)
-                log_repo.create(ArpBanLog(
+                await session.run_sync(lambda s: ArpBanLogRepository(s).create(ArpBanLog(
                     action="stop",
                     message="停止 ARP Ban",
                     operator="admin"
-                ))
+                )))
                 
         except httpx.HTTPStatusError as e:
             logger.error("=" * 60)
@@ -231,6 +348,13 @@ class ArpBanService:
             logger.info("ARP Ban 未运行，无需更新目标")
             return
         
+        target_ips = sorted(set(target_ips))
+        if target_ips == sorted(cls._current_targets):
+            cls._sync_state["skipped"] += 1
+            logger.info("[ARP Ban] 目标未变化，跳过更新")
+            return
+        cls._sync_state["pushes"] += 1
+        
         logger.info(f"[ARP Ban] 动态更新目标: 从 {cls._current_targets} 到 {target_ips}")
         
         try:
@@ -239,9 +363,9 @@ class ArpBanService:
             client = await BettercapClientManager.get_ban_client()
             logger.info("[ARP Ban] Ban客户端实例获取成功")
             
-            # 更新目标（无需whitelist参数）
-            if target_ips:
-                targets_str = ','.join(target_ips)
+            # 更新目标（压缩为 CIDR 块并扣除白名单）
+            targets_str = cls.build_targets_value(target_ips)
+            if targets_str:
                 logger.info(f"[ARP Ban] 执行命令: set arp.spoof.targets {targets_str}")
                 await client.execute_command(f"set arp.spoof.targets {targets_str}")
                 logger.info(f"[ARP Ban] ✓ 目标更新成功")
@@ -271,4 +395,104 @@ class ArpBanService:
             logger.error(f"[ARP Ban] 错误详情: {e}")
             logger.error("=" * 60)
             raise
-
+    
+    @classmethod
+    def get_reconcile_state(cls) -> dict:
+        """对账状态"""
+        return {
+            **cls._reconcile_state,
+            "interval": ARP_BAN_RECONCILE_INTERVAL,
+            "active": cls._reconcile_task is not None and not cls._reconcile_task.done()
+        }
+    
+    @classmethod
+    async def reconcile(cls) -> dict:
+        """
+        对比持久化的期望状态与 Ban 实例的实际状态，有偏差时修复
+        
+        - 期望运行：恢复进程内状态；实例未运行时重新推送目标并启动，目标有偏差时只重新推送目标
+        - 期望停止：实例仍在运行时停止并清空目标
+        
+        期望状态从配置缓存读取，目标列表只在期望运行时查询一次；Bettercap 只查询一次会话状态，无偏差时不发送命令。
+        
+        Returns:
+            对账状态
+        """
+        async with cls._state_lock:
+            cls._reconcile_state["checks"] += 1
+            cls._reconcile_state["last_checked_at"] = datetime.now()
+            try:
+                action = await cls._reconcile()
+                cls._reconcile_state["last_error"] = None
+                if action:
+                    cls._reconcile_state["repairs"] += 1
+                    cls._reconcile_state["last_action"] = action
+                    logger.warning(f"[ARP Ban] 对账发现偏差并已修复: {action}")
+            except Exception as e:
+                cls._reconcile_state["last_error"] = str(e)
+                logger.error(f"[ARP Ban] 对账失败: {type(e).__name__}: {e}")
+        return cls.get_reconcile_state()
+    
+    @classmethod
+    async def _reconcile(cls) -> Optional[str]:
+        """执行一次对账，返回所做的修复（无偏差返回 None）"""
+        desired = await ConfigCache.aget_json(ARP_BAN_STATE_KEY, {"running": False})
+        target_ips = []
+        if desired.get("running"):
+            async with AsyncSession(async_engine) as session:
+                targets = await session.run_sync(lambda s: ArpBanTargetRepository(s).get_all())
+            target_ips = [t.ip for t in targets]
+        
+        client = await BettercapClientManager.get_ban_client()
+        session_data = await client.get_session()
+        actual_running = any(
+            m.get("name") == ARP_SPOOF_MODULE and m.get("running")
+            for m in session_data.get("modules") or []
+        )
+        actual_value = ((session_data.get("env") or {}).get("data") or {}).get("arp.spoof.targets") or ""
+        actual_targets = compress_addresses(actual_value.strip('"').split(","))
+        
+        if not desired.get("running"):
+            cls._running = False
+            cls._current_targets = []
+            if not actual_running:
+                return None
+            await client.execute_command("arp.ban off")
+            await client.execute_command("set arp.spoof.targets \"\"")
+            return "Ban 实例仍在运行，已停止"
+        
+        cls._whitelist = desired.get("whitelist") or []
+        cls._running = True
+        cls._current_targets = target_ips
+        expected = cls.build_targets_value(target_ips)
+        
+        actions = []
+        if actual_targets != (expected.split(",") if expected else []):
+            await client.execute_command(f"set arp.spoof.targets {expected}" if expected else "set arp.spoof.targets \"\"")
+            actions.append("目标有偏差，已重新推送")
+        if not actual_running and expected:
+            await client.execute_command("arp.ban on")
+            actions.append("Ban 实例未运行，已启动")
+        return "；".join(actions) or None
+    
+    @classmethod
+    def start_reconciler(cls):
+        """启动后台对账循环（立即对账一次，之后每 ARP_BAN_RECONCILE_INTERVAL 秒一次）"""
+        if cls._reconcile_task is not None and not cls._reconcile_task.done():
+            return
+        loop = asyncio.get_event_loop()
+        cls._reconcile_task = loop.create_task(cls._reconcile_loop())
+        logger.info(f"[ARP Ban] 状态对账已启动，间隔 {ARP_BAN_RECONCILE_INTERVAL} 秒")
+    
+    @classmethod
+    def stop_reconciler(cls):
+        """停止后台对账循环"""
+        if cls._reconcile_task is not None:
+            cls._reconcile_task.cancel()
+            cls._reconcile_task = None
+    
+    @classmethod
+    async def _reconcile_loop(cls):
+        while True:
+            await cls.reconcile()
+            await asyncio.sleep(ARP_BAN_RECONCILE_INTERVAL)
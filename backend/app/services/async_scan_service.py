@@ -7,12 +7,15 @@ from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.models.scan_task import ScanTask
 from app.repositories.scan_task_repo import ScanTaskRepository
+from app.repositories.unit_of_work import unit_of_work
 from app.services.scan_service import upsert_devices_with_info, _parse_nmap_output
 from app.services.bettercap_service import scan_bettercap
-from app.utils.cidr import expand_cidr
+from app.services.db_writer import DbWriter
+from app.utils.cidr import count_hosts
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +23,34 @@ logger = logging.getLogger(__name__)
 _running_tasks: Dict[str, asyncio.Task] = {}
 
 
+# raw_output 最多保留的字符数，避免数据库过大
+MAX_RAW_OUTPUT = 50000
+
+
+def _update_task_job(task_id: str, append_output: Optional[str] = None, **fields):
+    """构造更新扫描任务字段的写任务（在写线程中按 task_id 重新加载，避免覆盖其他写入）"""
+    def job(session: Session):
+        task = ScanTaskRepository(session).get_by_task_id(task_id)
+        if not task:
+            return
+        for key, value in fields.items():
+            setattr(task, key, value)
+        if append_output:
+            output = f"{task.raw_output}\n{append_output}" if task.raw_output else append_output
+            task.raw_output = output[-MAX_RAW_OUTPUT:]
+        session.add(task)
+    return job
+
+
+async def _update_task(task_id: str, **fields):
+    """通过写线程更新扫描任务并等待完成"""
+    await DbWriter.run(_update_task_job(task_id, **fields))
+
+
 async def scan_nmap_realtime(
     targets: List[str], 
     nmap_args: Optional[str],
-    task_id: str,
-    repo: 'ScanTaskRepository'
+    task_id: str
 ) -> Tuple[Dict[str, Dict[str, Optional[str]]], str]:
     """
     实时读取 nmap 输出的扫描函数
@@ -83,31 +109,24 @@ async def scan_nmap_realtime(
         )
         
         if should_update:
-            from app.models.db import engine
-            with Session(engine) as session:
-                task_repo = ScanTaskRepository(session)
-                task = task_repo.get_by_task_id(task_id)
-                if task:
-                    # 限制输出大小，避免数据库过大
-                    current_output = ''.join(output_lines)
-                    task.raw_output = current_output[-50000:] if len(current_output) > 50000 else current_output
-                    task_repo.update(task)
+            # 交给写线程，不等待提交完成，扫描输出读取不被数据库写入拖慢
+            current_output = ''.join(output_lines)
+            DbWriter.submit_nowait(
+                _update_task_job(task_id, raw_output=current_output[-MAX_RAW_OUTPUT:]),
+                f"更新任务 {task_id} 实时输出"
+            )
             last_update_time = current_time
     
     # 等待进程结束
     await proc.wait()
     
-    # 最后确保更新一次完整输出
-    from app.models.db import engine
     raw_output = ''.join(output_lines)
-    with Session(engine) as session:
-        task_repo = ScanTaskRepository(session)
-        task = task_repo.get_by_task_id(task_id)
-        if task:
-            task.raw_output = raw_output[-50000:] if len(raw_output) > 50000 else raw_output
-            task_repo.update(task)
-    
     if proc.returncode != 0:
+        # 失败时补写完整输出（写线程按顺序执行，先于任务失败状态落库）；成功时由入库阶段一并写入
+        DbWriter.submit_nowait(
+            _update_task_job(task_id, raw_output=raw_output[-MAX_RAW_OUTPUT:]),
+            f"更新任务 {task_id} 实时输出"
+        )
         raise RuntimeError(f"nmap exited with code {proc.returncode}")
     
     # 解析完整输出
@@ -129,9 +148,9 @@ async def execute_scan_task(
     """
     执行异步扫描任务
     
-    这个函数在后台运行，不会阻塞 API 响应
+    这个函数在后台运行，不会阻塞 API 响应；所有数据库写入都经由写线程完成
     """
-    from app.models.db import engine
+    from app.models.db import async_engine
     
     logger.info(f"[Task {task_id}] Starting scan")
     logger.info(f"  CIDRs: {cidrs}")
@@ -142,105 +161,89 @@ async def execute_scan_task(
         logger.info(f"  Bettercap URL: {bettercap_url}")
         logger.info(f"  Bettercap duration: {bettercap_duration}s")
     
-    # 创建新的 session（后台任务需要独立的数据库连接）
-    with Session(engine) as session:
-        repo = ScanTaskRepository(session)
-        task = repo.get_by_task_id(task_id)
+    async with AsyncSession(async_engine) as session:
+        task = await session.run_sync(lambda s: ScanTaskRepository(s).get_by_task_id(task_id))
+    if not task:
+        logger.error(f"[Task {task_id}] Task not found in database")
+        return
+    
+    try:
+        # 启动阶段：状态、开始时间、主机数和进度一次写入（只计算主机数，不展开地址列表）
+        total_hosts = count_hosts(cidrs)
+        logger.info(f"[Task {task_id}] Total hosts: {total_hosts}")
+        await _update_task(
+            task_id,
+            status="running",
+            started_at=datetime.now(),
+            total_hosts=total_hosts,
+            progress=20 if scan_tool == "nmap" else 10
+        )
         
-        if not task:
-            logger.error(f"[Task {task_id}] Task not found in database")
-            return
+        # 根据扫描工具类型执行不同的扫描
+        if scan_tool == "bettercap":
+            # 使用 bettercap 扫描
+            parsed_results = await execute_bettercap_scan(
+                task_id, cidrs, bettercap_url, 
+                bettercap_username, bettercap_password, 
+                bettercap_duration
+            )
+            raw_output = f"Bettercap scan completed. Found {len(parsed_results)} hosts."
+        else:
+            # 使用 nmap 扫描（默认）
+            parsed_results, raw_output = await execute_nmap_scan(task_id, cidrs, nmap_args)
         
-        try:
-            # 更新状态为 running
-            task.status = "running"
-            task.started_at = datetime.now()
-            task.progress = 5
-            repo.update(task)
-            
-            # 根据扫描工具类型执行不同的扫描
-            if scan_tool == "bettercap":
-                # 使用 bettercap 扫描
-                parsed_results = await execute_bettercap_scan(
-                    task_id, cidrs, bettercap_url, 
-                    bettercap_username, bettercap_password, 
-                    bettercap_duration, repo, task
-                )
-                raw_output = f"Bettercap scan completed. Found {len(parsed_results)} hosts."
-            else:
-                # 使用 nmap 扫描（默认）
-                parsed_results, raw_output = await execute_nmap_scan(
-                    task_id, cidrs, nmap_args, repo, task
+        logger.info(f"[Task {task_id}] Scan completed, found {len(parsed_results)} online hosts")
+        
+        # 入库阶段：设备更新、扫描输出和任务完成状态在同一个事务中提交
+        def ingest(s: Session):
+            with unit_of_work(s):
+                total_count, new_count, offline_count = upsert_devices_with_info(
+                    session=s,
+                    devices_info=parsed_results,
+                    mark_offline=True,  # 手动扫描也要标记离线设备
+                    target_cidrs=cidrs,
+                    scan_tool=scan_tool  # 传递扫描工具类型
                 )
-            
-            task.progress = 70
-            task.raw_output = raw_output[-50000:] if len(raw_output) > 50000 else raw_output
-            repo.update(task)
-            
-            logger.info(f"[Task {task_id}] Scan completed, found {len(parsed_results)} online hosts")
-            
-            # 更新设备数据库
-            task.progress = 80
-            repo.update(task)
-            
-            total_count, new_count, offline_count = upsert_devices_with_info(
-                session=session,
-                devices_info=parsed_results,
-                mark_offline=True,  # 手动扫描也要标记离线设备
-                target_cidrs=cidrs,
-                scan_tool=scan_tool  # 传递扫描工具类型
-            )
-            
-            # 更新任务统计
-            task.status = "completed"
-            task.progress = 100
-            task.completed_at = datetime.now()
-            task.online_count = len(parsed_results)  # 在线设备数
-            task.new_count = new_count
-            task.offline_count = offline_count
-            repo.update(task)
-            
-            logger.info(f"[Task {task_id}] Task completed successfully")
-            logger.info(f"  Online: {task.online_count}, New: {task.new_count}")
-            
-        except Exception as e:
-            logger.error(f"[Task {task_id}] Task failed: {str(e)}", exc_info=True)
-            task.status = "failed"
-            task.error_message = str(e)[:1000]  # 限制错误信息长度
-            task.completed_at = datetime.now()
-            repo.update(task)
+                _update_task_job(
+                    task_id,
+                    status="completed",
+                    progress=100,
+                    completed_at=datetime.now(),
+                    raw_output=raw_output[-MAX_RAW_OUTPUT:],
+                    online_count=len(parsed_results),  # 在线设备数
+                    new_count=new_count,
+                    offline_count=offline_count
+                )(s)
+            return new_count
+        
+        new_count = await DbWriter.run(ingest, isolated=True)
+        
+        logger.info(f"[Task {task_id}] Task completed successfully")
+        logger.info(f"  Online: {len(parsed_results)}, New: {new_count}")
         
-        finally:
-            # 从运行列表中移除
-            if task_id in _running_tasks:
-                del _running_tasks[task_id]
+    except Exception as e:
+        logger.error(f"[Task {task_id}] Task failed: {str(e)}", exc_info=True)
+        await _update_task(
+            task_id,
+            status="failed",
+            error_message=str(e)[:1000],  # 限制错误信息长度
+            completed_at=datetime.now()
+        )
+    
+    finally:
+        # 从运行列表中移除
+        if task_id in _running_tasks:
+            del _running_tasks[task_id]
 
 
 async def execute_nmap_scan(
     task_id: str,
     cidrs: List[str],
-    nmap_args: str,
-    repo: 'ScanTaskRepository',
-    task: ScanTask
+    nmap_args: str
 ) -> Tuple[Dict[str, Dict[str, Optional[str]]], str]:
-    """执行 nmap 扫描"""
-    # 展开所有 CIDR
-    all_hosts = []
-    for cidr in cidrs:
-        all_hosts.extend(expand_cidr(cidr))
-    
-    task.total_hosts = len(all_hosts)
-    task.progress = 10
-    repo.update(task)
-    
-    logger.info(f"[Task {task_id}] Total hosts to scan: {len(all_hosts)}")
-    
-    # 执行 nmap 扫描（实时读取输出）
-    task.progress = 20
-    repo.update(task)
-    
-    # 使用实时扫描函数，每读取一行就更新数据库
-    parsed_results, raw_output = await scan_nmap_realtime(all_hosts, nmap_args, task_id, repo)
+    """执行 nmap 扫描（CIDR 直接交给 nmap，不展开成地址列表）"""
+    # 使用实时扫描函数，输出按批交给写线程更新
+    parsed_results, raw_output = await scan_nmap_realtime(cidrs, nmap_args, task_id)
     
     return parsed_results, raw_output
 
@@ -251,38 +254,16 @@ async def execute_bettercap_scan(
     bettercap_url: str,
     username: str,
     password: str,
-    duration: int,
-    repo: 'ScanTaskRepository',
-    task: ScanTask
+    duration: int
 ) -> Dict[str, Dict[str, Optional[str]]]:
     """执行 bettercap 扫描"""
-    from app.utils.cidr import expand_cidrs
-    
-    # 展开 CIDR 计算总主机数
-    all_hosts = expand_cidrs(cidrs)
-    task.total_hosts = len(all_hosts)
-    task.progress = 10
-    repo.update(task)
-    
-    logger.info(f"[Task {task_id}] Total hosts in range: {len(all_hosts)}")
-    
     # 定义进度回调函数
     def update_progress(progress: int, message: str):
-        from app.models.db import engine
-        with Session(engine) as session:
-            task_repo = ScanTaskRepository(session)
-            t = task_repo.get_by_task_id(task_id)
-            if t:
-                t.progress = progress
-                # 将 bettercap 的消息追加到 raw_output
-                if t.raw_output:
-                    t.raw_output += f"\n{message}"
-                else:
-                    t.raw_output = message
-                # 限制输出大小
-                if len(t.raw_output) > 50000:
-                    t.raw_output = t.raw_output[-50000:]
-                task_repo.update(t)
+        # 将 bettercap 的消息追加到 raw_output（在写线程中追加，不会丢失并发写入）
+        DbWriter.submit_nowait(
+            _update_task_job(task_id, append_output=message, progress=progress),
+            f"更新任务 {task_id} 进度"
+        )
     
     # 执行 bettercap 扫描
     parsed_results = await scan_bettercap(
@@ -297,7 +278,7 @@ async def execute_bettercap_scan(
     return parsed_results
 
 
-def start_scan_task(
+async def start_scan_task(
     cidrs: List[str], 
     scan_tool: str = "nmap",
     nmap_args: str = None,
@@ -321,25 +302,21 @@ def start_scan_task(
     Returns:
         task_id: 任务ID
     """
-    from app.models.db import engine
-    
     # 生成任务ID
     task_id = str(uuid4())
     
-    # 创建任务记录
-    with Session(engine) as session:
-        repo = ScanTaskRepository(session)
-        task = ScanTask(
-            task_id=task_id,
-            cidrs=json.dumps(cidrs),
-            scan_tool=scan_tool,
-            nmap_args=nmap_args,
-            bettercap_url=bettercap_url,
-            bettercap_duration=bettercap_duration,
-            status="pending",
-            progress=0
-        )
-        repo.create(task)
+    # 创建任务记录（经由写线程）
+    task = ScanTask(
+        task_id=task_id,
+        cidrs=json.dumps(cidrs),
+        scan_tool=scan_tool,
+        nmap_args=nmap_args,
+        bettercap_url=bettercap_url,
+        bettercap_duration=bettercap_duration,
+        status="pending",
+        progress=0
+    )
+    await DbWriter.run(lambda session: session.add(task))
     
     # 创建后台任务
     asyncio_task = asyncio.create_task(
@@ -356,63 +333,56 @@ def start_scan_task(
     return task_id
 
 
-def get_task_status(task_id: str) -> dict:
+def _task_status_dict(task: ScanTask) -> dict:
+    return {
+        "task_id": task.task_id,
+        "status": task.status,
+        "progress": task.progress,
+        "cidrs": json.loads(task.cidrs),
+        "nmap_args": task.nmap_args,
+        "created_at": task.created_at,
+        "started_at": task.started_at,
+        "completed_at": task.completed_at,
+        "total_hosts": task.total_hosts,
+        "online_count": task.online_count,
+        "offline_count": task.offline_count,
+        "new_count": task.new_count,
+        "error_message": task.error_message,
+        "raw_output": task.raw_output
+    }
+
+
+def _task_summary_dict(task: ScanTask) -> dict:
+    return {
+        "task_id": task.task_id,
+        "status": task.status,
+        "progress": task.progress,
+        "cidrs": json.loads(task.cidrs),
+        "nmap_args": task.nmap_args,
+        "created_at": task.created_at,
+        "started_at": task.started_at,
+        "completed_at": task.completed_at,
+        "total_hosts": task.total_hosts,
+        "online_count": task.online_count,
+        "new_count": task.new_count,
+        "error_message": task.error_message
+    }
+
+
+async def get_task_status(session: AsyncSession, task_id: str) -> Optional[dict]:
     """
     获取任务状态
     
     Returns:
         任务状态字典，包含所有任务信息
     """
-    from app.models.db import engine
-    
-    with Session(engine) as session:
-        repo = ScanTaskRepository(session)
-        task = repo.get_by_task_id(task_id)
-        
-        if not task:
-            return None
-        
-        return {
-            "task_id": task.task_id,
-            "status": task.status,
-            "progress": task.progress,
-            "cidrs": json.loads(task.cidrs),
-            "nmap_args": task.nmap_args,
-            "created_at": task.created_at,
-            "started_at": task.started_at,
-            "completed_at": task.completed_at,
-            "total_hosts": task.total_hosts,
-            "online_count": task.online_count,
-            "offline_count": task.offline_count,
-            "new_count": task.new_count,
-            "error_message": task.error_message,
-            "raw_output": task.raw_output
-        }
+    task = await session.run_sync(lambda s: ScanTaskRepository(s).get_by_task_id(task_id))
+    if not task:
+        return None
+    return _task_status_dict(task)
 
 
-def get_recent_tasks(limit: int = 50) -> List[dict]:
+async def get_recent_tasks(session: AsyncSession, limit: int = 50) -> List[dict]:
     """获取最近的任务列表"""
-    from app.models.db import engine
-    
-    with Session(engine) as session:
-        repo = ScanTaskRepository(session)
-        tasks = repo.get_recent(limit)
-        
-        return [
-            {
-                "task_id": task.task_id,
-                "status": task.status,
-                "progress": task.progress,
-                "cidrs": json.loads(task.cidrs),
-                "nmap_args": task.nmap_args,
-                "created_at": task.created_at,
-                "started_at": task.started_at,
-                "completed_at": task.completed_at,
-                "total_hosts": task.total_hosts,
-                "online_count": task.online_count,
-                "new_count": task.new_count,
-                "error_message": task.error_message
-            }
-            for task in tasks
-        ]
-
+    tasks = await session.run_sync(lambda s: ScanTaskRepository(s).get_recent(limit))
+    return [_task_summary_dict(task) for task in tasks]
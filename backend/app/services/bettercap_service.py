@@ -1,100 +1,126 @@
 import asyncio
+import base64
 import logging
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit
 from datetime import datetime
 import hashlib
 import json
+import os
 
 import httpx
 
+# 可选依赖（uvicorn[standard] 会安装），缺失时事件接收回退为 REST 轮询
+try:
+    from websockets.exceptions import InvalidHandshake
+    try:
+        from websockets.asyncio.client import connect as ws_connect  # websockets >= 13
+        _WS_HEADERS_ARG = "additional_headers"
+    except ImportError:
+        from websockets import connect as ws_connect
+        _WS_HEADERS_ARG = "extra_headers"
+except ImportError:
+    ws_connect = None
+
 logger = logging.getLogger(__name__)
 
+# 每个 Bettercap 实例的连接池上限（轮询、命令和状态查询共用长连接）
+BETTERCAP_MAX_CONNECTIONS = int(os.getenv("BETTERCAP_MAX_CONNECTIONS", "10"))
+BETTERCAP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("BETTERCAP_MAX_KEEPALIVE_CONNECTIONS", "5"))
+BETTERCAP_KEEPALIVE_EXPIRY = float(os.getenv("BETTERCAP_KEEPALIVE_EXPIRY", "30"))
+
 
 class BettercapClientManager:
     """Bettercap客户端管理器（双实例模式，分别用于扫描和Ban）"""
     _scan_instance: Optional['BettercapClient'] = None
     _ban_instance: Optional['BettercapClient'] = None
     _config_hash: Optional[str] = None
+    _ban_config_hash: Optional[str] = None
+    # 实例创建时的配置版本号：版本未变时直接复用，不再解析和计算哈希
+    _scan_config_version: Optional[int] = None
+    _ban_config_version: Optional[int] = None
     _lock = asyncio.Lock()
     
+    @classmethod
+    async def _load_config(cls):
+        """读取 Bettercap 配置快照（配置缓存，未命中时异步加载）"""
+        from app.services.config_cache import ConfigCache
+        
+        entry = await ConfigCache.aget_entry("bettercap_config")
+        if entry.data is None:
+            raise ValueError("Bettercap配置不存在，请先在设置页面配置")
+        return entry
+    
     @classmethod
     async def get_scan_client(cls) -> 'BettercapClient':
         """获取扫描专用客户端实例（端口8081）"""
         async with cls._lock:
-            # 从数据库加载配置
-            from app.models.db import engine
-            from sqlmodel import Session
-            from app.repositories.app_config_repo import AppConfigRepository
-            
-            with Session(engine) as session:
-                config_repo = AppConfigRepository(session)
-                config = config_repo.get_by_key("bettercap_config")
-                
-                if not config:
-                    raise ValueError("Bettercap配置不存在，请先在设置页面配置")
-                
-                config_dict = json.loads(config.value)
-                
-                # 获取扫描实例URL（默认8081）
-                scan_url = config_dict.get('scan_url', config_dict.get('url', 'http://127.0.0.1:8081'))
-                
-                # 计算配置哈希
-                config_str = f"{scan_url}:{config_dict['username']}:{config_dict['password']}"
-                current_hash = hashlib.md5(config_str.encode()).hexdigest()
-                
-                # 如果配置变更或实例不存在，创建新实例
-                if cls._scan_instance is None or cls._config_hash != current_hash:
-                    logger.info("=" * 60)
-                    logger.info(f"[Bettercap Manager] 创建扫描客户端实例")
-                    logger.info(f"[Bettercap Manager] URL: {scan_url}")
-                    logger.info("=" * 60)
-                    cls._scan_instance = BettercapClient(
-                        scan_url,
-                        config_dict['username'],
-                        config_dict['password']
-                    )
-                    cls._config_hash = current_hash
-                else:
-                    logger.debug(f"[Bettercap Manager] 复用扫描客户端实例")
-                
+            entry = await cls._load_config()
+            if cls._scan_instance is not None and cls._scan_config_version == entry.version:
                 return cls._scan_instance
+            config_dict = entry.data
+            
+            # 获取扫描实例URL（默认8081）
+            scan_url = config_dict.get('scan_url', config_dict.get('url', 'http://127.0.0.1:8081'))
+            
+            # 计算配置哈希
+            config_str = f"{scan_url}:{config_dict['username']}:{config_dict['password']}"
+            current_hash = hashlib.md5(config_str.encode()).hexdigest()
+            
+            # 如果配置变更或实例不存在，创建新实例（关闭旧实例的连接池）
+            if cls._scan_instance is None or cls._config_hash != current_hash:
+                if cls._scan_instance is not None:
+                    await cls._scan_instance.aclose()
+                logger.info("=" * 60)
+                logger.info(f"[Bettercap Manager] 创建扫描客户端实例")
+                logger.info(f"[Bettercap Manager] URL: {scan_url}")
+                logger.info("=" * 60)
+                cls._scan_instance = BettercapClient(
+                    scan_url,
+                    config_dict['username'],
+                    config_dict['password']
+                )
+                cls._config_hash = current_hash
+            else:
+                logger.debug(f"[Bettercap Manager] 复用扫描客户端实例")
+            cls._scan_config_version = entry.version
+            
+            return cls._scan_instance
     
     @classmethod
     async def get_ban_client(cls) -> 'BettercapClient':
         """获取Ban专用客户端实例（端口8082）"""
         async with cls._lock:
-            # 从数据库加载配置
-            from app.models.db import engine
-            from sqlmodel import Session
-            from app.repositories.app_config_repo import AppConfigRepository
-            
-            with Session(engine) as session:
-                config_repo = AppConfigRepository(session)
-                config = config_repo.get_by_key("bettercap_config")
-                
-                if not config:
-                    raise ValueError("Bettercap配置不存在，请先在设置页面配置")
-                
-                config_dict = json.loads(config.value)
-                
-                # 获取Ban实例URL（默认8082）
-                ban_url = config_dict.get('ban_url', 'http://127.0.0.1:8082')
-                
-                # 如果Ban实例不存在，创建
-                if cls._ban_instance is None:
-                    logger.info("=" * 60)
-                    logger.info(f"[Bettercap Manager] 创建Ban客户端实例")
-                    logger.info(f"[Bettercap Manager] URL: {ban_url}")
-                    logger.info("=" * 60)
-                    cls._ban_instance = BettercapClient(
-                        ban_url,
-                        config_dict['username'],
-                        config_dict['password']
-                    )
-                else:
-                    logger.debug(f"[Bettercap Manager] 复用Ban客户端实例")
-                
+            entry = await cls._load_config()
+            if cls._ban_instance is not None and cls._ban_config_version == entry.version:
                 return cls._ban_instance
+            config_dict = entry.data
+            
+            # 获取Ban实例URL（默认8082）
+            ban_url = config_dict.get('ban_url', 'http://127.0.0.1:8082')
+            
+            config_str = f"{ban_url}:{config_dict['username']}:{config_dict['password']}"
+            current_hash = hashlib.md5(config_str.encode()).hexdigest()
+            
+            # 如果配置变更或实例不存在，创建新实例（关闭旧实例的连接池）
+            if cls._ban_instance is None or cls._ban_config_hash != current_hash:
+                if cls._ban_instance is not None:
+                    await cls._ban_instance.aclose()
+                logger.info("=" * 60)
+                logger.info(f"[Bettercap Manager] 创建Ban客户端实例")
+                logger.info(f"[Bettercap Manager] URL: {ban_url}")
+                logger.info("=" * 60)
+                cls._ban_instance = BettercapClient(
+                    ban_url,
+                    config_dict['username'],
+                    config_dict['password']
+                )
+                cls._ban_config_hash = current_hash
+            else:
+                logger.debug(f"[Bettercap Manager] 复用Ban客户端实例")
+            cls._ban_config_version = entry.version
+            
+            return cls._ban_instance
     
     @classmethod
     async def get_client(cls) -> 'BettercapClient':
@@ -102,31 +128,123 @@ class BettercapClientManager:
         return await cls.get_scan_client()
     
     @classmethod
-    def invalidate(cls):
-        """使客户端实例失效（配置更改时调用）"""
+    async def invalidate(cls):
+        """使客户端实例失效并关闭其连接池（配置更改或应用关闭时调用）"""
+        async with cls._lock:
+            for instance in (cls._scan_instance, cls._ban_instance):
+                if instance is not None:
+                    await instance.aclose()
+            cls._scan_instance = None
+            cls._ban_instance = None
+            cls._config_hash = None
+            cls._ban_config_hash = None
+            cls._scan_config_version = None
+            cls._ban_config_version = None
         logger.info("[Bettercap Manager] 客户端实例已失效，下次将重新创建")
-        cls._scan_instance = None
-        cls._ban_instance = None
-        cls._config_hash = None
+
+
+class BettercapClientClosed(RuntimeError):
+    """客户端已关闭（配置变更或应用关闭时由 BettercapClientManager.invalidate 关闭），需要通过管理器重新获取"""
+
+
+class EventStreamUnavailable(RuntimeError):
+    """无法使用 WebSocket 事件流（未安装 websockets，或 Bettercap 未开启 api.rest.websocket）"""
+
+
+class EventStream:
+    """已建立的 Bettercap WebSocket 事件流：异步迭代得到事件（dict），连接断开时迭代结束或抛出异常"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    async def __aiter__(self) -> AsyncIterator[dict]:
+        async for message in self._connection:
+            try:
+                event = json.loads(message)
+            except ValueError:
+                continue
+            if isinstance(event, dict):
+                yield event
+
+    async def aclose(self) -> None:
+        await self._connection.close()
 
 
 class BettercapClient:
-    """Bettercap REST API 客户端"""
+    """
+    Bettercap REST API 客户端
+    
+    每个实例持有一个长连接的 httpx.AsyncClient（keep-alive 连接池），轮询时复用 TCP/TLS 连接。
+    连接绑定创建时的事件循环，在其他事件循环中使用时会关闭旧连接池并重建。
+    aclose() 后实例不可再用，之后的请求抛出 BettercapClientClosed，调用方需通过管理器重新获取客户端。
+    """
     
     def __init__(self, base_url: str, username: str, password: str):
         self.base_url = base_url.rstrip('/')
         self.auth = (username, password)
         self.timeout = httpx.Timeout(10.0, connect=5.0)
+        self.limits = httpx.Limits(
+            max_connections=BETTERCAP_MAX_CONNECTIONS,
+            max_keepalive_connections=BETTERCAP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=BETTERCAP_KEEPALIVE_EXPIRY
+        )
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closed = False
+    
+    @property
+    def closed(self) -> bool:
+        return self._closed
+    
+    def _check_open(self) -> None:
+        if self._closed:
+            raise BettercapClientClosed(f"Bettercap 客户端已关闭: {self.base_url}")
+    
+    def _get_http(self) -> httpx.AsyncClient:
+        """当前事件循环中的连接池客户端（不存在或事件循环变化时创建）"""
+        self._check_open()
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http.is_closed or self._http_loop is not loop:
+            self._discard_foreign_http()
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=self.auth,
+                timeout=self.timeout,
+                limits=self.limits
+            )
+            self._http_loop = loop
+        return self._http
+    
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """发送请求（复用连接池），不检查状态码"""
+        return await self._get_http().request(method, path, **kwargs)
+    
+    def _discard_foreign_http(self) -> None:
+        """关闭属于其他事件循环的连接池：提交到其所属的事件循环执行，该循环已结束时连接随循环一起失效"""
+        http, loop = self._http, self._http_loop
+        self._http, self._http_loop = None, None
+        if http is None or http.is_closed or loop is None:
+            return
+        if loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(http.aclose(), loop)
+    
+    async def aclose(self):
+        """关闭连接池，之后的调用抛出 BettercapClientClosed"""
+        self._closed = True
+        if self._http is not None and self._http_loop is asyncio.get_running_loop():
+            http, self._http, self._http_loop = self._http, None, None
+            if not http.is_closed:
+                await http.aclose()
+        else:
+            self._discard_foreign_http()
     
     async def health_check(self) -> bool:
         """检查Bettercap连接是否正常"""
         try:
-            url = f"{self.base_url}/api/session"
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(url, auth=self.auth)
-                response.raise_for_status()
-                logger.debug(f"[Bettercap] 健康检查通过: {self.base_url}")
-                return True
+            response = await self.request("GET", "/api/session")
+            response.raise_for_status()
+            logger.debug(f"[Bettercap] 健康检查通过: {self.base_url}")
+            return True
         except httpx.HTTPStatusError as e:
             logger.warning(f"[Bettercap] 健康检查失败 - HTTP {e.response.status_code}: {e.response.text}")
             return False
@@ -139,37 +257,60 @@ class BettercapClient:
     
     async def execute_command(self, command: str) -> dict:
         """执行 bettercap 命令"""
-        url = f"{self.base_url}/api/session"
         payload = {"cmd": command}
         
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                url,
-                json=payload,
-                auth=self.auth
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.request("POST", "/api/session", json=payload)
+        response.raise_for_status()
+        return response.json()
+    
+    async def get_session(self) -> dict:
+        """获取会话状态（模块运行状态、环境变量等）"""
+        response = await self.request("GET", "/api/session")
+        response.raise_for_status()
+        return response.json()
     
     async def get_lan_hosts(self) -> List[dict]:
         """获取 LAN 主机列表"""
-        url = f"{self.base_url}/api/session/lan"
-        
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.get(url, auth=self.auth)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("hosts", [])
+        response = await self.request("GET", "/api/session/lan")
+        response.raise_for_status()
+        data = response.json()
+        return data.get("hosts", [])
     
     async def get_events(self, limit: int = 50) -> List[dict]:
         """获取最近的事件日志"""
-        url = f"{self.base_url}/api/events"
+        response = await self.request("GET", "/api/events", params={"n": limit})
+        response.raise_for_status()
+        data = response.json()
+        return data if isinstance(data, list) else []
+    
+    def _events_ws_url(self) -> str:
+        """WebSocket 事件流地址"""
+        parts = urlsplit(self.base_url)
+        scheme = "wss" if parts.scheme == "https" else "ws"
+        return urlunsplit((scheme, parts.netloc, f"{parts.path}/api/events", "", ""))
+    
+    async def open_event_stream(self) -> "EventStream":
+        """
+        建立 WebSocket 事件流连接（/api/events）；返回时握手已完成，之后发生的事件都会进入该连接
         
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.get(url, auth=self.auth, params={"n": limit})
-            response.raise_for_status()
-            data = response.json()
-            return data if isinstance(data, list) else []
+        Raises:
+            EventStreamUnavailable: 未安装 websockets，或握手被拒绝（Bettercap 未开启 api.rest.websocket）
+        """
+        self._check_open()
+        if ws_connect is None:
+            raise EventStreamUnavailable("未安装 websockets")
+        credentials = base64.b64encode(f"{self.auth[0]}:{self.auth[1]}".encode()).decode()
+        try:
+            connection = await ws_connect(
+                self._events_ws_url(),
+                open_timeout=self.timeout.connect,
+                ping_interval=20,
+                ping_timeout=20,
+                **{_WS_HEADERS_ARG: {"Authorization": f"Basic {credentials}"}}
+            )
+        except InvalidHandshake as e:
+            raise EventStreamUnavailable(f"WebSocket 握手失败: {e}")
+        return EventStream(connection)
     
     async def start_scan(self):
         """启动主动扫描模块"""
@@ -248,10 +389,10 @@ async def scan_bettercap(
     Returns:
         解析结果字典 {ip: {mac, hostname, vendor, os}}
     """
-    from app.utils.cidr import expand_cidrs
+    from app.utils.cidr import AddressSet
     
-    # 展开 CIDR 得到目标 IP 集合
-    target_ips = set(expand_cidrs(target_cidrs)) if target_cidrs else set()
+    # 目标网段的地址集合（惰性判断成员，不展开大网段）
+    target_ips = AddressSet(target_cidrs) if target_cidrs else None
     
     # 使用单例管理器获取客户端
     logger.info("[Bettercap Scan] 获取Bettercap客户端实例")
@@ -288,7 +429,7 @@ async def scan_bettercap(
                     continue
                 
                 # 如果指定了目标 CIDR，则只保留目标范围内的 IP
-                if target_ips and ip not in target_ips:
+                if target_ips is not None and ip not in target_ips:
                     continue
                 
                 discovered_hosts[ip] = host
@@ -0,0 +1,196 @@
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session
+
+from app.models.app_config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+# 记录在 session.info 中：本事务修改过的配置键 / 是否执行过批量 UPDATE/DELETE
+_PENDING_KEYS_KEY = "config_cache_pending_keys"
+_PENDING_ALL_KEY = "config_cache_pending_all"
+
+
+class ConfigEntry(NamedTuple):
+    """一条配置的快照"""
+    key: str
+    value: Optional[str]  # 原始值（JSON 字符串），配置不存在时为 None
+    data: Any  # 解析后的 JSON，配置不存在或不是合法 JSON 时为 None
+    version: int  # 版本号，配置每次变更提交后加一
+
+
+class ConfigCache:
+    """
+    进程内应用配置缓存（按配置键）
+
+    - 首次读取某个键时从数据库加载并解析 JSON，之后直接命中内存；不存在的键也会缓存
+    - 每个键有版本号，变更提交后加一；依赖配置构建的对象（如 Bettercap 客户端）可比较版本号决定是否重建
+    - 任何会话提交了 AppConfig 的新增/修改/删除后，自动失效对应键并通知监听器。
+      绕过 ORM 直接改库时调用 invalidate()
+    - 返回的 data 是共享对象，调用方不要修改
+    """
+    _entries: Dict[str, ConfigEntry] = {}
+    _versions: Dict[str, int] = {}
+    _listeners: Dict[str, List[Callable[[str], None]]] = {}
+    _lock = threading.Lock()
+    _stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0}
+
+    @classmethod
+    def get_entry(cls, key: str) -> ConfigEntry:
+        """获取配置快照（未命中时用同步会话加载）"""
+        entry = cls._lookup(key)
+        if entry is not None:
+            return entry
+        from app.models.db import engine
+
+        version = cls.version(key)
+        with Session(engine) as session:
+            config = cls._select(session, key)
+        return cls._store(key, config, version)
+
+    @classmethod
+    async def aget_entry(cls, key: str) -> ConfigEntry:
+        """获取配置快照（未命中时用异步会话加载，不阻塞事件循环）"""
+        entry = cls._lookup(key)
+        if entry is not None:
+            return entry
+        from sqlmodel.ext.asyncio.session import AsyncSession
+        from app.models.db import async_engine
+
+        version = cls.version(key)
+        async with AsyncSession(async_engine) as session:
+            config = await session.run_sync(lambda s: cls._select(s, key))
+        return cls._store(key, config, version)
+
+    @classmethod
+    def get_json(cls, key: str, default: Any = None) -> Any:
+        """获取解析后的配置（不存在时返回 default）"""
+        data = cls.get_entry(key).data
+        return default if data is None else data
+
+    @classmethod
+    async def aget_json(cls, key: str, default: Any = None) -> Any:
+        """获取解析后的配置（不存在时返回 default，异步加载）"""
+        data = (await cls.aget_entry(key)).data
+        return default if data is None else data
+
+    @classmethod
+    def version(cls, key: str) -> int:
+        """配置键的当前版本号"""
+        with cls._lock:
+            return cls._versions.get(key, 0)
+
+    @classmethod
+    def add_listener(cls, key: str, callback: Callable[[str], None]) -> None:
+        """注册配置变更监听器：该键的变更提交后以键名调用（在提交所在线程中同步执行，应尽快返回）"""
+        with cls._lock:
+            cls._listeners.setdefault(key, []).append(callback)
+
+    @classmethod
+    def remove_listener(cls, key: str, callback: Callable[[str], None]) -> None:
+        with cls._lock:
+            callbacks = cls._listeners.get(key, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    @classmethod
+    def invalidate(cls, keys: Optional[Iterable[str]] = None) -> None:
+        """失效指定键（版本号加一并通知监听器）；不传参数时失效全部已缓存或被监听的键"""
+        with cls._lock:
+            cls._stats["invalidations"] += 1
+            if keys is None:
+                keys = set(cls._entries) | set(cls._versions) | set(cls._listeners)
+            keys = list(keys)
+            callbacks = []
+            for key in keys:
+                cls._entries.pop(key, None)
+                cls._versions[key] = cls._versions.get(key, 0) + 1
+                callbacks.extend((key, cb) for cb in cls._listeners.get(key, []))
+
+        for key, callback in callbacks:
+            try:
+                callback(key)
+            except Exception as e:
+                logger.error(f"配置变更监听器执行失败 ({key}): {e}")
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._lock:
+            lookups = cls._stats["hits"] + cls._stats["misses"]
+            return {
+                **cls._stats,
+                "size": len(cls._entries),
+                "versions": dict(cls._versions),
+                "hit_rate": round(cls._stats["hits"] / lookups, 4) if lookups else None
+            }
+
+    @classmethod
+    def _lookup(cls, key: str) -> Optional[ConfigEntry]:
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is None:
+                cls._stats["misses"] += 1
+            else:
+                cls._stats["hits"] += 1
+            return entry
+
+    @staticmethod
+    def _select(session: Session, key: str) -> Optional[str]:
+        from app.repositories.app_config_repo import AppConfigRepository
+
+        config = AppConfigRepository(session).get_by_key(key)
+        return config.value if config else None
+
+    @classmethod
+    def _store(cls, key: str, value: Optional[str], version: int) -> ConfigEntry:
+        """写入缓存；加载期间发生过失效（版本号已变化）时只返回结果不写入"""
+        data = None
+        if value is not None:
+            try:
+                data = json.loads(value)
+            except ValueError:
+                logger.warning(f"配置 {key} 不是合法的 JSON")
+        entry = ConfigEntry(key=key, value=value, data=data, version=version)
+        with cls._lock:
+            cls._stats["loads"] += 1
+            if cls._versions.get(key, 0) == version:
+                cls._entries[key] = entry
+        return entry
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _collect_config_changes(session, flush_context, instances):
+    keys = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, AppConfig) and obj.key:
+            if keys is None:
+                keys = session.info.setdefault(_PENDING_KEYS_KEY, set())
+            keys.add(obj.key)
+
+
+@event.listens_for(OrmSession, "do_orm_execute")
+def _detect_bulk_config_statements(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if any(mapper.class_ is AppConfig for mapper in orm_execute_state.all_mappers):
+        orm_execute_state.session.info[_PENDING_ALL_KEY] = True
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_committed(session):
+    keys = session.info.pop(_PENDING_KEYS_KEY, None)
+    if session.info.pop(_PENDING_ALL_KEY, False):
+        ConfigCache.invalidate()
+    elif keys:
+        ConfigCache.invalidate(keys)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING_KEYS_KEY, None)
+    session.info.pop(_PENDING_ALL_KEY, None)
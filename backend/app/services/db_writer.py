@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+from sqlmodel import Session
+
+from app.repositories.unit_of_work import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+# 写任务：接收写线程的会话（处于工作单元中），只修改会话中的对象，不自行提交
+WriteJob = Callable[[Session], Any]
+
+# 每批最多合并的写任务数
+MAX_BATCH_SIZE = 200
+
+
+class _Job:
+    __slots__ = ("fn", "future", "isolated")
+
+    def __init__(self, fn: WriteJob, isolated: bool):
+        self.fn = fn
+        self.future: Future = Future()
+        self.isolated = isolated
+
+
+class DbWriter:
+    """
+    数据库单写线程
+
+    后台的批量/高频写入（扫描结果入库、Bettercap 事件、调度器、设备导入、统计桶和数据保留清理、
+    系统事件日志）都提交到同一个队列，由一个线程串行执行，队列中积压的任务合并为一次提交（group commit）。
+    配合 WAL 模式，读请求不会被写入阻塞，这些写入之间也不再互相争抢数据库锁。
+
+    未经过写线程的写入（均为单行、短事务，依赖 busy_timeout 等待锁）：
+    - API 的增删改接口（设备、IP 申请、定时任务、ARP Ban 目标、设置）使用请求会话直接提交
+    - 修改用户密码、启动时的默认用户/配置迁移（写线程启动前执行）
+
+    - 普通任务不能自行 commit，写线程在整批执行完后统一提交；任务在工作单元中执行，
+      调用仓储的 create/update 也不会提前提交。某个任务失败时整批回滚，再逐个重新执行，
+      只让失败的任务报错
+    - isolated 任务单独执行，可以自行提交（如内部多次提交的扫描结果入库）
+    - 写线程未启动时（脚本、命令行工具）在调用方线程直接执行
+    """
+    _queue: Optional[queue.Queue] = None
+    _thread: Optional[threading.Thread] = None
+    _lock = threading.Lock()
+    _stats = {"jobs": 0, "batches": 0, "failed": 0, "max_batch": 0}
+
+    @classmethod
+    def start(cls) -> None:
+        with cls._lock:
+            if cls._thread is not None and cls._thread.is_alive():
+                return
+            cls._queue = queue.Queue()
+            cls._thread = threading.Thread(target=cls._run_loop, name="db-writer", daemon=True)
+            cls._thread.start()
+            logger.info("[DB Writer] 写线程已启动")
+
+    @classmethod
+    def stop(cls, timeout: float = 10.0) -> None:
+        """停止写线程（先执行完队列中已有的任务）"""
+        with cls._lock:
+            thread, q = cls._thread, cls._queue
+            if thread is None or q is None:
+                return
+            q.put(None)
+            thread.join(timeout)
+            cls._thread = None
+            cls._queue = None
+        # 停止过程中仍可能有任务入队，在当前线程执行完
+        while True:
+            try:
+                job = q.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                cls._execute([job])
+        logger.info("[DB Writer] 写线程已停止")
+
+    @classmethod
+    def is_running(cls) -> bool:
+        return cls._thread is not None and cls._thread.is_alive()
+
+    @classmethod
+    def submit(cls, fn: WriteJob, isolated: bool = False) -> Future:
+        """提交写任务，返回 concurrent.futures.Future（结果为 fn 的返回值）"""
+        job = _Job(fn, isolated)
+        q = cls._queue
+        if q is None or not cls.is_running():
+            cls._execute([job])
+        else:
+            q.put(job)
+        return job.future
+
+    @classmethod
+    async def run(cls, fn: WriteJob, isolated: bool = False) -> Any:
+        """在协程中提交写任务并等待完成"""
+        return await asyncio.wrap_future(cls.submit(fn, isolated))
+
+    @classmethod
+    def submit_nowait(cls, fn: WriteJob, description: str) -> None:
+        """提交不需要等待结果的写任务，失败时记录日志"""
+        def _log_failure(future: Future):
+            error = future.exception()
+            if error is not None:
+                logger.error(f"[DB Writer] {description} 失败: {error}")
+
+        cls.submit(fn).add_done_callback(_log_failure)
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        q = cls._queue
+        return {
+            **cls._stats,
+            "running": cls.is_running(),
+            "queued": q.qsize() if q is not None else 0
+        }
+
+    @classmethod
+    def _run_loop(cls) -> None:
+        q = cls._queue
+        stopping = False
+        while not stopping:
+            job = q.get()
+            if job is None:
+                break
+            batch: List[_Job] = [job]
+            # 合并队列中已积压的任务，isolated 任务单独成批
+            while not job.isolated and len(batch) < MAX_BATCH_SIZE:
+                try:
+                    job = q.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                if job.isolated:
+                    cls._execute(batch)
+                    batch = [job]
+                    break
+                batch.append(job)
+            cls._execute(batch)
+
+    @classmethod
+    def _execute(cls, batch: List[_Job]) -> None:
+        from app.models.db import engine
+
+        pending = [job for job in batch if job.future.set_running_or_notify_cancel()]
+        if not pending:
+            return
+
+        started = time.monotonic()
+        try:
+            with Session(engine, expire_on_commit=False) as session:
+                with unit_of_work(session):
+                    results = [job.fn(session) for job in pending]
+        except Exception as e:
+            if len(pending) == 1:
+                cls._stats["failed"] += 1
+                pending[0].future.set_exception(e)
+                return
+            # 整批已回滚，逐个重试以定位失败的任务
+            logger.warning(f"[DB Writer] 批量写入失败，逐个重试 {len(pending)} 个任务: {e}")
+            for job in pending:
+                cls._retry_single(job)
+            return
+
+        cls._stats["jobs"] += len(pending)
+        cls._stats["batches"] += 1
+        cls._stats["max_batch"] = max(cls._stats["max_batch"], len(pending))
+        for job, result in zip(pending, results):
+            job.future.set_result(result)
+
+        elapsed = time.monotonic() - started
+        if elapsed > 1:
+            logger.warning(f"[DB Writer] 批量写入耗时 {elapsed:.2f}s（{len(pending)} 个任务）")
+
+    @classmethod
+    def _retry_single(cls, job: _Job) -> None:
+        from app.models.db import engine
+
+        try:
+            with Session(engine, expire_on_commit=False) as session:
+                with unit_of_work(session):
+                    result = job.fn(session)
+        except Exception as e:
+            cls._stats["failed"] += 1
+            job.future.set_exception(e)
+            return
+        cls._stats["jobs"] += 1
+        cls._stats["batches"] += 1
+        job.future.set_result(result)
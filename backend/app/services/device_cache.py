@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session
+
+from app.models.device import Device
+
+logger = logging.getLogger(__name__)
+
+# 最多缓存的 IP 条数（包括“该 IP 没有设备”的负缓存），超出时淘汰最久未使用的
+DEVICE_CACHE_SIZE = int(os.getenv("DEVICE_CACHE_SIZE", "4096"))
+
+# 记录在 session.info 中：本事务修改过的设备 IP / 是否执行过批量 UPDATE/DELETE
+_PENDING_IPS_KEY = "device_cache_pending_ips"
+_PENDING_ALL_KEY = "device_cache_pending_all"
+
+# 负缓存标记：该 IP 在数据库中没有设备
+_MISSING = object()
+
+
+class DeviceCache:
+    """
+    进程内设备索引（按 IP）
+
+    - 首次查询某个 IP 时从数据库加载，之后直接命中内存；不存在的 IP 也会缓存（负缓存）
+    - 缓存的是设备的只读快照（与会话无关的 Device 副本），调用方不要修改；需要修改时按 id 在会话中重新加载
+    - 任何会话提交了设备的新增/修改/删除后，自动失效相关 IP；批量 UPDATE/DELETE 设备表时整体清空。
+      绕过 ORM 直接改库时调用 invalidate()
+    - 条目数上限 DEVICE_CACHE_SIZE，按 LRU 淘汰
+    """
+    _entries: "OrderedDict[str, object]" = OrderedDict()  # ip -> 设备快照或 _MISSING
+    _lock = threading.Lock()
+    _generation = 0  # 每次失效加一，加载期间发生过失效的结果不写入缓存
+    _stats = {"hits": 0, "negative_hits": 0, "misses": 0, "loads": 0, "invalidations": 0, "evictions": 0}
+
+    @classmethod
+    def get(cls, ip: str) -> Optional[Device]:
+        """按 IP 获取设备快照（不存在返回 None）"""
+        return cls.get_many([ip]).get(ip)
+
+    @classmethod
+    def get_many(cls, ips: Iterable[str]) -> Dict[str, Device]:
+        """批量按 IP 获取设备快照（ip -> 设备），未命中的 IP 合并为一次批量查询"""
+        result: Dict[str, Device] = {}
+        missing: List[str] = []
+        with cls._lock:
+            for ip in set(ips):
+                entry = cls._entries.get(ip)
+                if entry is None:
+                    missing.append(ip)
+                    continue
+                cls._entries.move_to_end(ip)
+                if entry is _MISSING:
+                    cls._stats["negative_hits"] += 1
+                else:
+                    cls._stats["hits"] += 1
+                    result[ip] = entry
+            cls._stats["misses"] += len(missing)
+
+        if missing:
+            result.update(cls._load(missing))
+        return result
+
+    @classmethod
+    def peek(cls, ip: str) -> Tuple[bool, Optional[Device]]:
+        """只查内存、不访问数据库（可在事件循环中调用）：返回 (是否命中, 设备快照；已知没有设备时为 None)"""
+        with cls._lock:
+            entry = cls._entries.get(ip)
+            if entry is None:
+                return False, None
+            cls._entries.move_to_end(ip)
+            if entry is _MISSING:
+                cls._stats["negative_hits"] += 1
+                return True, None
+            cls._stats["hits"] += 1
+            return True, entry
+
+    @classmethod
+    def invalidate(cls, ips: Optional[Iterable[str]] = None) -> None:
+        """失效指定 IP 的缓存；不传参数时清空全部"""
+        with cls._lock:
+            cls._stats["invalidations"] += 1
+            cls._generation += 1
+            if ips is None:
+                cls._entries.clear()
+                return
+            for ip in ips:
+                cls._entries.pop(ip, None)
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._lock:
+            lookups = cls._stats["hits"] + cls._stats["negative_hits"] + cls._stats["misses"]
+            return {
+                **cls._stats,
+                "size": len(cls._entries),
+                "max_size": DEVICE_CACHE_SIZE,
+                "hit_rate": round((lookups - cls._stats["misses"]) / lookups, 4) if lookups else None
+            }
+
+    @classmethod
+    def _load(cls, ips: List[str]) -> Dict[str, Device]:
+        from app.models.db import engine
+        from app.repositories.device_repo import DeviceRepository
+
+        with cls._lock:
+            generation = cls._generation
+        with Session(engine) as session:
+            devices = DeviceRepository(session).get_by_ips(ips)
+            snapshots = {ip: Device.model_validate(d) for ip, d in devices.items()}
+        with cls._lock:
+            cls._stats["loads"] += 1
+            if generation == cls._generation:
+                for ip in ips:
+                    cls._store(ip, snapshots.get(ip, _MISSING))
+        return snapshots
+
+    @classmethod
+    def _store(cls, ip: str, entry: object) -> None:
+        """写入一条缓存（调用方持有锁）"""
+        cls._entries[ip] = entry
+        cls._entries.move_to_end(ip)
+        while len(cls._entries) > DEVICE_CACHE_SIZE:
+            cls._entries.popitem(last=False)
+            cls._stats["evictions"] += 1
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _collect_device_changes(session, flush_context, instances):
+    ips = session.info.setdefault(_PENDING_IPS_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Device):
+            continue
+        if obj.ip:
+            ips.add(obj.ip)
+        # IP 被修改时，旧 IP 的缓存同样需要失效
+        history = inspect(obj).attrs.ip.history
+        ips.update(ip for ip in history.deleted or () if ip)
+
+
+@event.listens_for(OrmSession, "do_orm_execute")
+def _detect_bulk_device_statements(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if any(mapper.class_ is Device for mapper in orm_execute_state.all_mappers):
+        orm_execute_state.session.info[_PENDING_ALL_KEY] = True
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_committed(session):
+    ips = session.info.pop(_PENDING_IPS_KEY, None)
+    if session.info.pop(_PENDING_ALL_KEY, False):
+        DeviceCache.invalidate()
+    elif ips:
+        DeviceCache.invalidate(ips)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING_IPS_KEY, None)
+    session.info.pop(_PENDING_ALL_KEY, None)
@@ -0,0 +1,151 @@
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlmodel import Session
+
+from app.models.device import Device
+from app.models.device_presence import DevicePresenceSession
+from app.repositories.device_address_history_repo import DeviceAddressHistoryRepository
+from app.repositories.device_presence_repo import DevicePresenceRepository
+from app.repositories.device_repo import DeviceRepository
+from app.repositories.device_tag_repo import DeviceTagRepository, normalize_tags
+from app.services.presence_service import is_online_for_source
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_mac(mac: Optional[str]) -> Optional[str]:
+    """统一 MAC 地址写法（大写、冒号分隔），空值返回 None"""
+    if not mac:
+        return None
+    mac = mac.strip().replace("-", ":").upper()
+    return mac or None
+
+
+def _is_online(device: Device) -> bool:
+    return is_online_for_source(device, "nmap") or is_online_for_source(device, "bettercap")
+
+
+def _load_tags(device: Device) -> List[str]:
+    try:
+        tags = json.loads(device.tags) if device.tags else []
+    except ValueError:
+        return []
+    return tags if isinstance(tags, list) else []
+
+
+def merge_devices(
+    session: Session,
+    source: Device,
+    target: Device,
+    now: datetime,
+    open_sessions: Optional[Dict[int, DevicePresenceSession]] = None
+) -> None:
+    """
+    把重复的设备记录 source 合并到 target 并删除 source（不提交）
+
+    标签取并集，在线区间和地址变更记录转移到 target，target 缺失的信息字段用 source 补齐。
+    """
+    if source.tags:
+        tags = normalize_tags(_load_tags(target) + _load_tags(source))
+        target.tags = json.dumps(tags, ensure_ascii=False) if tags else None
+        tag_repo = DeviceTagRepository(session)
+        tag_repo.delete_for_device(source.id)
+        tag_repo.set_tags(target.id, tags)
+
+    for field in ("mac", "hostname", "vendor", "os", "note"):
+        if not getattr(target, field) and getattr(source, field):
+            setattr(target, field, getattr(source, field))
+    if source.firstSeenAt and (not target.firstSeenAt or source.firstSeenAt < target.firstSeenAt):
+        target.firstSeenAt = source.firstSeenAt
+
+    if open_sessions is not None:
+        open_sessions.pop(source.id, None)
+    DevicePresenceRepository(session).reassign_device(source.id, target.id, now)
+    DeviceAddressHistoryRepository(session).reassign_device(source.id, target.id)
+
+    session.add(target)
+    session.delete(source)
+    # 先删除旧记录，保证随后修改 target.ip 时不会违反 IP 唯一约束
+    session.flush()
+
+
+def resolve_device_identities(
+    session: Session,
+    devices_info: Dict[str, Dict[str, Optional[str]]],
+    existing_devices: Dict[str, Device],
+    now: datetime,
+    open_sessions: Optional[Dict[int, DevicePresenceSession]] = None,
+    scanned_hosts: Optional[Dict[str, Dict[str, Optional[str]]]] = None
+) -> List[Tuple[str, str]]:
+    """
+    按 MAC 识别换了 IP 的设备（用于扫描结果入库前）
+
+    - 本次扫描到的 IP 上没有记录（或只有无 MAC / 同 MAC 的记录），而同一 MAC 的设备
+      记录在另一个本次未发现的 IP 上：视为同一设备换了地址，迁移到新 IP 并记录变更
+    - 新 IP 上已有其他 MAC 的设备：视为地址被其他设备复用，仍按 IP 处理
+    - 同一 MAC 在本次扫描中对应多个 IP（代理 ARP、多地址主机）：不做匹配
+    - 同一 MAC 的其他记录已离线且本次未发现：作为重复记录合并
+
+    所有 MAC 一次批量查询。会修改 existing_devices，使其按新 IP 指向迁移后的设备。
+    不提交，由调用方提交。
+
+    增量同步时 devices_info 只包含要写入的主机，scanned_hosts 传入本次发现的全部主机：
+    在线判断和多 IP 检测按全部主机进行，只为 devices_info 中的主机做匹配。
+
+    Returns:
+        [(原 IP, 新 IP)]
+    """
+    if scanned_hosts is None:
+        scanned_hosts = devices_info
+    online_ips: Set[str] = set(scanned_hosts.keys())
+    mac_ips: Dict[str, Set[str]] = {}
+    for ip, info in scanned_hosts.items():
+        mac = normalize_mac(info.get('mac'))
+        if mac:
+            mac_ips.setdefault(mac, set()).add(ip)
+    unique_macs = {
+        mac: next(iter(ips)) for mac, ips in mac_ips.items()
+        if len(ips) == 1 and next(iter(ips)) in devices_info
+    }
+    if not unique_macs:
+        return []
+
+    by_mac = DeviceRepository(session).get_by_macs(unique_macs.keys())
+    history_repo = DeviceAddressHistoryRepository(session)
+    moves: List[Tuple[str, str]] = []
+
+    for mac, ip in unique_macs.items():
+        current = existing_devices.get(ip)
+        if current is not None and current.mac and normalize_mac(current.mac) != mac:
+            continue
+        others = [d for d in by_mac.get(mac, []) if d is not current and d.ip not in online_ips]
+        if not others:
+            continue
+
+        if current is not None and current.mac:
+            target = current
+        else:
+            # 取最近出现过的同 MAC 设备作为该设备的身份
+            target = max(others, key=lambda d: d.lastSeenAt or d.firstSeenAt or datetime.min)
+            others.remove(target)
+            if current is not None:
+                merge_devices(session, current, target, now, open_sessions)
+            old_ip = target.ip
+            history_repo.add(target.id, mac, old_ip, ip, now)
+            target.ip = ip
+            session.add(target)
+            existing_devices[ip] = target
+            moves.append((old_ip, ip))
+            logger.info(f"[Identity] 设备 {mac} 地址变更: {old_ip} -> {ip}")
+
+        for duplicate in others:
+            if not _is_online(duplicate):
+                logger.info(f"[Identity] 合并重复设备记录 {duplicate.ip} -> {target.ip} ({mac})")
+                merge_devices(session, duplicate, target, now, open_sessions)
+
+    if moves:
+        session.flush()
+    return moves
@@ -0,0 +1,224 @@
+import codecs
+import csv
+import io
+import ipaddress
+import json
+import logging
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from app.models.db import engine
+from app.models.device import Device
+from app.services.db_writer import DbWriter
+from app.services.scan_service import merge_device_records
+
+logger = logging.getLogger(__name__)
+
+# 导出字段顺序（CSV 表头）
+EXPORT_FIELDS = (
+    "ip", "mac", "hostname", "vendor", "os", "tags", "note",
+    "firstSeenAt", "lastSeenAt", "nmap_last_seen", "nmap_offline_at",
+    "bettercap_last_seen", "bettercap_offline_at",
+)
+EXPORT_FORMATS = ("csv", "ndjson")
+
+# 服务端游标每次取回的行数 / 导入时每批合并的记录数
+EXPORT_BATCH_SIZE = 1000
+IMPORT_CHUNK_SIZE = 1000
+# 导入结果中最多返回的错误条数
+MAX_REPORTED_ERRORS = 100
+
+
+def _device_to_row(d: Device) -> Dict[str, object]:
+    row: Dict[str, object] = {}
+    for field in EXPORT_FIELDS:
+        value = getattr(d, field)
+        if field == "tags":
+            try:
+                value = json.loads(value) if value else []
+            except ValueError:
+                value = []
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        row[field] = value
+    return row
+
+
+def iter_export(fmt: str) -> Iterator[str]:
+    """
+    流式导出设备清单
+
+    使用独立会话和 yield_per 服务端游标逐批读取，内存占用与设备总数无关。
+    """
+    buffer = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+
+    with Session(engine) as session:
+        statement = select(Device).order_by(Device.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        count = 0
+        for d in session.exec(statement):
+            row = _device_to_row(d)
+            if writer is not None:
+                row["tags"] = json.dumps(row["tags"], ensure_ascii=False) if row["tags"] else ""
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(row, ensure_ascii=False))
+                buffer.write("\n")
+            count += 1
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """根据文件名/Content-Type 推断导入格式"""
+    name = (filename or "").lower()
+    if name.endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+
+def _parse_tags(value) -> Optional[List[str]]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, list):
+        return [str(t) for t in value if str(t).strip()]
+    text = str(value).strip()
+    if text.startswith("["):
+        return [str(t) for t in json.loads(text)]
+    return [t.strip() for t in text.split(";") if t.strip()]
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(str(value))
+
+
+def _normalize_record(raw: Dict[str, object]) -> Dict[str, object]:
+    """校验并规整一条导入记录，无效时抛出 ValueError"""
+    ip = str(raw.get("ip") or "").strip()
+    if not ip:
+        raise ValueError("缺少 ip")
+    ipaddress.ip_address(ip)
+
+    record: Dict[str, object] = {"ip": ip}
+    for field in ("mac", "hostname", "vendor", "os", "note"):
+        value = raw.get(field)
+        record[field] = str(value).strip() if value not in (None, "") else None
+    if record["mac"]:
+        record["mac"] = record["mac"].upper()
+    record["tags"] = _parse_tags(raw.get("tags"))
+    record["firstSeenAt"] = _parse_datetime(raw.get("firstSeenAt"))
+    return record
+
+
+def _iter_lines(stream: BinaryIO) -> Iterator[bytes]:
+    """逐行读取上传文件（去掉 UTF-8 BOM），保持字节形式，由调用方逐行解码以便准确定位编码错误"""
+    first = True
+    for data in iter(stream.readline, b""):
+        if first:
+            data = data[len(codecs.BOM_UTF8):] if data.startswith(codecs.BOM_UTF8) else data
+            first = False
+        yield data
+
+
+def _iter_raw_records(stream: BinaryIO, fmt: str) -> Iterator[Tuple[int, object]]:
+    """
+    逐行解析上传文件，产出 (行号, 原始记录 或 异常)
+
+    NDJSON 中无法解码的行作为该行的错误产出；CSV 的字段可能跨行，遇到无法解码的行时抛出 UnicodeDecodeError
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(data.decode("utf-8") for data in _iter_lines(stream))
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_no, data in enumerate(_iter_lines(stream), start=1):
+        try:
+            line = data.decode("utf-8").strip()
+        except UnicodeDecodeError as e:
+            yield line_no, e
+            continue
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, e
+
+
+def import_devices(stream: BinaryIO, fmt: str) -> dict:
+    """
+    流式导入设备清单：边解析边按批合并，每批经由写线程提交一次
+
+    Returns:
+        {"total", "created", "updated", "failed", "errors"}
+    """
+    total = created = updated = failed = 0
+    errors: List[dict] = []
+    chunk: List[Dict[str, object]] = []
+
+    def flush():
+        nonlocal created, updated
+        records = list(chunk)
+        # 经由写线程执行（merge_device_records 自行提交，作为 isolated 任务单独成批）
+        c, u = DbWriter.submit(lambda session: merge_device_records(session, records), isolated=True).result()
+        created += c
+        updated += u
+        chunk.clear()
+
+    rows = _iter_raw_records(stream, fmt)
+    line_no = 0
+    while True:
+        # CSV 遇到无法解码的行时无法继续解析：记为一行错误并停止，之前的记录照常导入
+        try:
+            line_no, raw = next(rows)
+        except StopIteration:
+            break
+        except UnicodeDecodeError as e:
+            total += 1
+            failed += 1
+            errors.append({"line": line_no + 1, "error": f"文件不是有效的 UTF-8 编码，已停止解析: {e}"})
+            break
+        total += 1
+        try:
+            if isinstance(raw, UnicodeDecodeError):
+                raise ValueError(f"不是有效的 UTF-8 编码: {raw}")
+            if isinstance(raw, Exception):
+                raise ValueError(f"JSON 解析失败: {raw}")
+            if not isinstance(raw, dict):
+                raise ValueError("记录必须是对象")
+            chunk.append(_normalize_record(raw))
+        except ValueError as e:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_no, "error": str(e)})
+            continue
+
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            flush()
+
+    if chunk:
+        flush()
+
+    logger.info(f"[Device Import] total={total}, created={created}, updated={updated}, failed={failed}")
+    return {
+        "total": total,
+        "created": created,
+        "updated": updated,
+        "failed": failed,
+        "errors": errors
+    }
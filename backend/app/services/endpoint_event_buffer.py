@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlmodel import Session
+
+from app.services.db_writer import DbWriter
+
+logger = logging.getLogger(__name__)
+
+# 缓冲的最长时间（毫秒）和最多条数（按 IP 合并后），先达到者触发写入
+ENDPOINT_FLUSH_INTERVAL_MS = int(os.getenv("ENDPOINT_FLUSH_INTERVAL_MS", "200"))
+ENDPOINT_FLUSH_MAX_EVENTS = int(os.getenv("ENDPOINT_FLUSH_MAX_EVENTS", "500"))
+
+
+class _EndpointState(NamedTuple):
+    online: bool
+    mac: Optional[str]
+    hostname: Optional[str]
+    vendor: Optional[str]
+    seen_at: datetime  # 事件到达时间（写入设备的时间戳）
+    received: float  # 到达时的 monotonic 时间（计算写入延迟）
+
+
+class EndpointEventBuffer:
+    """
+    Bettercap endpoint.new / endpoint.lost 事件的写入缓冲
+
+    - 事件按 IP 合并，后到的状态覆盖先到的（上线事件中缺失的 MAC/主机名/厂商沿用之前的值）
+    - 缓冲满 ENDPOINT_FLUSH_MAX_EVENTS 个 IP 或最早的事件等待超过 ENDPOINT_FLUSH_INTERVAL_MS 时，
+      整批交给写线程，在一个事务中完成：一次批量查询设备和在线区间，统一提交
+    - 在事件循环中调用；没有运行中的事件循环时立即写入
+    """
+    _pending: Dict[str, _EndpointState] = {}
+    _in_flight: Dict[str, int] = {}  # 已交给写线程、尚未提交完成的 IP -> 所在批次数
+    _lock = threading.Lock()
+    _timer: Optional[asyncio.TimerHandle] = None
+    _stats = {
+        "events": 0,  # 收到的事件数
+        "coalesced": 0,  # 被同一 IP 的后续事件覆盖的事件数
+        "skipped": 0,  # 按设备缓存判断不会改变数据而丢弃的离线事件数
+        "flushes": 0,
+        "flushed_ips": 0,
+        "failed_flushes": 0,
+        "max_queue_depth": 0,
+        "last_flush_size": 0,
+        "last_flush_latency_ms": None,  # 批次中最早的事件从到达到提交完成的耗时
+        "max_flush_latency_ms": None
+    }
+
+    @classmethod
+    def record_online(cls, ip: str, mac: str = None, hostname: str = None, vendor: str = None) -> None:
+        """记录设备上线事件"""
+        with cls._lock:
+            previous = cls._pending.get(ip)
+            if previous is not None and previous.online:
+                mac = mac or previous.mac
+                hostname = hostname or previous.hostname
+                vendor = vendor or previous.vendor
+        cls._add(ip, online=True, mac=mac, hostname=hostname, vendor=vendor)
+
+    @classmethod
+    def record_offline(cls, ip: str) -> None:
+        """
+        记录设备离线事件
+
+        缓冲中和写线程中都没有该 IP 的待写事件，且设备缓存中已知该 IP 没有设备或 Bettercap 已标记离线时，
+        事件不会改变任何数据，直接丢弃（只查内存，不访问数据库）。
+        写入中的 IP 不走缓存判断：缓存要等该批提交后才失效，此时的缓存条目可能已过时
+        """
+        from app.services.device_cache import DeviceCache
+
+        with cls._lock:
+            pending = ip in cls._pending or ip in cls._in_flight
+        if not pending:
+            cached, device = DeviceCache.peek(ip)
+            if cached and (device is None or device.bettercap_offline_at is not None):
+                with cls._lock:
+                    cls._stats["events"] += 1
+                    cls._stats["skipped"] += 1
+                return
+        cls._add(ip, online=False, mac=None, hostname=None, vendor=None)
+
+    @classmethod
+    def flush(cls) -> Optional[Future]:
+        """立即把缓冲中的事件交给写线程，返回写任务的 Future（缓冲为空时返回 None）"""
+        with cls._lock:
+            if cls._timer is not None:
+                cls._timer.cancel()
+                cls._timer = None
+            if not cls._pending:
+                return None
+            states, cls._pending = cls._pending, {}
+            for ip in states:
+                cls._in_flight[ip] = cls._in_flight.get(ip, 0) + 1
+
+        oldest = min(state.received for state in states.values())
+        future = DbWriter.submit(_flush_job(states))
+
+        def _on_done(f: Future):
+            latency_ms = round((time.monotonic() - oldest) * 1000, 1)
+            with cls._lock:
+                # 提交后设备缓存已失效（after_commit 先于本回调执行），可以恢复缓存判断
+                for ip in states:
+                    remaining = cls._in_flight.pop(ip, 1) - 1
+                    if remaining > 0:
+                        cls._in_flight[ip] = remaining
+                if f.exception() is not None:
+                    cls._stats["failed_flushes"] += 1
+                    logger.error(f"[Endpoint Buffer] 写入 {len(states)} 个设备状态失败: {f.exception()}")
+                    return
+                cls._stats["flushes"] += 1
+                cls._stats["flushed_ips"] += len(states)
+                cls._stats["last_flush_size"] = len(states)
+                cls._stats["last_flush_latency_ms"] = latency_ms
+                cls._stats["max_flush_latency_ms"] = max(cls._stats["max_flush_latency_ms"] or 0, latency_ms)
+
+        future.add_done_callback(_on_done)
+        return future
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._lock:
+            return {
+                **cls._stats,
+                "queue_depth": len(cls._pending),
+                "in_flight": len(cls._in_flight),
+                "flush_interval_ms": ENDPOINT_FLUSH_INTERVAL_MS,
+                "flush_max_events": ENDPOINT_FLUSH_MAX_EVENTS
+            }
+
+    @classmethod
+    def _add(cls, ip: str, **fields) -> None:
+        now = datetime.now()
+        flush_now = False
+        with cls._lock:
+            cls._stats["events"] += 1
+            previous = cls._pending.pop(ip, None)
+            if previous is not None:
+                cls._stats["coalesced"] += 1
+            # 保留最早的到达时间，延迟统计从该 IP 第一次进入缓冲算起
+            received = previous.received if previous is not None else time.monotonic()
+            cls._pending[ip] = _EndpointState(seen_at=now, received=received, **fields)
+            depth = len(cls._pending)
+            cls._stats["max_queue_depth"] = max(cls._stats["max_queue_depth"], depth)
+
+            if depth >= ENDPOINT_FLUSH_MAX_EVENTS:
+                flush_now = True
+            elif cls._timer is None:
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    flush_now = True
+                else:
+                    cls._timer = loop.call_later(ENDPOINT_FLUSH_INTERVAL_MS / 1000, cls._on_timer)
+
+        if flush_now:
+            cls.flush()
+
+    @classmethod
+    def _on_timer(cls) -> None:
+        with cls._lock:
+            cls._timer = None
+        cls.flush()
+
+
+def _flush_job(states: Dict[str, _EndpointState]):
+    """构造批量写任务：一次查询涉及的设备和在线区间，更新上线/离线状态"""
+    def job(session: Session) -> dict:
+        from app.models.device import Device
+        from app.repositories.device_presence_repo import DevicePresenceRepository
+        from app.repositories.device_repo import DeviceRepository
+        from app.services.presence_service import record_offline, record_online
+
+        device_repo = DeviceRepository(session)
+        devices = device_repo.get_by_ips(states)
+        open_sessions = DevicePresenceRepository(session).get_open_sessions(
+            "bettercap", [d.id for d in devices.values()]
+        )
+
+        created: List[tuple] = []
+        online = offline = 0
+        for ip, state in states.items():
+            device = devices.get(ip)
+            if not state.online:
+                # 未知 IP 的离线事件直接忽略
+                if device is None:
+                    continue
+                if not device.bettercap_offline_at:
+                    record_offline(session, device, "bettercap", state.seen_at, open_sessions)
+                device.bettercap_offline_at = state.seen_at
+                device.offline_at = state.seen_at  # 兼容旧字段
+                device_repo.add(device)
+                offline += 1
+                continue
+
+            online += 1
+            if device is None:
+                device = device_repo.add(Device(
+                    ip=ip,
+                    mac=state.mac,
+                    hostname=state.hostname,
+                    vendor=state.vendor,
+                    firstSeenAt=state.seen_at,
+                    lastSeenAt=state.seen_at,
+                    bettercap_last_seen=state.seen_at
+                ))
+                created.append((device, state))
+                continue
+
+            # 维护在线区间（离线 -> 在线时开启新区间）
+            record_online(session, device, "bettercap", state.seen_at, open_sessions)
+            device.lastSeenAt = state.seen_at
+            device.bettercap_last_seen = state.seen_at
+            device.bettercap_offline_at = None
+            device.offline_at = None
+            if state.mac:
+                device.mac = state.mac
+            if state.hostname:
+                device.hostname = state.hostname
+            if state.vendor:
+                device.vendor = state.vendor
+            device_repo.add(device)
+
+        if created:
+            # 新设备一次 flush 分配 ID，再开启在线区间
+            session.flush()
+            for device, state in created:
+                record_online(session, device, "bettercap", state.seen_at, open_sessions)
+
+        return {"online": online, "offline": offline, "created": len(created)}
+    return job
@@ -0,0 +1,128 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from app.models.device import Device
+from app.models.device_presence import DevicePresenceSession
+from app.repositories.device_presence_repo import DevicePresenceRepository
+
+
+def is_online_for_source(device: Device, source: str) -> bool:
+    """判断设备在指定扫描工具下当前是否在线"""
+    if source == "nmap":
+        return bool(device.nmap_last_seen and not device.nmap_offline_at)
+    if source == "bettercap":
+        return bool(device.bettercap_last_seen and not device.bettercap_offline_at)
+    return False
+
+
+def _last_seen_for_source(device: Device, source: str) -> Optional[datetime]:
+    if source == "nmap":
+        return device.nmap_last_seen
+    if source == "bettercap":
+        return device.bettercap_last_seen
+    return None
+
+
+def record_online(
+    session: Session,
+    device: Device,
+    source: str,
+    now: datetime,
+    open_sessions: Optional[Dict[int, DevicePresenceSession]] = None
+) -> None:
+    """
+    设备被某来源发现在线时维护在线区间（需在更新设备状态字段之前调用）
+
+    - 离线 -> 在线：开启新区间
+    - 已在线但没有未结束区间（升级前的旧数据）：从上次发现时间补开一个区间
+    """
+    if device.id is None:
+        return
+    repo = DevicePresenceRepository(session)
+    if open_sessions is None:
+        open_sessions = repo.get_open_sessions(source, [device.id])
+
+    current = open_sessions.get(device.id)
+    if is_online_for_source(device, source):
+        if current is None:
+            started_at = _last_seen_for_source(device, source) or now
+            open_sessions[device.id] = repo.open(device.id, source, started_at)
+        return
+
+    if current is not None:
+        # 上一个区间没有正常结束，以最后发现时间收尾
+        repo.close(current, _last_seen_for_source(device, source) or now)
+    open_sessions[device.id] = repo.open(device.id, source, now)
+
+
+def record_offline(
+    session: Session,
+    device: Device,
+    source: str,
+    now: datetime,
+    open_sessions: Optional[Dict[int, DevicePresenceSession]] = None
+) -> None:
+    """设备被某来源判定离线时结束当前在线区间"""
+    if device.id is None:
+        return
+    repo = DevicePresenceRepository(session)
+    if open_sessions is None:
+        open_sessions = repo.get_open_sessions(source, [device.id])
+
+    current = open_sessions.pop(device.id, None)
+    if current is not None:
+        repo.close(current, now)
+
+
+def merge_intervals(intervals: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """合并重叠区间（多个来源同时在线只计一次）"""
+    merged: List[Tuple[datetime, datetime]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def summarize_presence(
+    sessions: List[DevicePresenceSession],
+    start: datetime,
+    end: datetime,
+    now: Optional[datetime] = None
+) -> dict:
+    """
+    根据在线区间计算时间窗内的在线统计
+
+    Returns:
+        {"uptime_seconds", "uptime_percent", "session_count", "sessions"}
+    """
+    now = now or datetime.now()
+    window_end = min(end, now)
+    clipped: List[Tuple[datetime, datetime]] = []
+    for s in sessions:
+        s_end = s.ended_at or now
+        lo = max(s.started_at, start)
+        hi = min(s_end, window_end)
+        if hi > lo:
+            clipped.append((lo, hi))
+
+    uptime = sum((hi - lo).total_seconds() for lo, hi in merge_intervals(clipped))
+    window = (window_end - start).total_seconds()
+
+    return {
+        "uptime_seconds": round(uptime, 3),
+        "uptime_percent": round(uptime / window * 100, 2) if window > 0 else 0.0,
+        "session_count": len(sessions),
+        "sessions": [
+            {
+                "source": s.source,
+                "started_at": s.started_at,
+                "ended_at": s.ended_at
+            }
+            for s in sessions
+        ]
+    }
@@ -0,0 +1,175 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.models.arp_ban_log import ArpBanLog
+from app.models.device_address_history import DeviceAddressHistory
+from app.models.device_presence import DevicePresenceSession
+from app.models.scan_task import ScanTask
+from app.models.system_event_log import SystemEventLog
+from app.models.task_execution import TaskExecution
+from app.repositories.retention_repo import RetentionRepository
+from app.services.db_writer import DbWriter
+
+logger = logging.getLogger(__name__)
+
+# 每批删除/清空的最大行数（每批一个短事务，不长时间占用写锁）
+RETENTION_BATCH_SIZE = 2000
+# 增量 VACUUM 每次释放的页数
+VACUUM_PAGES_PER_STEP = 1000
+# 启动时转换为增量 VACUUM 模式的数据库大小上限（MB）；完整 VACUUM 会独占并重写整个库，更大的库需在维护时手动转换
+VACUUM_CONVERT_MAX_MB = int(os.getenv("VACUUM_CONVERT_MAX_MB", "256"))
+
+_FINISHED_SCAN = ScanTask.status.in_(("completed", "failed"))
+_FINISHED_EXECUTION = TaskExecution.status != "running"
+
+# 删除策略：(名称, 模型, 时间列, 保留时长, 额外条件)
+DELETE_POLICIES = [
+    ("system_event_logs", SystemEventLog, "created_at", timedelta(days=30), []),
+    ("arp_ban_log", ArpBanLog, "created_at", timedelta(days=90), []),
+    ("scan_tasks", ScanTask, "created_at", timedelta(days=30), [_FINISHED_SCAN]),
+    ("taskexecution", TaskExecution, "started_at", timedelta(days=90), [_FINISHED_EXECUTION]),
+    ("device_presence_sessions", DevicePresenceSession, "ended_at", timedelta(days=365), []),
+    ("device_address_history", DeviceAddressHistory, "changed_at", timedelta(days=365), []),
+]
+
+# 压缩策略：超过保留时长的行保留统计信息，只清空原始输出 (名称, 模型, 清空的列, 时间列, 保留时长, 额外条件)
+COMPACT_POLICIES = [
+    ("scan_tasks.raw_output", ScanTask, "raw_output", "created_at", timedelta(days=3), [_FINISHED_SCAN]),
+    ("taskexecution.raw_output", TaskExecution, "raw_output", "started_at", timedelta(days=7), [_FINISHED_EXECUTION]),
+]
+
+_last_report: Optional[dict] = None
+
+
+def _run_batches(job) -> int:
+    """反复提交同一个批处理写任务，直到某一批不足 RETENTION_BATCH_SIZE 行"""
+    total = 0
+    while True:
+        count = DbWriter.submit(job).result()
+        total += count
+        if count < RETENTION_BATCH_SIZE:
+            return total
+
+
+def _page_stats() -> Optional[Dict[str, int]]:
+    from app.models.db import engine
+
+    with Session(engine) as session:
+        return RetentionRepository(session).get_page_stats()
+
+
+def convert_to_incremental_vacuum(max_mb: int = VACUUM_CONVERT_MAX_MB) -> bool:
+    """
+    把已有数据库切换到 auto_vacuum=INCREMENTAL（启动时、写线程启动前调用）
+
+    需要一次完整 VACUUM：独占整个数据库并重写文件，不能在事务中执行，也不应在请求路径上执行。
+    数据库超过 max_mb 时跳过并记录日志，由维护时设置更大的 VACUUM_CONVERT_MAX_MB 重启完成转换。
+
+    Returns:
+        是否执行了转换
+    """
+    from app.models.db import engine
+
+    stats = _page_stats()
+    if stats is None or stats["auto_vacuum"] == 2:
+        return False
+    size_mb = stats["page_count"] * stats["page_size"] / 1024 / 1024
+    if size_mb > max_mb:
+        logger.warning(
+            f"[Retention] 数据库 {size_mb:.1f} MB 超过 {max_mb} MB，跳过增量 VACUUM 模式转换；"
+            f"请在维护时设置 VACUUM_CONVERT_MAX_MB 后重启完成转换"
+        )
+        return False
+
+    logger.info(f"[Retention] 转换数据库为增量 VACUUM 模式（完整 VACUUM，{size_mb:.1f} MB）...")
+    started = time.monotonic()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+        connection.execute(text("VACUUM"))
+    logger.info(f"[Retention] 增量 VACUUM 模式转换完成，耗时 {time.monotonic() - started:.1f} 秒")
+    return True
+
+
+def _incremental_vacuum_job(session: Session) -> None:
+    """释放最多 VACUUM_PAGES_PER_STEP 个空闲页"""
+    from app.models.db import engine
+
+    # SQLite 每执行一步只释放一页，executescript 会把语句执行完；它会先提交，所以使用独立连接
+    connection = engine.raw_connection()
+    try:
+        connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP});")
+    finally:
+        connection.close()
+
+
+def _vacuum(stats: Dict[str, int]) -> None:
+    """归还空闲页：按批增量释放；数据库尚未转换为增量模式时跳过（转换只在启动时进行）"""
+    if stats["auto_vacuum"] != 2:
+        logger.info("[Retention] 数据库未启用增量 VACUUM，跳过空间回收（启动时转换，见 VACUUM_CONVERT_MAX_MB）")
+        return
+
+    freelist = stats["freelist_count"]
+    while freelist > 0:
+        DbWriter.submit(_incremental_vacuum_job, isolated=True).result()
+        freelist -= VACUUM_PAGES_PER_STEP
+
+
+def run_retention(now: Optional[datetime] = None) -> dict:
+    """
+    执行数据保留策略
+
+    按策略分批删除过期行、清空旧的原始输出，最后用增量 VACUUM 把空闲页归还给文件系统。
+    所有写入经由写线程，每批一个短事务。
+
+    Returns:
+        报告：各表删除/清空的行数、回收的字节数、耗时
+    """
+    global _last_report
+    now = now or datetime.now()
+    started = time.monotonic()
+    before = _page_stats()
+
+    deleted: Dict[str, int] = {}
+    for name, model, time_column, keep, extra in DELETE_POLICIES:
+        conditions: List = [getattr(model, time_column) < now - keep, *extra]
+        deleted[name] = _run_batches(
+            lambda s: RetentionRepository(s).delete_batch(model, conditions, RETENTION_BATCH_SIZE)
+        )
+
+    compacted: Dict[str, int] = {}
+    for name, model, column, time_column, keep, extra in COMPACT_POLICIES:
+        conditions = [getattr(model, time_column) < now - keep, *extra]
+        compacted[name] = _run_batches(
+            lambda s: RetentionRepository(s).clear_column_batch(model, column, conditions, RETENTION_BATCH_SIZE)
+        )
+
+    bytes_reclaimed = 0
+    if before is not None:
+        _vacuum(_page_stats())
+        after = _page_stats()
+        bytes_reclaimed = max(0, (before["page_count"] - after["page_count"]) * after["page_size"])
+
+    report = {
+        "run_at": now,
+        "deleted": deleted,
+        "compacted": compacted,
+        "bytes_reclaimed": bytes_reclaimed,
+        "duration_seconds": round(time.monotonic() - started, 2)
+    }
+    _last_report = report
+    logger.info(
+        f"[Retention] 删除 {sum(deleted.values())} 行，清空 {sum(compacted.values())} 条原始输出，"
+        f"回收 {bytes_reclaimed / 1024 / 1024:.1f} MB"
+    )
+    return report
+
+
+def get_last_report() -> Optional[dict]:
+    """最近一次执行的报告（本进程未执行过时为 None）"""
+    return _last_report
@@ -1,5 +1,7 @@
 import asyncio
 import contextlib
+import json
+import logging
 import re
 import shutil
 import subprocess
@@ -10,6 +12,14 @@ from sqlmodel import Session
 
 from app.models.device import Device
 from app.repositories.device_repo import DeviceRepository
+from app.repositories.device_presence_repo import DevicePresenceRepository
+from app.repositories.device_tag_repo import DeviceTagRepository, normalize_tags
+from app.repositories.unit_of_work import unit_of_work
+from app.services.device_identity_service import normalize_mac, resolve_device_identities
+from app.services.presence_service import record_online, record_offline
+from app.services.stats_rollup_service import record_scan_rollup
+
+logger = logging.getLogger(__name__)
 
 
 def _get_local_machine_info(ip: str) -> Optional[Dict[str, Optional[str]]]:
@@ -280,15 +290,17 @@ def upsert_devices(session: Session, online_ips: List[str]) -> int:
     repo = DeviceRepository(session)
     updated = 0
     now = datetime.now()
-    for ip in online_ips:
-        d = repo.get_by_ip(ip)
-        if d:
-            d.lastSeenAt = now
-            repo.update(d)
-        else:
-            d = Device(ip=ip, firstSeenAt=now, lastSeenAt=now)
-            repo.create(d)
-        updated += 1
+    with unit_of_work(session):
+        existing = repo.get_by_ips(online_ips)
+        for ip in online_ips:
+            d = existing.get(ip)
+            if d:
+                d.lastSeenAt = now
+                repo.update(d)
+            else:
+                d = Device(ip=ip, firstSeenAt=now, lastSeenAt=now)
+                existing[ip] = repo.create(d)
+            updated += 1
     return updated
 
 
@@ -297,7 +309,8 @@ def upsert_devices_with_info(
     devices_info: Dict[str, Dict[str, Optional[str]]],
     mark_offline: bool = False,
     target_cidrs: Optional[List[str]] = None,
-    scan_tool: str = "nmap"  # 新增：扫描工具类型（nmap 或 bettercap）
+    scan_tool: str = "nmap",  # 新增：扫描工具类型（nmap 或 bettercap）
+    scanned_hosts: Optional[Dict[str, Dict[str, Optional[str]]]] = None
 ) -> Tuple[int, int, int]:
     """
     更新或创建设备记录（包含 MAC 地址、主机名、操作系统等详细信息）
@@ -308,11 +321,13 @@ def upsert_devices_with_info(
         mark_offline: 是否标记离线设备
         target_cidrs: 目标网段列表，用于确定哪些设备应该被标记为离线
         scan_tool: 扫描工具类型（nmap 或 bettercap），用于双状态跟踪
+        scanned_hosts: 本次发现的全部主机（增量同步时 devices_info 只是其中要写入的部分），
+            身份识别、离线判断和在线数统计按全部主机进行；为 None 时即 devices_info
         
     Returns:
         (更新数量, 新设备数量, 离线数量)
     """
-    from app.utils.cidr import expand_cidrs
+    from app.utils.cidr import AddressSet
     
     repo = DeviceRepository(session)
     updated = 0
@@ -320,9 +335,10 @@ def upsert_devices_with_info(
     offline_count = 0
     now = datetime.now()
     
-    online_ips = set(devices_info.keys())
+    online_ips = set((scanned_hosts if scanned_hosts is not None else devices_info).keys())
+    new_ips: List[str] = []
+    offline_ips: List[str] = []
     
-    # 更新在线设备
     for ip, info in devices_info.items():
         # 如果设备没有 MAC 地址，尝试检测是否为本机
         if not info.get('mac'):
@@ -333,69 +349,211 @@ def upsert_devices_with_info(
                     info['mac'] = local_info.get('mac')
                 if not info.get('vendor'):
                     info['vendor'] = local_info.get('vendor')
-        
-        d = repo.get_by_ip(ip)
-        if d:
-            # 更新现有设备
-            d.lastSeenAt = now
-            d.offline_at = None  # 清除旧的离线标记（兼容）
+        info['mac'] = normalize_mac(info.get('mac'))
+    
+    # 设备、在线区间和统计在一个工作单元中修改，整次扫描只提交一次
+    with unit_of_work(session):
+        # 一次性加载本次发现的设备和该扫描工具下所有未结束的在线区间，避免逐台查询
+        existing_devices = repo.get_by_ips(online_ips)
+        open_sessions = DevicePresenceRepository(session).get_open_sessions(scan_tool)
+    
+        # 按 MAC 识别换了 IP 的设备，迁移到新 IP 而不是当作新设备
+        moves = resolve_device_identities(
+            session, devices_info, existing_devices, now, open_sessions, scanned_hosts=scanned_hosts
+        )
+    
+        # 更新在线设备
+        for ip, info in devices_info.items():
+            d = existing_devices.get(ip)
+            if d:
+                # 维护在线区间（需在更新状态字段之前判断是否为上线）
+                record_online(session, d, scan_tool, now, open_sessions)
             
-            # 根据扫描工具更新对应的状态字段
-            if scan_tool == "nmap":
-                d.nmap_last_seen = now
-                d.nmap_offline_at = None
-            elif scan_tool == "bettercap":
-                d.bettercap_last_seen = now
-                d.bettercap_offline_at = None
+                # 更新现有设备
+                d.lastSeenAt = now
+                d.offline_at = None  # 清除旧的离线标记（兼容）
             
-            # 更新设备信息（两种扫描都可以更新）
-            if info.get('mac'):
-                d.mac = info['mac']
-            if info.get('hostname'):
-                d.hostname = info['hostname']
-            if info.get('vendor'):
-                d.vendor = info['vendor']
-            if info.get('os'):
-                d.os = info['os']
-            repo.update(d)
-            updated += 1
-        else:
-            # 只为有 MAC 地址或主机名的设备创建记录
-            if info.get('mac') or info.get('hostname'):
-                d = Device(
-                    ip=ip,
-                    mac=info.get('mac'),
-                    hostname=info.get('hostname'),
-                    vendor=info.get('vendor'),
-                    os=info.get('os'),
-                    firstSeenAt=now,
-                    lastSeenAt=now,
-                    # 初始化双状态
-                    nmap_last_seen=now if scan_tool == "nmap" else None,
-                    bettercap_last_seen=now if scan_tool == "bettercap" else None
-                )
-                repo.create(d)
-                new_count += 1
-    
-    # 标记离线设备（按扫描工具分别标记）
-    if mark_offline and target_cidrs:
-        all_target_ips = set(expand_cidrs(target_cidrs))
-        all_devices = repo.list()
-        
-        for device in all_devices:
-            if device.ip in all_target_ips and device.ip not in online_ips:
-                # 设备在目标网段内，但本次扫描未发现
+                # 根据扫描工具更新对应的状态字段
                 if scan_tool == "nmap":
-                    if not device.nmap_offline_at:
-                        device.nmap_offline_at = now
-                        device.offline_at = now  # 同时更新旧字段
-                        repo.update(device)
-                        offline_count += 1
+                    d.nmap_last_seen = now
+                    d.nmap_offline_at = None
                 elif scan_tool == "bettercap":
-                    if not device.bettercap_offline_at:
-                        device.bettercap_offline_at = now
-                        device.offline_at = now  # 同时更新旧字段
-                        repo.update(device)
-                        offline_count += 1
+                    d.bettercap_last_seen = now
+                    d.bettercap_offline_at = None
+            
+                # 更新设备信息（两种扫描都可以更新）
+                if info.get('mac'):
+                    d.mac = info['mac']
+                if info.get('hostname'):
+                    d.hostname = info['hostname']
+                if info.get('vendor'):
+                    d.vendor = info['vendor']
+                if info.get('os'):
+                    d.os = info['os']
+                repo.update(d)
+                updated += 1
+            else:
+                # 只为有 MAC 地址或主机名的设备创建记录
+                if info.get('mac') or info.get('hostname'):
+                    d = Device(
+                        ip=ip,
+                        mac=info.get('mac'),
+                        hostname=info.get('hostname'),
+                        vendor=info.get('vendor'),
+                        os=info.get('os'),
+                        firstSeenAt=now,
+                        lastSeenAt=now,
+                        # 初始化双状态
+                        nmap_last_seen=now if scan_tool == "nmap" else None,
+                        bettercap_last_seen=now if scan_tool == "bettercap" else None
+                    )
+                    repo.create(d)
+                    record_online(session, d, scan_tool, now, open_sessions)
+                    new_ips.append(ip)
+                    new_count += 1
+    
+        # 标记离线设备（按扫描工具分别标记）
+        if mark_offline and target_cidrs:
+            all_target_ips = AddressSet(target_cidrs)
+            all_devices = repo.list()
+        
+            for device in all_devices:
+                if device.ip in all_target_ips and device.ip not in online_ips:
+                    # 设备在目标网段内，但本次扫描未发现
+                    if scan_tool == "nmap":
+                        if not device.nmap_offline_at:
+                            record_offline(session, device, scan_tool, now, open_sessions)
+                            device.nmap_offline_at = now
+                            device.offline_at = now  # 同时更新旧字段
+                            repo.update(device)
+                            offline_ips.append(device.ip)
+                            offline_count += 1
+                    elif scan_tool == "bettercap":
+                        if not device.bettercap_offline_at:
+                            record_offline(session, device, scan_tool, now, open_sessions)
+                            device.bettercap_offline_at = now
+                            device.offline_at = now  # 同时更新旧字段
+                            repo.update(device)
+                            offline_ips.append(device.ip)
+                            offline_count += 1
+    
+        # 增量更新网段活动统计（分钟/小时/天）
+        record_scan_rollup(session, online_ips, new_ips, offline_ips, target_cidrs, now)
+    
+    if moves:
+        logger.info(f"[Identity] 本次扫描有 {len(moves)} 台设备更换了 IP")
     
     return updated + new_count, new_count, offline_count
+
+
+def mark_devices_offline(
+    session: Session,
+    ips: List[str],
+    target_cidrs: Optional[List[str]] = None,
+    scan_tool: str = "nmap",
+    online_ips: Optional[List[str]] = None
+) -> int:
+    """
+    把指定 IP 的设备标记为离线（增量同步时用于处理消失的主机）
+
+    与 upsert_devices_with_info(mark_offline=True) 的规则一致：只标记目标网段内、
+    该扫描工具下尚未离线的设备；未给出目标网段时不标记。
+    online_ips 为本次发现的全部在线主机，用于网段统计的在线数（不传时不记录在线数）。
+
+    Returns:
+        离线数量
+    """
+    from app.utils.cidr import AddressSet
+
+    if not ips or not target_cidrs:
+        return 0
+
+    target_ips = AddressSet(target_cidrs)
+    ips = [ip for ip in ips if ip in target_ips]
+    if not ips:
+        return 0
+
+    repo = DeviceRepository(session)
+    offline_ips: List[str] = []
+    now = datetime.now()
+
+    with unit_of_work(session):
+        devices = repo.get_by_ips(ips)
+        open_sessions = DevicePresenceRepository(session).get_open_sessions(
+            scan_tool, [d.id for d in devices.values()]
+        )
+        for ip, device in devices.items():
+            if scan_tool == "nmap":
+                if device.nmap_offline_at:
+                    continue
+                device.nmap_offline_at = now
+            elif scan_tool == "bettercap":
+                if device.bettercap_offline_at:
+                    continue
+                device.bettercap_offline_at = now
+            else:
+                continue
+            record_offline(session, device, scan_tool, now, open_sessions)
+            device.offline_at = now  # 同时更新旧字段
+            repo.update(device)
+            offline_ips.append(ip)
+
+        if offline_ips:
+            record_scan_rollup(session, online_ips or [], [], offline_ips, target_cidrs, now)
+
+    return len(offline_ips)
+
+
+# 导入时可合并的设备字段
+MERGE_FIELDS = ("mac", "hostname", "vendor", "os", "note")
+
+
+def merge_device_records(session: Session, records: List[Dict[str, object]]) -> Tuple[int, int]:
+    """
+    把一批设备清单记录合并到设备表（用于批量导入）
+
+    按 IP 批量查询已有设备：已存在的只覆盖记录中非空的字段，不存在的新建；
+    不改变在线状态。整批只提交一次。
+
+    Args:
+        session: 数据库会话
+        records: 设备记录列表，每条至少包含 ip，tags 为字符串列表
+
+    Returns:
+        (新建数量, 更新数量)
+    """
+    repo = DeviceRepository(session)
+    existing = repo.get_by_ips(r["ip"] for r in records)
+    tagged: Dict[str, List[str]] = {}
+    created = 0
+    updated = 0
+    now = datetime.now()
+
+    for record in records:
+        ip = record["ip"]
+        d = existing.get(ip)
+        if d is None:
+            d = Device(ip=ip, firstSeenAt=record.get("firstSeenAt") or now)
+            existing[ip] = d
+            created += 1
+        else:
+            updated += 1
+
+        for field in MERGE_FIELDS:
+            value = record.get(field)
+            if value:
+                setattr(d, field, value)
+        if record.get("tags") is not None:
+            tags = normalize_tags(record["tags"])
+            d.tags = json.dumps(tags, ensure_ascii=False)
+            tagged[ip] = tags
+        session.add(d)
+
+    # 新设备需要先分配 ID 才能写入标签表
+    session.flush()
+    tag_repo = DeviceTagRepository(session)
+    for ip, tags in tagged.items():
+        tag_repo.set_tags(existing[ip].id, tags)
+
+    session.commit()
+    return created, updated
@@ -3,6 +3,7 @@ import json
 import logging
 import fcntl
 import os
+from collections import OrderedDict
 from datetime import datetime
 from typing import Optional
 
@@ -16,10 +17,15 @@ from app.models.scheduled_task import ScheduledTask
 from app.models.task_execution import TaskExecution
 from app.repositories.scheduled_task_repo import ScheduledTaskRepository
 from app.repositories.task_execution_repo import TaskExecutionRepository
-from app.repositories.app_config_repo import AppConfigRepository
 from app.services.scan_service import scan_nmap, upsert_devices_with_info
-from app.services.bettercap_service import BettercapClientManager
+from app.services.bettercap_service import BettercapClientClosed, BettercapClientManager, EventStreamUnavailable
+from app.services.config_cache import ConfigCache
+from app.services.db_writer import DbWriter
+from app.services.endpoint_event_buffer import EndpointEventBuffer
+from app.services.task_log_store import LogSlice, TaskLogStore
 from app.repositories.system_event_log_repo import SystemEventLogRepository
+from app.services.stats_rollup_service import prune_rollups
+from app.services.retention_service import run_retention
 
 logger = logging.getLogger(__name__)
 
@@ -28,44 +34,57 @@ _scheduler: Optional[BackgroundScheduler] = None
 _running_tasks = set()  # 正在运行的任务ID，防止并发执行
 _scheduler_lock_file = None  # 调度器文件锁
 _bettercap_continuous_tasks = {}  # 存储持续运行的 Bettercap 任务
-_bettercap_task_logs = {}  # 存储 Bettercap 任务的原始日志（task_id -> list of log lines）
-_bettercap_task_friendly_logs = {}  # 存储 Bettercap 任务的友好日志，用于历史记录（task_id -> list of log lines）
 
 
 def _log_system_event(event_type: str, message: str, details: str = None, severity: str = "info"):
-    """记录系统事件日志到数据库"""
+    """记录系统事件日志到数据库（经由写线程异步写入）"""
+    def _on_done(future):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Failed to log system event {event_type}: {error}")
+        else:
+            logger.info(f"System event logged: {event_type} - {message}")
+
     try:
-        with Session(engine) as session:
-            repo = SystemEventLogRepository(session)
-            repo.create(
+        DbWriter.submit(
+            lambda session: SystemEventLogRepository(session).add(
                 event_type=event_type,
                 message=message,
                 details=details,
                 severity=severity
             )
-            logger.info(f"System event logged: {event_type} - {message}")
+        ).add_done_callback(_on_done)
     except Exception as e:
         logger.error(f"Failed to log system event: {e}")
 
 
-def _cleanup_old_system_logs():
-    """清理30天前的系统事件日志"""
+def _run_data_retention():
+    """执行数据保留策略：分批清理过期日志/历史、清空旧的原始输出并回收空间"""
     try:
-        with Session(engine) as session:
-            repo = SystemEventLogRepository(session)
-            deleted_count = repo.cleanup_old_logs(days=30)
-            logger.info(f"[System Log Cleanup] Deleted {deleted_count} old system logs")
-            
-            # 记录清理操作本身
-            if deleted_count > 0:
-                repo.create(
-                    event_type="system_log_cleanup",
-                    message=f"自动清理了{deleted_count}条30天前的系统日志",
-                    details=json.dumps({"deleted_count": deleted_count}),
-                    severity="info"
-                )
+        report = run_retention()
+        deleted_count = sum(report["deleted"].values())
+        compacted_count = sum(report["compacted"].values())
+        if deleted_count or compacted_count:
+            _log_system_event(
+                event_type="data_retention",
+                message=(
+                    f"自动清理了{deleted_count}条过期记录，清空{compacted_count}条旧的原始输出，"
+                    f"回收{report['bytes_reclaimed'] / 1024 / 1024:.1f}MB"
+                ),
+                details=json.dumps(report, default=str)
+            )
     except Exception as e:
-        logger.error(f"[System Log Cleanup] Failed to cleanup old logs: {e}")
+        logger.error(f"[Retention] Failed to run data retention: {e}")
+
+
+def _prune_stats_rollups():
+    """按保留策略清理过期的网段统计时间桶"""
+    try:
+        # 经由写线程执行（prune_rollups 自行提交，作为 isolated 任务单独成批）
+        deleted_count = DbWriter.submit(prune_rollups, isolated=True).result()
+        logger.info(f"[Stats Rollup] Pruned {deleted_count} expired stats buckets")
+    except Exception as e:
+        logger.error(f"[Stats Rollup] Failed to prune stats buckets: {e}")
 
 
 def validate_cron_expression(cron_expr: str) -> bool:
@@ -77,22 +96,16 @@ def validate_cron_expression(cron_expr: str) -> bool:
         return False
 
 
-def _add_bettercap_log(task_id: int, message: str, friendly_message: str = None, max_lines: int = 1000, add_timestamp: bool = True):
+def _add_bettercap_log(task_id: int, message: str, friendly_message: str = None, add_timestamp: bool = True):
     """
-    添加 Bettercap 任务日志
+    添加 Bettercap 任务日志（写入 TaskLogStore 的环形缓冲，保留行数见 TASK_LOG_MAX_LINES）
     
     Args:
         task_id: 任务ID
         message: 原始日志消息
         friendly_message: 友好格式的日志消息（用于历史记录），如果为None则使用message
-        max_lines: 最大日志行数
         add_timestamp: 是否添加时间戳
     """
-    if task_id not in _bettercap_task_logs:
-        _bettercap_task_logs[task_id] = []
-    if task_id not in _bettercap_task_friendly_logs:
-        _bettercap_task_friendly_logs[task_id] = []
-    
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     # 原始日志：根据参数决定是否添加时间戳
@@ -101,17 +114,286 @@ def _add_bettercap_log(task_id: int, message: str, friendly_message: str = None,
     else:
         raw_log_line = message
     
-    _bettercap_task_logs[task_id].append(raw_log_line)
+    TaskLogStore.append(task_id, "raw", raw_log_line)
     
     # 友好日志：始终添加时间戳
     friendly_log_line = f"[{timestamp}] {friendly_message if friendly_message else message}"
-    _bettercap_task_friendly_logs[task_id].append(friendly_log_line)
+    TaskLogStore.append(task_id, "friendly", friendly_log_line)
+
+
+def _handle_bettercap_event(task_id: int, event: dict):
+    """记录一条 Bettercap 事件到任务日志，设备上线/离线事件交给写线程更新数据库"""
+    # 获取事件信息
+    tag = event.get('tag', '')
+    time_str = event.get('time', '')
+    
+    # 格式化时间（只显示时:分:秒）
+    if 'T' in time_str:
+        time_display = time_str.split('T')[1].split('.')[0] if 'T' in time_str else time_str
+    else:
+        time_display = time_str
+    
+    # 获取事件数据
+    data = event.get('data', {})
+    
+    # 根据事件类型格式化输出（模拟 bettercap 原始输出）
+    if tag == 'endpoint.new':
+        endpoint = data.get('endpoint', {})
+        ip = endpoint.get('ipv4', '')
+        mac = endpoint.get('mac', '')
+        hostname = endpoint.get('hostname', '')
+        vendor = endpoint.get('vendor', '')
+        
+        # 构建类似 bettercap 原始输出的格式
+        raw_output = f"[{time_display}] [sys.log] [inf] endpoint.new {ip}"
+        if mac:
+            raw_output += f" {mac}"
+        if hostname:
+            raw_output += f" {hostname}"
+        if vendor:
+            raw_output += f" ({vendor})"
+        
+        # 构建友好格式
+        device_name = hostname or vendor or mac[:17] if mac else ip
+        friendly_output = f"🟢 设备上线: {ip} ({device_name})"
+        
+        _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
+        
+        # 更新该设备为在线（写入缓冲按 IP 合并，定时批量提交）
+        if ip and (mac or hostname):
+            EndpointEventBuffer.record_online(ip, mac, hostname, vendor)
     
-    # 保持日志数量在限制内
-    if len(_bettercap_task_logs[task_id]) > max_lines:
-        _bettercap_task_logs[task_id] = _bettercap_task_logs[task_id][-max_lines:]
-    if len(_bettercap_task_friendly_logs[task_id]) > max_lines:
-        _bettercap_task_friendly_logs[task_id] = _bettercap_task_friendly_logs[task_id][-max_lines:]
+    elif tag == 'endpoint.lost':
+        endpoint = data.get('endpoint', {})
+        ip = endpoint.get('ipv4', '')
+        mac = endpoint.get('mac', '')
+        hostname = endpoint.get('hostname', '')
+        vendor = endpoint.get('vendor', '')
+        
+        raw_output = f"[{time_display}] [sys.log] [inf] endpoint.lost {ip}"
+        if mac:
+            raw_output += f" {mac}"
+        
+        # 构建友好格式
+        device_name = hostname or vendor or mac[:17] if mac else ip
+        friendly_output = f"🔴 设备离线: {ip} ({device_name})"
+        
+        _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
+        
+        # 标记该设备为离线（写入缓冲按 IP 合并，定时批量提交）
+        if ip:
+            EndpointEventBuffer.record_offline(ip)
+    
+    elif tag.startswith('wifi.') or tag.startswith('ble.') or tag.startswith('hid.'):
+        # 无线相关事件
+        raw_output = f"[{time_display}] [sys.log] [inf] {tag} {json.dumps(data)}"
+        friendly_output = f"📡 {tag}"
+        _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
+    
+    elif tag == 'sys.log':
+        # 系统日志
+        message = data.get('Message', '')
+        level = data.get('Level', 'inf')
+        raw_output = f"[{time_display}] [sys.log] [{level}] {message}"
+        friendly_output = f"ℹ️ {message}"
+        _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
+    
+    else:
+        # 其他事件，显示原始 JSON
+        raw_output = f"[{time_display}] [{tag}] {json.dumps(data)}"
+        friendly_output = f"📋 {tag}"
+        _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
+
+
+# Bettercap 事件接收：WebSocket 推送优先，不可用时按 EVENT_POLL_INTERVAL 轮询 REST
+EVENT_POLL_INTERVAL = 2
+EVENT_STREAM_MAX_BACKOFF = 30  # 断线重连的最大退避（秒）
+EVENT_BACKFILL_LIMIT = 500  # 重连补齐 / 轮询时从 REST 拉取的事件数
+EVENT_SEEN_SIZE = 2048  # 去重用的最近事件数
+HOST_SYNC_INTERVAL = 60  # 主机列表同步间隔（秒），只写入与上次快照相比有变化的主机
+HOST_FULL_SYNC_INTERVAL = 3600  # 全量同步间隔（秒），刷新最后发现时间并修正与数据库的偏差
+
+
+def _host_fingerprint(info: dict) -> tuple:
+    """主机快照中比较的字段"""
+    return (info.get("mac"), info.get("hostname"), info.get("vendor"))
+
+
+def _diff_hosts(snapshot: dict, hosts: dict):
+    """
+    对比上次同步的快照（ip -> 指纹）和本次主机列表
+
+    Returns:
+        (新增或信息变化的主机 ip -> 设备信息, 消失的主机 IP 列表)
+    """
+    changed = {
+        ip: info for ip, info in hosts.items()
+        if snapshot.get(ip) != _host_fingerprint(info)
+    }
+    vanished = [ip for ip in snapshot if ip not in hosts]
+    return changed, vanished
+
+
+def _sync_host_diff(hosts: dict, changed: dict, vanished: list, cidrs: list):
+    """
+    构造增量同步写任务：新增/变化的主机按扫描结果更新，消失的主机标记离线，一次提交
+
+    身份识别和网段在线数统计仍按本次发现的全部主机（hosts）进行，
+    避免未变化的在线主机被当作换了 IP，或在线数只统计到有变化的主机。
+    """
+    def job(session: Session):
+        from app.repositories.unit_of_work import unit_of_work
+        from app.services.scan_service import mark_devices_offline
+        
+        updated = new_count = 0
+        with unit_of_work(session):
+            if changed:
+                updated, new_count, _ = upsert_devices_with_info(
+                    session,
+                    changed,
+                    mark_offline=False,
+                    target_cidrs=cidrs,
+                    scan_tool="bettercap",
+                    scanned_hosts=hosts
+                )
+            offline_count = mark_devices_offline(
+                session, vanished, target_cidrs=cidrs, scan_tool="bettercap", online_ips=list(hosts)
+            )
+        return updated, new_count, offline_count
+    return job
+
+
+# 事件流结束标记
+_STREAM_END = object()
+
+
+def _event_key(event: dict):
+    """事件去重键：有 id 时用 id，否则用时间 + 类型 + 数据"""
+    if event.get('id') is not None:
+        return event['id']
+    return (event.get('time'), event.get('tag'), json.dumps(event.get('data'), sort_keys=True, default=str))
+
+
+class _BettercapEventFeed:
+    """
+    Bettercap 事件接收
+
+    - WebSocket 长连接（/api/events），事件到达即处理，空闲时没有轮询开销
+    - 断线后按指数退避重连；连接建立后先缓冲推送的事件，再用 REST /api/events 补齐断线期间的事件，
+      最后处理缓冲（按最近事件去重）
+    - 补齐时 REST 返回的事件全部是新的且数量达到上限，说明有事件超出缓冲被丢弃，
+      置位 resync_needed，由监控循环立即全量同步主机列表
+    - WebSocket 不可用（未安装 websockets 或 Bettercap 未开启 api.rest.websocket）时回退为 REST 轮询
+    """
+
+    def __init__(self, task_id: int, client):
+        self.task_id = task_id
+        self.client = client
+        self.resync_needed = asyncio.Event()
+        self._seen: "OrderedDict[object, None]" = OrderedDict()
+
+    async def wait_resync(self, timeout: float) -> bool:
+        """等待需要全量同步（事件丢失）或超时，返回是否需要全量同步"""
+        try:
+            await asyncio.wait_for(self.resync_needed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        requested = self.resync_needed.is_set()
+        self.resync_needed.clear()
+        return requested
+
+    def _accept(self, event: dict) -> bool:
+        """是否是未处理过的事件（同时记录为已处理）"""
+        key = _event_key(event)
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > EVENT_SEEN_SIZE:
+            self._seen.popitem(last=False)
+        return True
+
+    async def _backfill(self) -> int:
+        """从 REST 拉取最近事件并处理其中未处理过的，返回处理数"""
+        had_seen = bool(self._seen)
+        events = await self.client.get_events(limit=EVENT_BACKFILL_LIMIT)
+        new_events = [e for e in reversed(events) if self._accept(e)]  # 从旧到新排序
+        if had_seen and events and len(new_events) == len(events) >= EVENT_BACKFILL_LIMIT:
+            logger.warning(f"Task {self.task_id}: Bettercap events exceeded the backfill window, forcing host resync")
+            _add_bettercap_log(
+                self.task_id,
+                f"[事件] 断线期间事件超过 {EVENT_BACKFILL_LIMIT} 条，立即全量同步主机列表",
+                friendly_message="⚠ 部分事件已丢失，立即全量同步设备",
+                add_timestamp=True
+            )
+            self.resync_needed.set()
+        for event in new_events:
+            _handle_bettercap_event(self.task_id, event)
+        return len(new_events)
+
+    async def run(self):
+        backoff = 1
+        while True:
+            try:
+                # 先建立连接并开始缓冲推送的事件，再用 REST 补齐，避免补齐与连接之间的事件丢失
+                stream = await self.client.open_event_stream()
+                buffer: asyncio.Queue = asyncio.Queue()
+                reader = asyncio.create_task(self._read_stream(stream, buffer))
+                try:
+                    await self._backfill()
+                    while True:
+                        event = await buffer.get()
+                        if event is _STREAM_END:
+                            break
+                        if isinstance(event, Exception):
+                            raise event
+                        backoff = 1
+                        if self._accept(event):
+                            _handle_bettercap_event(self.task_id, event)
+                finally:
+                    reader.cancel()
+                    await asyncio.gather(reader, return_exceptions=True)
+                    await stream.aclose()
+                logger.info(f"Task {self.task_id}: Bettercap event stream closed, reconnecting")
+            except EventStreamUnavailable as e:
+                logger.info(f"Task {self.task_id}: Bettercap event stream unavailable ({e}), falling back to polling")
+                _add_bettercap_log(
+                    self.task_id,
+                    f"[事件] WebSocket 事件流不可用（{e}），改为每 {EVENT_POLL_INTERVAL} 秒轮询",
+                    friendly_message="ℹ️ 事件推送不可用，改为定时拉取事件",
+                    add_timestamp=True
+                )
+                await self._poll()
+                return
+            except (asyncio.CancelledError, BettercapClientClosed):
+                raise
+            except Exception as e:
+                logger.warning(f"Task {self.task_id}: Bettercap event stream error: {e}, reconnecting in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, EVENT_STREAM_MAX_BACKOFF)
+
+    @staticmethod
+    async def _read_stream(stream, buffer: asyncio.Queue):
+        """把推送的事件放入缓冲；连接结束时放入 _STREAM_END，出错时放入异常"""
+        try:
+            async for event in stream:
+                buffer.put_nowait(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            buffer.put_nowait(e)
+            return
+        buffer.put_nowait(_STREAM_END)
+
+    async def _poll(self):
+        """REST 轮询（WebSocket 不可用时）"""
+        while True:
+            try:
+                await self._backfill()
+            except (asyncio.CancelledError, BettercapClientClosed):
+                raise
+            except Exception as e:
+                logger.debug(f"Task {self.task_id}: Failed to get events: {e}")
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
 
 
 async def start_bettercap_continuous_monitoring(task_id: int, cidrs: list):
@@ -125,32 +407,29 @@ async def start_bettercap_continuous_monitoring(task_id: int, cidrs: list):
         add_timestamp=True
     )
     
-    # 加载配置
+    # 加载配置（配置缓存）
     try:
-        with Session(engine) as session:
-            config_repo = AppConfigRepository(session)
-            config = config_repo.get_by_key("bettercap_config")
-            if not config:
-                # 配置不存在时记录错误并返回
-                error_msg = "Bettercap 配置不存在，请先在设置页面配置"
-                logger.error(f"Task {task_id}: {error_msg}")
-                _add_bettercap_log(
-                    task_id,
-                    f"[错误] {error_msg}",
-                    friendly_message=f"❌ {error_msg}",
-                    add_timestamp=True
-                )
-                return
-            
-            config_dict = json.loads(config.value)
-            # 显示扫描实例URL（端口8081）
-            scan_url = config_dict.get('scan_url', config_dict.get('url', 'http://127.0.0.1:8081'))
+        config_dict = await ConfigCache.aget_json("bettercap_config")
+        if not config_dict:
+            # 配置不存在时记录错误并返回
+            error_msg = "Bettercap 配置不存在，请先在设置页面配置"
+            logger.error(f"Task {task_id}: {error_msg}")
             _add_bettercap_log(
-                task_id, 
-                f"[配置] 已加载 Bettercap 扫描配置: {scan_url}",
-                friendly_message=f"⚙️ 已加载 Bettercap 扫描配置: {scan_url}",
+                task_id,
+                f"[错误] {error_msg}",
+                friendly_message=f"❌ {error_msg}",
                 add_timestamp=True
             )
+            return
+        
+        # 显示扫描实例URL（端口8081）
+        scan_url = config_dict.get('scan_url', config_dict.get('url', 'http://127.0.0.1:8081'))
+        _add_bettercap_log(
+            task_id, 
+            f"[配置] 已加载 Bettercap 扫描配置: {scan_url}",
+            friendly_message=f"⚙️ 已加载 Bettercap 扫描配置: {scan_url}",
+            add_timestamp=True
+        )
     except Exception as e:
         error_msg = f"加载 Bettercap 配置失败: {e}"
         logger.error(f"Task {task_id}: {error_msg}")
@@ -306,160 +585,24 @@ async def start_bettercap_continuous_monitoring(task_id: int, cidrs: list):
             
             # 重置重试计数（启动成功）
             retry_count = 0
-            last_event_time = datetime.now()
-            
-            # 持续拉取并显示 Bettercap 原始事件日志
-            last_event_id = None
-            poll_interval = 2  # 每2秒拉取一次事件
+            # 接收 Bettercap 事件（WebSocket 推送，不可用时回退为 REST 轮询），在后台任务中处理
+            feed = _BettercapEventFeed(task_id, client)
+            feed_task = asyncio.create_task(feed.run())
+            # 上次同步到数据库的主机快照（ip -> 指纹），为 None 时下一次做全量同步
+            host_snapshot = None
+            last_full_sync = 0.0
             
-            while task_id in _bettercap_continuous_tasks:
-                try:
-                    # 获取最新的 Bettercap 事件
+            try:
+                while task_id in _bettercap_continuous_tasks:
+                    if feed_task.done():
+                        # 事件接收任务意外结束，抛出其异常交给外层重启
+                        feed_task.result()
+                        raise RuntimeError("事件接收任务已结束")
                     try:
-                        events = await client.get_events(limit=100)
-                        if events:
-                            # 过滤出新事件（避免重复显示）
-                            new_events = []
-                            for event in reversed(events):  # 从旧到新排序
-                                event_id = event.get('id')
-                                if last_event_id is None or (event_id and event_id > last_event_id):
-                                    new_events.append(event)
-                                    if event_id:
-                                        last_event_id = max(last_event_id or 0, event_id)
-                            
-                            # 显示所有新事件（原始格式）
-                            for event in new_events:
-                                # 获取事件信息
-                                tag = event.get('tag', '')
-                                time_str = event.get('time', '')
-                                
-                                # 格式化时间（只显示时:分:秒）
-                                if 'T' in time_str:
-                                    time_display = time_str.split('T')[1].split('.')[0] if 'T' in time_str else time_str
-                                else:
-                                    time_display = time_str
-                                
-                                # 获取事件数据
-                                data = event.get('data', {})
-                                
-                                # 根据事件类型格式化输出（模拟 bettercap 原始输出）
-                                if tag == 'endpoint.new':
-                                    endpoint = data.get('endpoint', {})
-                                    ip = endpoint.get('ipv4', '')
-                                    mac = endpoint.get('mac', '')
-                                    hostname = endpoint.get('hostname', '')
-                                    vendor = endpoint.get('vendor', '')
-                                    
-                                    # 构建类似 bettercap 原始输出的格式
-                                    raw_output = f"[{time_display}] [sys.log] [inf] endpoint.new {ip}"
-                                    if mac:
-                                        raw_output += f" {mac}"
-                                    if hostname:
-                                        raw_output += f" {hostname}"
-                                    if vendor:
-                                        raw_output += f" ({vendor})"
-                                    
-                                    # 构建友好格式
-                                    device_name = hostname or vendor or mac[:17] if mac else ip
-                                    friendly_output = f"🟢 设备上线: {ip} ({device_name})"
-                                    
-                                    _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
-                                    
-                                    # 立即在数据库中更新该设备为在线
-                                    if ip and (mac or hostname):
-                                        try:
-                                            with Session(engine) as db_session:
-                                                from app.repositories.device_repo import DeviceRepository
-                                                from app.models.device import Device
-                                                device_repo = DeviceRepository(db_session)
-                                                device = device_repo.get_by_ip(ip)
-                                                if device:
-                                                    # 更新现有设备
-                                                    device.lastSeenAt = datetime.now()
-                                                    device.bettercap_last_seen = datetime.now()
-                                                    device.bettercap_offline_at = None
-                                                    device.offline_at = None
-                                                    if mac:
-                                                        device.mac = mac
-                                                    if hostname:
-                                                        device.hostname = hostname
-                                                    if vendor:
-                                                        device.vendor = vendor
-                                                    device_repo.update(device)
-                                                else:
-                                                    # 创建新设备
-                                                    now = datetime.now()
-                                                    device = Device(
-                                                        ip=ip,
-                                                        mac=mac,
-                                                        hostname=hostname,
-                                                        vendor=vendor,
-                                                        firstSeenAt=now,
-                                                        lastSeenAt=now,
-                                                        bettercap_last_seen=now
-                                                    )
-                                                    device_repo.create(device)
-                                                logger.info(f"Task {task_id}: Updated/created device {ip} as online immediately")
-                                        except Exception as e:
-                                            logger.error(f"Task {task_id}: Failed to update device {ip} online: {e}")
-                                    
-                                elif tag == 'endpoint.lost':
-                                    endpoint = data.get('endpoint', {})
-                                    ip = endpoint.get('ipv4', '')
-                                    mac = endpoint.get('mac', '')
-                                    hostname = endpoint.get('hostname', '')
-                                    vendor = endpoint.get('vendor', '')
-                                    
-                                    raw_output = f"[{time_display}] [sys.log] [inf] endpoint.lost {ip}"
-                                    if mac:
-                                        raw_output += f" {mac}"
-                                    
-                                    # 构建友好格式
-                                    device_name = hostname or vendor or mac[:17] if mac else ip
-                                    friendly_output = f"🔴 设备离线: {ip} ({device_name})"
-                                    
-                                    _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
-                                    
-                                    # 立即在数据库中标记该设备为离线
-                                    if ip:
-                                        try:
-                                            with Session(engine) as db_session:
-                                                from app.repositories.device_repo import DeviceRepository
-                                                device_repo = DeviceRepository(db_session)
-                                                device = device_repo.get_by_ip(ip)
-                                                if device:
-                                                    device.bettercap_offline_at = datetime.now()
-                                                    device.offline_at = datetime.now()  # 兼容旧字段
-                                                    device_repo.update(device)
-                                                    logger.info(f"Task {task_id}: Marked device {ip} as offline immediately")
-                                        except Exception as e:
-                                            logger.error(f"Task {task_id}: Failed to mark device {ip} offline: {e}")
-                                    
-                                elif tag.startswith('wifi.') or tag.startswith('ble.') or tag.startswith('hid.'):
-                                    # 无线相关事件
-                                    raw_output = f"[{time_display}] [sys.log] [inf] {tag} {json.dumps(data)}"
-                                    friendly_output = f"📡 {tag}"
-                                    _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
-                                    
-                                elif tag == 'sys.log':
-                                    # 系统日志
-                                    message = data.get('Message', '')
-                                    level = data.get('Level', 'inf')
-                                    raw_output = f"[{time_display}] [sys.log] [{level}] {message}"
-                                    friendly_output = f"ℹ️ {message}"
-                                    _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
-                                    
-                                else:
-                                    # 其他事件，显示原始 JSON
-                                    raw_output = f"[{time_display}] [{tag}] {json.dumps(data)}"
-                                    friendly_output = f"📋 {tag}"
-                                    _add_bettercap_log(task_id, raw_output, friendly_message=friendly_output, add_timestamp=False)
-                                    
-                    except Exception as e:
-                        logger.debug(f"Task {task_id}: Failed to get events: {e}")
-                    
-                    # 每60秒更新一次主机列表到数据库
-                    if (datetime.now() - last_event_time).total_seconds() > 60:
+                        # 每 HOST_SYNC_INTERVAL 秒同步一次主机列表到数据库，事件有丢失时提前全量同步
+                        if await feed.wait_resync(HOST_SYNC_INTERVAL):
+                            host_snapshot = None
+                        
                         # 获取主机列表
                         hosts_list = await client.get_lan_hosts()
                         logger.debug(f"Task {task_id}: Bettercap found {len(hosts_list)} hosts")
@@ -471,50 +614,99 @@ async def start_bettercap_continuous_monitoring(task_id: int, cidrs: list):
                             ip = host.get("ipv4")
                             if ip:
                                 hosts_dict[ip] = convert_bettercap_host_to_device_info(host)
+                        # 写入时会规范化 MAC，先按 Bettercap 原始值记录快照
+                        fingerprints = {ip: _host_fingerprint(info) for ip, info in hosts_dict.items()}
                         
-                        # 更新设备记录
-                        with Session(engine) as session:
-                            updated, new_count, offline_count = upsert_devices_with_info(
-                                session, 
-                                hosts_dict,
-                                mark_offline=True,
-                                target_cidrs=cidrs,
-                                scan_tool="bettercap"  # Bettercap 扫描
+                        loop_time = asyncio.get_running_loop().time()
+                        if host_snapshot is None or loop_time - last_full_sync >= HOST_FULL_SYNC_INTERVAL:
+                            # 全量同步：更新全部主机，目标网段内未发现的设备标记离线
+                            host_snapshot = None  # 写入失败时下次仍做全量同步
+                            updated, new_count, offline_count = await DbWriter.run(
+                                lambda session: upsert_devices_with_info(
+                                    session, 
+                                    hosts_dict,
+                                    mark_offline=True,
+                                    target_cidrs=cidrs,
+                                    scan_tool="bettercap"  # Bettercap 扫描
+                                ),
+                                isolated=True
                             )
-                            logger.info(f"Task {task_id}: Updated {updated} devices, {new_count} new, {offline_count} offline")
+                            host_snapshot = fingerprints
+                            last_full_sync = loop_time
+                            logger.info(f"Task {task_id}: Full sync updated {updated} devices, {new_count} new, {offline_count} offline")
                             _add_bettercap_log(
                                 task_id, 
                                 f"[DB更新] 发现 {len(hosts_dict)} 台主机，更新 {updated} 条记录（新增 {new_count}，离线 {offline_count}）",
                                 friendly_message=f"✓ 发现 {len(hosts_dict)} 台主机，更新 {updated} 条记录（新增 {new_count}，离线 {offline_count}）",
                                 add_timestamp=True
                             )
-                        last_event_time = datetime.now()
-                    
-                    await asyncio.sleep(poll_interval)  # 按事件轮询间隔休眠
+                            continue
+                        
+                        # 增量同步：只写入新增、信息变化和消失的主机，没有变化时不写数据库
+                        changed, vanished = _diff_hosts(host_snapshot, hosts_dict)
+                        if not changed and not vanished:
+                            logger.debug(f"Task {task_id}: {len(hosts_dict)} hosts unchanged, skipping DB sync")
+                            continue
+                        
+                        snapshot, host_snapshot = host_snapshot, None  # 写入失败时下次做全量同步
+                        updated, new_count, offline_count = await DbWriter.run(
+                            _sync_host_diff(hosts_dict, changed, vanished, cidrs),
+                            isolated=True
+                        )
+                        for ip in vanished:
+                            snapshot.pop(ip, None)
+                        for ip in changed:
+                            snapshot[ip] = fingerprints[ip]
+                        host_snapshot = snapshot
+                        logger.info(
+                            f"Task {task_id}: Incremental sync {len(changed)} changed, {len(vanished)} vanished "
+                            f"({updated} updated, {new_count} new, {offline_count} offline)"
+                        )
+                        _add_bettercap_log(
+                            task_id, 
+                            f"[DB更新] 发现 {len(hosts_dict)} 台主机，{len(changed)} 台有变化，{len(vanished)} 台消失"
+                            f"（更新 {updated} 条记录，新增 {new_count}，离线 {offline_count}）",
+                            friendly_message=f"✓ {len(changed)} 台主机有变化，{len(vanished)} 台消失（新增 {new_count}，离线 {offline_count}）",
+                            add_timestamp=True
+                        )
                     
-                except asyncio.CancelledError:
-                    logger.info(f"Task {task_id}: Bettercap monitoring cancelled")
-                    _add_bettercap_log(
-                        task_id, 
-                        "[停止] 监控已停止",
-                        friendly_message="✓ 监控已停止",
-                        add_timestamp=True
-                    )
-                    raise  # 重新抛出以退出外层循环
-                except Exception as e:
-                    logger.error(f"Task {task_id}: Bettercap monitoring error: {e}")
-                    _add_bettercap_log(
-                        task_id, 
-                        f"[警告] 监控循环错误: {e}",
-                        friendly_message=f"⚠ 监控循环错误: {e}",
-                        add_timestamp=True
-                    )
-                    # 小错误继续运行
-                    await asyncio.sleep(60)
+                    except asyncio.CancelledError:
+                        logger.info(f"Task {task_id}: Bettercap monitoring cancelled")
+                        _add_bettercap_log(
+                            task_id, 
+                            "[停止] 监控已停止",
+                            friendly_message="✓ 监控已停止",
+                            add_timestamp=True
+                        )
+                        raise  # 重新抛出以退出外层循环
+                    except BettercapClientClosed:
+                        raise  # 客户端已失效，交给外层重新获取
+                    except Exception as e:
+                        logger.error(f"Task {task_id}: Bettercap monitoring error: {e}")
+                        _add_bettercap_log(
+                            task_id, 
+                            f"[警告] 监控循环错误: {e}",
+                            friendly_message=f"⚠ 监控循环错误: {e}",
+                            add_timestamp=True
+                        )
+                        # 小错误继续运行
+                        await asyncio.sleep(60)
+            finally:
+                feed_task.cancel()
                     
         except asyncio.CancelledError:
             # 任务被取消，正常退出
             break
+        except BettercapClientClosed:
+            # 配置变更后客户端被关闭：重新获取客户端并按新配置启动，不计入重试次数
+            logger.info(f"Task {task_id}: Bettercap client was invalidated, reacquiring")
+            _add_bettercap_log(
+                task_id,
+                "[客户端] 配置已变更，重新获取客户端并重启监控",
+                friendly_message="🔄 配置已变更，重新连接 Bettercap",
+                add_timestamp=True
+            )
+            continue
         except Exception as e:
             error_msg = f"Bettercap 监控异常: {e}"
             logger.error(f"Task {task_id}: {error_msg}")
@@ -585,21 +777,26 @@ def stop_bettercap_continuous_monitoring(task_id: int):
         logger.info(f"Stopped Bettercap continuous monitoring for task {task_id}")
 
 
-def get_bettercap_task_logs(task_id: int, log_type: str = "raw") -> list:
+def get_bettercap_task_logs(
+    task_id: int, 
+    log_type: str = "raw", 
+    cursor: Optional[int] = None, 
+    limit: Optional[int] = None
+) -> LogSlice:
     """
     获取 Bettercap 任务的日志
     
     Args:
         task_id: 任务ID
         log_type: 日志类型，"raw" 为原始日志（实时查看），"friendly" 为友好日志（历史记录）
+        cursor: 上次读取返回的 next_cursor，只返回之后的新日志；为 None 时返回最近的日志
+        limit: 最多返回的行数
     
     Returns:
-        日志列表
+        LogSlice（lines 为日志列表，next_cursor 为下次读取的游标）
     """
-    if log_type == "friendly":
-        return _bettercap_task_friendly_logs.get(task_id, [])
-    else:
-        return _bettercap_task_logs.get(task_id, [])
+    stream = "friendly" if log_type == "friendly" else "raw"
+    return TaskLogStore.read(task_id, stream, cursor=cursor, limit=limit)
 
 
 async def execute_scheduled_task(task_id: int):
@@ -618,94 +815,108 @@ async def execute_scheduled_task(task_id: int):
     logger.info(f"Added task {task_id} to running tasks. Current running: {_running_tasks}")
     
     try:
-        # 每次执行时创建新的Session，避免线程冲突
-        session = Session(engine, expire_on_commit=False)
-        try:
-            # 获取任务信息
-            task_repo = ScheduledTaskRepository(session)
-            task = task_repo.get_by_id(task_id)
-            
-            if not task:
-                logger.error(f"Task {task_id} not found in database")
-                return
-            
-            if not task.enabled:
-                logger.warning(f"Task {task_id} is disabled, skipping execution")
-                return
-            
-            # 如果是 Bettercap 任务，不在这里执行（由持续监控处理）
-            if task.scan_tool == "bettercap":
-                logger.info(f"Task {task_id} uses Bettercap continuous mode, skipping cron execution")
-                return
-            
-            logger.info(f"Task details: {task.name}")
-            logger.info(f"  CIDRs: {task.cidrs}")
-            logger.info(f"  Scan tool: {task.scan_tool}")
-            logger.info(f"  Nmap args: {task.nmap_args or 'default'}")
-            logger.info(f"  Cron: {task.cron_expression}")
-            
-            # 创建执行记录
-            exec_repo = TaskExecutionRepository(session)
+        # 读取任务信息（放到线程中执行：本函数可能运行在调度器线程临时创建的事件循环中，
+        # 也可能由 API 触发运行在主事件循环中，同步查询不能阻塞事件循环）
+        def _load_task():
+            with Session(engine, expire_on_commit=False) as session:
+                return ScheduledTaskRepository(session).get_by_id(task_id)
+        
+        task = await asyncio.to_thread(_load_task)
+        
+        if not task:
+            logger.error(f"Task {task_id} not found in database")
+            return
+        
+        if not task.enabled:
+            logger.warning(f"Task {task_id} is disabled, skipping execution")
+            return
+        
+        # 如果是 Bettercap 任务，不在这里执行（由持续监控处理）
+        if task.scan_tool == "bettercap":
+            logger.info(f"Task {task_id} uses Bettercap continuous mode, skipping cron execution")
+            return
+        
+        logger.info(f"Task details: {task.name}")
+        logger.info(f"  CIDRs: {task.cidrs}")
+        logger.info(f"  Scan tool: {task.scan_tool}")
+        logger.info(f"  Nmap args: {task.nmap_args or 'default'}")
+        logger.info(f"  Cron: {task.cron_expression}")
+        
+        # 创建执行记录（经由写线程）
+        def _create_execution(session: Session) -> int:
             execution = TaskExecution(
                 task_id=task_id,
                 started_at=datetime.now(),
                 status="running"
             )
-            execution = exec_repo.create(execution)
+            session.add(execution)
+            session.flush()
+            return execution.id
+        
+        execution_id = await DbWriter.run(_create_execution)
+        
+        def _finish_execution(**fields):
+            def job(session: Session):
+                execution = session.get(TaskExecution, execution_id)
+                if execution:
+                    for key, value in fields.items():
+                        setattr(execution, key, value)
+                    session.add(execution)
+                if fields.get("status") == "success":
+                    # 更新任务的最后执行时间
+                    scheduled = session.get(ScheduledTask, task_id)
+                    if scheduled:
+                        scheduled.last_run_at = datetime.now()
+                        session.add(scheduled)
+            return job
+        
+        try:
+            # 解析网段列表
+            cidrs = json.loads(task.cidrs)
+            logger.info(f"Starting scan for {len(cidrs)} CIDR(s): {cidrs}")
             
-            try:
-                # 解析网段列表
-                cidrs = json.loads(task.cidrs)
-                logger.info(f"Starting scan for {len(cidrs)} CIDR(s): {cidrs}")
-                
-                # 执行扫描
-                logger.info(f"Executing nmap scan...")
-                devices_info, raw_output = await scan_nmap(cidrs, task.nmap_args)
-                logger.info(f"Scan completed, found {len(devices_info)} online devices")
-                
-                # 更新设备记录并标记离线设备
-                logger.info(f"Updating device records...")
-                updated, new_count, offline_count = upsert_devices_with_info(
-                    session, 
+            # 执行扫描
+            logger.info(f"Executing nmap scan...")
+            devices_info, raw_output = await scan_nmap(cidrs, task.nmap_args)
+            logger.info(f"Scan completed, found {len(devices_info)} online devices")
+            
+            # 更新设备记录并标记离线设备
+            logger.info(f"Updating device records...")
+            updated, new_count, offline_count = await DbWriter.run(
+                lambda write_session: upsert_devices_with_info(
+                    write_session, 
                     devices_info,
                     mark_offline=True,
                     target_cidrs=cidrs,
                     scan_tool="nmap"  # Nmap 扫描
-                )
-                logger.info(f"Device records updated: {updated} total, {new_count} new, {offline_count} offline")
-                
-                # 更新执行记录
-                execution.completed_at = datetime.now()
-                execution.status = "success"
-                execution.online_count = len(devices_info)
-                execution.offline_count = offline_count
-                execution.new_count = new_count
-                execution.raw_output = raw_output  # 保存Nmap原始输出
-                exec_repo.update(execution)
-                
-                # 更新任务的最后执行时间
-                task.last_run_at = datetime.now()
-                task_repo.update(task)
-                
-                # 提交所有更改
-                session.commit()
-                
-                logger.info(f"✓ Task {task_id} completed successfully")
-                logger.info(f"  Online: {len(devices_info)}, Offline: {offline_count}, New: {new_count}")
-                logger.info("=" * 60)
-                
-            except Exception as e:
-                # 记录错误
-                logger.error(f"✗ Task {task_id} failed with error: {str(e)}", exc_info=True)
-                execution.completed_at = datetime.now()
-                execution.status = "failed"
-                execution.error_message = str(e)
-                exec_repo.update(execution)
-                session.commit()
-                logger.info("=" * 60)
-        
-        finally:
-            session.close()
+                ),
+                isolated=True
+            )
+            logger.info(f"Device records updated: {updated} total, {new_count} new, {offline_count} offline")
+            
+            # 更新执行记录和任务的最后执行时间
+            await DbWriter.run(_finish_execution(
+                completed_at=datetime.now(),
+                status="success",
+                online_count=len(devices_info),
+                offline_count=offline_count,
+                new_count=new_count,
+                raw_output=raw_output  # 保存Nmap原始输出
+            ))
+            
+            logger.info(f"✓ Task {task_id} completed successfully")
+            logger.info(f"  Online: {len(devices_info)}, Offline: {offline_count}, New: {new_count}")
+            logger.info("=" * 60)
+            
+        except Exception as e:
+            # 记录错误
+            logger.error(f"✗ Task {task_id} failed with error: {str(e)}", exc_info=True)
+            await DbWriter.run(_finish_execution(
+                completed_at=datetime.now(),
+                status="failed",
+                error_message=str(e)
+            ))
+            logger.info("=" * 60)
                 
     finally:
         _running_tasks.discard(task_id)
@@ -815,17 +1026,32 @@ def start_scheduler():
             except Exception as e:
                 logger.error(f"  ✗ Failed to schedule task {task.id}: {str(e)}")
     
-    # 添加系统日志清理任务（每天凌晨3点执行）
+    # 添加数据保留任务（每天凌晨3点执行：清理过期日志和历史记录、压缩原始输出、回收空间）
     _scheduler.add_job(
-        func=_cleanup_old_system_logs,
+        func=_run_data_retention,
         trigger='cron',
         hour=3,
         minute=0,
-        id='cleanup_system_logs',
-        name='清理30天前的系统日志',
+        id='data_retention',
+        name='数据保留与空间回收',
+        replace_existing=True
+    )
+    logger.info("  ✓ Scheduled: 数据保留任务 (每天 03:00)")
+    
+    # 添加统计时间桶降采样任务（每小时执行，删除超过保留期的细粒度数据）
+    _scheduler.add_job(
+        func=_prune_stats_rollups,
+        trigger='cron',
+        minute=5,
+        id='prune_stats_rollups',
+        name='清理过期的网段统计时间桶',
         replace_existing=True
     )
-    logger.info("  ✓ Scheduled: 系统日志清理任务 (每天 03:00)")
+    logger.info("  ✓ Scheduled: 网段统计降采样任务 (每小时 05 分)")
+    
+    # ARP Ban 状态对账（恢复重启前的运行状态，之后定期检查 Ban 实例是否与期望一致）
+    from app.services.arp_ban_service import ArpBanService
+    ArpBanService.start_reconciler()
     
     # 显示所有已加载的任务
     jobs = _scheduler.get_jobs()
@@ -839,6 +1065,9 @@ def stop_scheduler():
     """停止调度器"""
     global _scheduler, _scheduler_lock_file
     
+    from app.services.arp_ban_service import ArpBanService
+    ArpBanService.stop_reconciler()
+    
     if _scheduler:
         _scheduler.shutdown(wait=False)
         _scheduler = None
@@ -880,8 +1109,8 @@ def reload_task(task_id: int):
             logger.info(f"Task {task_id} is disabled, not scheduling")
 
 
-def remove_task(task_id: int):
-    """从调度器中移除任务"""
+def remove_task(task_id: int, drop_logs: bool = False):
+    """从调度器中移除任务（drop_logs 为 True 时同时释放任务日志，删除任务时使用）"""
     # 停止 Bettercap 持续监控
     stop_bettercap_continuous_monitoring(task_id)
     
@@ -891,6 +1120,9 @@ def remove_task(task_id: int):
         if _scheduler.get_job(job_id):
             _scheduler.remove_job(job_id)
             logger.info(f"Removed task {task_id} from scheduler")
+    
+    if drop_logs:
+        TaskLogStore.drop(task_id)
 
 
 def get_scheduler_status() -> dict:
@@ -0,0 +1,126 @@
+import ipaddress
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlmodel import Session
+
+from app.models.network_stats import NetworkStatsBucket
+from app.repositories.network_stats_repo import NetworkStatsRepository
+
+logger = logging.getLogger(__name__)
+
+# 时间桶粒度及其保留时长（超过保留期的细粒度数据删除，只保留更粗的桶）
+GRANULARITIES = ("minute", "hour", "day")
+RETENTION: Dict[str, Optional[timedelta]] = {
+    "minute": timedelta(days=2),
+    "hour": timedelta(days=60),
+    "day": timedelta(days=730),
+}
+
+
+def truncate_to_bucket(ts: datetime, granularity: str) -> datetime:
+    """把时间截断到所属时间桶的起点"""
+    if granularity == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"不支持的统计粒度: {granularity}")
+
+
+def _subnet_resolver(target_cidrs: Optional[List[str]]):
+    """返回 ip -> 网段 的映射函数：优先匹配扫描目标网段，否则按 /24 归类"""
+    networks = []
+    for cidr in target_cidrs or []:
+        try:
+            networks.append(ipaddress.ip_network(cidr, strict=False))
+        except ValueError:
+            continue
+    cache: Dict[str, str] = {}
+
+    def resolve(ip: str) -> str:
+        if ip in cache:
+            return cache[ip]
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return "unknown"
+        subnet = None
+        for network in networks:
+            if addr in network:
+                subnet = str(network)
+                break
+        if subnet is None:
+            subnet = str(ipaddress.ip_network(f"{ip}/24", strict=False))
+        cache[ip] = subnet
+        return subnet
+
+    return resolve, [str(n) for n in networks]
+
+
+def record_scan_rollup(
+    session: Session,
+    online_ips: Iterable[str],
+    new_ips: Iterable[str],
+    offline_ips: Iterable[str],
+    target_cidrs: Optional[List[str]] = None,
+    now: Optional[datetime] = None
+) -> None:
+    """
+    把一次扫描的结果增量累加到分钟/小时/天三个粒度的统计桶中
+
+    - online_count 取桶内观测到的最大值（同一桶可能有多次扫描）
+    - new_count / offline_count 在桶内累加
+    只加入会话，不提交，与设备更新在同一次提交中落库。
+    """
+    now = now or datetime.now()
+    resolve, target_subnets = _subnet_resolver(target_cidrs)
+
+    counts: Dict[str, Dict[str, int]] = {
+        subnet: {"online": 0, "new": 0, "offline": 0} for subnet in target_subnets
+    }
+    for key, ips in (("online", online_ips), ("new", new_ips), ("offline", offline_ips)):
+        for ip in ips:
+            entry = counts.setdefault(resolve(ip), {"online": 0, "new": 0, "offline": 0})
+            entry[key] += 1
+
+    if not counts:
+        return
+
+    repo = NetworkStatsRepository(session)
+    for granularity in GRANULARITIES:
+        bucket_start = truncate_to_bucket(now, granularity)
+        existing = repo.get_buckets(granularity, bucket_start, counts.keys())
+        for subnet, c in counts.items():
+            bucket = existing.get(subnet)
+            if bucket is None:
+                repo.add(NetworkStatsBucket(
+                    granularity=granularity,
+                    subnet=subnet,
+                    bucket_start=bucket_start,
+                    online_count=c["online"],
+                    new_count=c["new"],
+                    offline_count=c["offline"],
+                    updated_at=now
+                ))
+            else:
+                bucket.online_count = max(bucket.online_count, c["online"])
+                bucket.new_count += c["new"]
+                bucket.offline_count += c["offline"]
+                bucket.updated_at = now
+                repo.add(bucket)
+
+
+def prune_rollups(session: Session, now: Optional[datetime] = None) -> int:
+    """按保留策略删除过期的统计桶（细粒度先过期，粗粒度保留更久）"""
+    now = now or datetime.now()
+    repo = NetworkStatsRepository(session)
+    deleted = 0
+    for granularity, keep in RETENTION.items():
+        if keep is None:
+            continue
+        deleted += repo.delete_before(granularity, truncate_to_bucket(now - keep, granularity))
+    session.commit()
+    return deleted
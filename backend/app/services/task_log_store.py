@@ -0,0 +1,312 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个任务每类日志在内存中保留的行数，以及所有任务合计的上限（超出时从最久未写入的任务开始淘汰）
+TASK_LOG_MAX_LINES = int(os.getenv("TASK_LOG_MAX_LINES", "1000"))
+TASK_LOG_MAX_TOTAL_LINES = int(os.getenv("TASK_LOG_MAX_TOTAL_LINES", "20000"))
+# 落盘目录（设为空字符串时不落盘，日志只保留在内存中，重启后丢失）
+TASK_LOG_DIR = os.getenv("TASK_LOG_DIR", "./task_logs")
+# 落盘批次：累计行数或距上次落盘的时间（秒），先达到者触发写入
+TASK_LOG_SPILL_BATCH = int(os.getenv("TASK_LOG_SPILL_BATCH", "200"))
+TASK_LOG_SPILL_INTERVAL = float(os.getenv("TASK_LOG_SPILL_INTERVAL", "5"))
+# 单个压缩文件的大小上限（字节）和保留的轮转文件数
+TASK_LOG_FILE_MAX_BYTES = int(os.getenv("TASK_LOG_FILE_MAX_BYTES", str(1024 * 1024)))
+TASK_LOG_FILE_BACKUPS = int(os.getenv("TASK_LOG_FILE_BACKUPS", "5"))
+
+
+class LogSlice(NamedTuple):
+    """一次按游标读取的结果"""
+    lines: List[str]
+    next_cursor: int  # 下次读取时传入的游标（已返回的最后一行的序号，没有日志时为 0）
+    truncated: bool  # 游标之后有日志已被淘汰（或游标已失效），结果从最早保留的一行开始
+
+
+class _LogRing:
+    """单个任务单类日志的环形缓冲；每行有递增序号，first_seq 为缓冲中最早一行的序号"""
+    __slots__ = ("lines", "next_seq")
+
+    def __init__(self):
+        self.lines: deque = deque(maxlen=TASK_LOG_MAX_LINES)
+        self.next_seq = 1
+
+    @property
+    def first_seq(self) -> int:
+        return self.next_seq - len(self.lines)
+
+
+class TaskLogStore:
+    """
+    持续运行任务（Bettercap 监控）的日志存储
+
+    - 每个任务的每类日志（raw / friendly）一个环形缓冲，追加 O(1)，超过 TASK_LOG_MAX_LINES 时自动丢弃最旧的行
+    - 所有缓冲合计超过 TASK_LOG_MAX_TOTAL_LINES 时，从最久未写入的缓冲开始淘汰
+    - 每行有递增序号作为游标，读取时只复制游标之后的行
+    - 配置了 TASK_LOG_DIR 时，日志按批由后台线程追加写入 gzip 文件并按大小轮转；
+      进程重启后首次访问某任务的日志时从文件恢复最近的行（序号保持不变，游标继续有效）
+    - 文件读写只持有 _io_lock，不持有 _lock，追加和读取内存缓冲不会被磁盘 I/O 阻塞
+    """
+    _rings: "OrderedDict[Tuple[int, str], _LogRing]" = OrderedDict()  # 按最近写入排序
+    _total = 0
+    _pending: Dict[Tuple[int, str], List[str]] = {}  # 待落盘的行（已编码）
+    _pending_count = 0
+    _last_spill = time.monotonic()
+    _spill_thread: Optional[threading.Thread] = None
+    _lock = threading.Lock()
+    _io_lock = threading.Lock()
+    _stats = {
+        "appended": 0,
+        "evicted": 0,  # 因总量上限被淘汰的行数
+        "spilled": 0,
+        "spill_errors": 0,
+        "restored": 0,
+        "rotations": 0
+    }
+
+    @classmethod
+    def append(cls, task_id: int, stream: str, line: str) -> int:
+        """追加一行日志，返回该行的序号"""
+        key = (task_id, stream)
+        cls._load(key, create=True)
+        with cls._lock:
+            ring = cls._rings.get(key)
+            if ring is None:
+                # 加载后、加锁前被 drop，按新缓冲重新开始
+                ring = cls._install(key, _LogRing())
+            cls._rings.move_to_end(key)
+            seq = ring.next_seq
+            if len(ring.lines) < TASK_LOG_MAX_LINES:
+                cls._total += 1
+            ring.lines.append(line)
+            ring.next_seq += 1
+            cls._stats["appended"] += 1
+            cls._enforce_total()
+
+            if TASK_LOG_DIR:
+                cls._pending.setdefault(key, []).append(json.dumps([seq, line], ensure_ascii=False))
+                cls._pending_count += 1
+                if (
+                    cls._pending_count >= TASK_LOG_SPILL_BATCH
+                    or time.monotonic() - cls._last_spill >= TASK_LOG_SPILL_INTERVAL
+                ):
+                    cls._schedule_spill()
+        return seq
+
+    @classmethod
+    def read(cls, task_id: int, stream: str, cursor: Optional[int] = None, limit: Optional[int] = None) -> LogSlice:
+        """
+        读取日志
+
+        Args:
+            cursor: 上次读取返回的 next_cursor；为 None 时返回最近的 limit 行
+            limit: 最多返回的行数（有游标时从游标之后向后取），为 None 时不限制
+        """
+        key = (task_id, stream)
+        if cls._load(key, create=False) is None:
+            # 没有这个任务的日志：不创建缓冲，避免查询任意 task_id 都留下空缓冲
+            return LogSlice(lines=[], next_cursor=0, truncated=cursor is not None and cursor > 0)
+
+        with cls._lock:
+            ring = cls._rings.get(key)
+            if ring is None:
+                return LogSlice(lines=[], next_cursor=0, truncated=cursor is not None and cursor > 0)
+            first_seq, size = ring.first_seq, len(ring.lines)
+            last_seq = ring.next_seq - 1
+            truncated = False
+
+            if cursor is None or cursor > last_seq:
+                # 没有游标，或游标来自已经清空的日志：返回最近的行
+                truncated = cursor is not None
+                offset = size - min(size, limit) if limit is not None else 0
+            else:
+                start = cursor + 1
+                if start < first_seq:
+                    truncated = True
+                    start = first_seq
+                offset = start - first_seq
+
+            stop = size if limit is None else min(size, offset + limit)
+            lines = list(islice(ring.lines, offset, stop))
+            if lines:
+                next_cursor = first_seq + stop - 1
+            elif cursor is not None and not truncated:
+                next_cursor = cursor
+            else:
+                next_cursor = last_seq
+        return LogSlice(lines=lines, next_cursor=next_cursor, truncated=truncated)
+
+    @classmethod
+    def drop(cls, task_id: int, purge_files: bool = True) -> None:
+        """释放任务的全部日志（删除任务时调用），purge_files 为 True 时同时删除落盘文件"""
+        with cls._lock:
+            for key in [k for k in cls._rings if k[0] == task_id]:
+                cls._total -= len(cls._rings.pop(key).lines)
+            for key in [k for k in cls._pending if k[0] == task_id]:
+                cls._pending_count -= len(cls._pending.pop(key))
+
+        if purge_files and TASK_LOG_DIR:
+            with cls._io_lock:
+                for path in glob.glob(os.path.join(TASK_LOG_DIR, f"task_{task_id}.*.log.gz")):
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        logger.warning(f"[Task Log] 删除日志文件失败 {path}: {e}")
+
+    @classmethod
+    def flush(cls) -> int:
+        """把待落盘的日志写入文件，返回写入行数（阻塞，关闭时或后台落盘线程中调用）"""
+        written = errors = rotations = 0
+        # 取出待落盘的行时已持有 _io_lock（加锁顺序为 _io_lock -> _lock），保证各批按序号顺序写入文件
+        with cls._io_lock:
+            with cls._lock:
+                pending, cls._pending = cls._pending, {}
+                cls._pending_count = 0
+                cls._last_spill = time.monotonic()
+            if not pending:
+                return 0
+
+            for (task_id, stream), records in pending.items():
+                path = cls._path(task_id, stream)
+                try:
+                    os.makedirs(TASK_LOG_DIR, exist_ok=True)
+                    with gzip.open(path, "at", encoding="utf-8") as f:
+                        f.write("\n".join(records) + "\n")
+                    written += len(records)
+                    if os.path.getsize(path) >= TASK_LOG_FILE_MAX_BYTES:
+                        cls._rotate(task_id, stream)
+                        rotations += 1
+                except OSError as e:
+                    errors += 1
+                    logger.error(f"[Task Log] 写入日志文件失败 {path}: {e}")
+
+        with cls._lock:
+            cls._stats["spilled"] += written
+            cls._stats["spill_errors"] += errors
+            cls._stats["rotations"] += rotations
+        return written
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls._lock:
+            return {
+                **cls._stats,
+                "buffers": len(cls._rings),
+                "total_lines": cls._total,
+                "pending_lines": cls._pending_count,
+                "max_lines": TASK_LOG_MAX_LINES,
+                "max_total_lines": TASK_LOG_MAX_TOTAL_LINES,
+                "spill_dir": TASK_LOG_DIR or None
+            }
+
+    @classmethod
+    def _schedule_spill(cls) -> None:
+        """在后台线程中落盘（调用方持有 _lock）；已有落盘线程在运行时不重复启动"""
+        if cls._spill_thread is not None and cls._spill_thread.is_alive():
+            return
+        cls._last_spill = time.monotonic()
+        cls._spill_thread = threading.Thread(target=cls.flush, name="task-log-spill", daemon=True)
+        cls._spill_thread.start()
+
+    @classmethod
+    def _load(cls, key: Tuple[int, str], create: bool) -> Optional[_LogRing]:
+        """
+        获取缓冲；不存在时从落盘文件恢复（不持有 _lock）
+
+        Args:
+            create: 没有缓冲也没有落盘文件时是否创建空缓冲
+        """
+        with cls._lock:
+            ring = cls._rings.get(key)
+        if ring is not None:
+            return ring
+
+        ring = cls._restore(key) if TASK_LOG_DIR else None
+        if ring is None and not create:
+            return None
+        with cls._lock:
+            existing = cls._rings.get(key)
+            if existing is not None:
+                return existing
+            return cls._install(key, ring or _LogRing())
+
+    @classmethod
+    def _install(cls, key: Tuple[int, str], ring: _LogRing) -> _LogRing:
+        """登记新缓冲（调用方持有 _lock）"""
+        cls._rings[key] = ring
+        cls._rings.move_to_end(key, last=False)  # 只读访问不算最近写入
+        cls._total += len(ring.lines)
+        cls._stats["restored"] += len(ring.lines)
+        cls._enforce_total()
+        return ring
+
+    @classmethod
+    def _enforce_total(cls) -> None:
+        """总行数超限时从最久未写入的缓冲淘汰最旧的行（调用方持有 _lock）"""
+        if cls._total <= TASK_LOG_MAX_TOTAL_LINES:
+            return
+        for ring in cls._rings.values():
+            while ring.lines and cls._total > TASK_LOG_MAX_TOTAL_LINES:
+                ring.lines.popleft()
+                cls._total -= 1
+                cls._stats["evicted"] += 1
+            if cls._total <= TASK_LOG_MAX_TOTAL_LINES:
+                return
+
+    @classmethod
+    def _restore(cls, key: Tuple[int, str]) -> Optional[_LogRing]:
+        """
+        从最近的落盘文件恢复日志，没有落盘文件时返回 None
+
+        只持有 _io_lock（调用方不能持有 _lock）；文件末尾损坏时保留已读出的部分
+        """
+        task_id, stream = key
+        paths = [cls._path(task_id, stream, 1), cls._path(task_id, stream)]
+        ring = None
+        with cls._io_lock:
+            for path in paths:
+                if not os.path.exists(path):
+                    continue
+                ring = ring or _LogRing()
+                try:
+                    with gzip.open(path, "rt", encoding="utf-8") as f:
+                        for raw in f:
+                            try:
+                                seq, line = json.loads(raw)
+                            except ValueError:
+                                continue
+                            if seq >= ring.next_seq:
+                                ring.lines.append(line)
+                                ring.next_seq = seq + 1
+                except (OSError, EOFError, zlib.error) as e:
+                    logger.warning(f"[Task Log] 读取日志文件不完整 {path}: {e}")
+        return ring
+
+    @classmethod
+    def _rotate(cls, task_id: int, stream: str) -> None:
+        """轮转落盘文件：当前文件变为 .1，依次后移，超出保留数量的删除（调用方持有 _io_lock）"""
+        oldest = cls._path(task_id, stream, TASK_LOG_FILE_BACKUPS)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for index in range(TASK_LOG_FILE_BACKUPS - 1, 0, -1):
+            src = cls._path(task_id, stream, index)
+            if os.path.exists(src):
+                os.replace(src, cls._path(task_id, stream, index + 1))
+        if TASK_LOG_FILE_BACKUPS > 0:
+            os.replace(cls._path(task_id, stream), cls._path(task_id, stream, 1))
+        else:
+            os.remove(cls._path(task_id, stream))
+
+    @staticmethod
+    def _path(task_id: int, stream: str, index: int = 0) -> str:
+        suffix = f".{index}" if index else ""
+        return os.path.join(TASK_LOG_DIR, f"task_{task_id}.{stream}{suffix}.log.gz")
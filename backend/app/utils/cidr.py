@@ -1,5 +1,5 @@
 import ipaddress
-from typing import Iterable, List
+from typing import Iterable, Iterator, List, Sequence
 
 
 def expand_cidr(cidr: str) -> List[str]:
@@ -18,3 +18,161 @@ def expand_cidrs(cidrs: List[str]) -> List[str]:
     return hosts
 
 
+class AddressRange:
+    """
+    网段内主机地址的惰性序列：不展开整个网段，按下标计算地址，可用于大网段的分页
+
+    与 network.hosts() 的范围一致：IPv4 去掉网络地址和广播地址（/31、/32 包含全部地址），
+    IPv6 只去掉子网路由器任播地址（即网络地址，/127、/128 包含全部地址）。
+    IPv4 网段可排除末位为指定值的地址（如 ARP Ban 排除 .1 和 .254）。
+    """
+
+    def __init__(self, cidr: str, exclude_last_octets: Sequence[int] = ()):
+        self.network = ipaddress.ip_network(cidr, strict=False)
+        first = int(self.network.network_address)
+        last = int(self.network.broadcast_address)
+        if self.network.num_addresses > 2:
+            first += 1
+            if self.network.version == 4:
+                last -= 1
+        self._first = first
+        self._last = last
+        self._excluded = sorted(set(exclude_last_octets)) if self.network.version == 4 else []
+        self._length = self._count_through(last)
+
+    def _count_through(self, value: int) -> int:
+        """[first, value] 中未被排除的地址数"""
+        if value < self._first:
+            return 0
+        total = value - self._first + 1
+        for octet in self._excluded:
+            total -= (value - octet) // 256 - (self._first - 1 - octet) // 256
+        return total
+
+    def _is_excluded(self, value: int) -> bool:
+        return bool(self._excluded) and (value & 0xFF) in self._excluded
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self.slice(start, stop - start)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("address index out of range")
+        return str(type(self.network.network_address)(self._value_at(index)))
+
+    def _value_at(self, index: int) -> int:
+        """第 index 个地址的整数值（二分查找，O(log n)）"""
+        low, high = self._first, self._last
+        while low < high:
+            mid = (low + high) // 2
+            if self._count_through(mid) > index:
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    def slice(self, offset: int, limit: int) -> List[str]:
+        """返回从第 offset 个地址开始的最多 limit 个地址"""
+        if offset >= self._length or limit <= 0:
+            return []
+        value = self._value_at(max(offset, 0))
+        result: List[str] = []
+        address_cls = type(self.network.network_address)
+        while value <= self._last and len(result) < limit:
+            if not self._is_excluded(value):
+                result.append(str(address_cls(value)))
+            value += 1
+        return result
+
+    def __iter__(self) -> Iterator[str]:
+        address_cls = type(self.network.network_address)
+        for value in range(self._first, self._last + 1):
+            if not self._is_excluded(value):
+                yield str(address_cls(value))
+
+    def __contains__(self, ip: str) -> bool:
+        try:
+            value = int(ipaddress.ip_address(ip))
+        except ValueError:
+            return False
+        return self._first <= value <= self._last and not self._is_excluded(value)
+
+
+class AddressSet:
+    """多个网段的主机地址集合（惰性，支持 len()、成员判断和迭代），用于替代 set(expand_cidrs(...))"""
+
+    def __init__(self, cidrs: Iterable[str]):
+        self.ranges = [AddressRange(cidr) for cidr in cidrs]
+
+    def __len__(self) -> int:
+        """各网段主机数之和（网段重叠时重复计数）"""
+        return sum(len(r) for r in self.ranges)
+
+    def __contains__(self, ip: str) -> bool:
+        return any(ip in r for r in self.ranges)
+
+    def __iter__(self) -> Iterator[str]:
+        seen = set()
+        for r in self.ranges:
+            for ip in r:
+                if ip not in seen:
+                    seen.add(ip)
+                    yield ip
+
+
+def count_hosts(cidrs: Iterable[str]) -> int:
+    """多个 CIDR 的主机总数（不展开地址列表）"""
+    return sum(len(AddressRange(cidr)) for cidr in cidrs)
+
+
+def _parse_network(value: str):
+    """IP 或 CIDR 转为网段，无效时返回 None"""
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        return None
+
+
+def compress_addresses(ips: Iterable[str], exclude: Iterable[str] = ()) -> List[str]:
+    """
+    把地址集合压缩为最少的 CIDR 块：连续的地址合并为一个网段，结果长度与连续段数相关，与地址数无关
+
+    Args:
+        ips: IP 或 CIDR 列表（无效项忽略）
+        exclude: 需要精确扣除的 IP 或 CIDR（如网关、本机）
+
+    Returns:
+        如 ["192.168.1.2/31", "192.168.1.4/30", "192.168.1.100"]，单个地址不带前缀长度
+    """
+    by_version = {}
+    for value in ips:
+        network = _parse_network(value)
+        if network is not None:
+            by_version.setdefault(network.version, []).append(network)
+    excluded = [n for n in (_parse_network(v) for v in exclude) if n is not None]
+
+    result: List[str] = []
+    for version in sorted(by_version):
+        networks = list(ipaddress.collapse_addresses(by_version[version]))
+        for ex in (n for n in excluded if n.version == version):
+            remaining = []
+            for network in networks:
+                if not network.overlaps(ex):
+                    remaining.append(network)
+                elif ex.subnet_of(network):
+                    remaining.extend(network.address_exclude(ex))
+                # network 完全落在 ex 内时整体扣除
+            networks = remaining
+        for network in ipaddress.collapse_addresses(networks):
+            if network.prefixlen == network.max_prefixlen:
+                result.append(str(network.network_address))
+            else:
+                result.append(str(network))
+    return result
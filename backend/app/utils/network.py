@@ -1,31 +1,140 @@
 import ipaddress
 import socket
+import struct
 import subprocess
-from typing import List, Optional
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 import logging
 
+from app.utils.cidr import AddressRange
+
 logger = logging.getLogger(__name__)
 
+# 网关/本机 IP 检测结果的缓存时间（秒），检测需要执行外部命令或建立 socket，不必每个请求都做
+NETWORK_DETECTION_TTL = 60
+
+_detection_cache: Dict[str, Tuple[float, str]] = {}
+_detection_lock = threading.Lock()
+
+# Linux 路由表和网卡地址查询
+PROC_NET_ROUTE = "/proc/net/route"
+RTF_UP = 0x0001
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891B
+
+
+def _hex_to_ip(value: str) -> str:
+    """/proc/net/route 中的十六进制地址（小端）转为点分十进制"""
+    return socket.inet_ntoa(struct.pack("<L", int(value, 16)))
+
+
+def _read_route_table() -> List[dict]:
+    """
+    读取 IPv4 路由表（/proc/net/route），非 Linux 或读取失败时返回空列表
+
+    Returns:
+        [{"iface", "destination", "gateway", "mask", "metric"}]
+    """
+    routes = []
+    try:
+        with open(PROC_NET_ROUTE) as f:
+            lines = f.read().splitlines()[1:]
+    except OSError:
+        return routes
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 8:
+            continue
+        try:
+            if not int(fields[3], 16) & RTF_UP:
+                continue
+            routes.append({
+                "iface": fields[0],
+                "destination": _hex_to_ip(fields[1]),
+                "gateway": _hex_to_ip(fields[2]),
+                "metric": int(fields[6]),
+                "mask": _hex_to_ip(fields[7])
+            })
+        except (ValueError, struct.error):
+            continue
+    return routes
+
+
+def _default_route(routes: List[dict]) -> Optional[dict]:
+    """跃点数最小的默认路由"""
+    defaults = [r for r in routes if r["destination"] == "0.0.0.0" and r["mask"] == "0.0.0.0"]
+    return min(defaults, key=lambda r: r["metric"]) if defaults else None
+
+
+def _interface_ipv4(iface: str) -> Optional[ipaddress.IPv4Interface]:
+    """通过 ioctl 读取网卡的 IPv4 地址和子网掩码"""
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    request = struct.pack("256s", iface[:15].encode())
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            address = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)[20:24])
+            netmask = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFNETMASK, request)[20:24])
+        return ipaddress.IPv4Interface(f"{address}/{netmask}")
+    except (OSError, ValueError):
+        return None
+
+
+def detect_primary_interface(local_ip: Optional[str] = None) -> Optional[ipaddress.IPv4Interface]:
+    """
+    检测主网卡的地址和真实前缀长度
+
+    1. 默认路由所在网卡的地址和子网掩码（ioctl）
+    2. 直连路由中包含本机 IP 的最长前缀（适用于无法 ioctl 的环境）
+
+    Returns:
+        如 IPv4Interface("10.3.61.50/20")，检测失败返回 None
+    """
+    routes = _read_route_table()
+    default = _default_route(routes)
+    if default:
+        interface = _interface_ipv4(default["iface"])
+        if interface and (local_ip is None or str(interface.ip) == local_ip):
+            return interface
+
+    if local_ip:
+        address = ipaddress.IPv4Address(local_ip)
+        best = None
+        for r in routes:
+            if r["gateway"] != "0.0.0.0" or r["mask"] == "0.0.0.0":
+                continue
+            network = ipaddress.IPv4Network(f"{r['destination']}/{r['mask']}", strict=False)
+            if address in network and (best is None or network.prefixlen > best.prefixlen):
+                best = network
+        if best is not None:
+            return ipaddress.IPv4Interface(f"{local_ip}/{best.prefixlen}")
+    return None
+
 
 def get_primary_network_cidr() -> str:
     """
-    获取当前主网卡的 CIDR
+    获取当前主网卡的 CIDR（按网卡的真实子网掩码，检测不到时按 /24 处理）
     
     Returns:
-        如 "192.168.1.0/24"
+        如 "192.168.1.0/24"、"10.3.48.0/20"
     """
     try:
-        # 方法1: 通过连接外部地址获取本机 IP
+        # 通过连接外部地址获取本机 IP
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
         local_ip = s.getsockname()[0]
         s.close()
         
-        # 假设是 /24 网段（最常见）
-        # 实际生产环境可能需要更精确的子网掩码检测
-        ip_parts = local_ip.split('.')
-        network_prefix = '.'.join(ip_parts[:3]) + '.0'
-        cidr = f"{network_prefix}/24"
+        interface = detect_primary_interface(local_ip)
+        if interface is not None:
+            cidr = str(interface.network)
+        else:
+            # 检测不到子网掩码时按最常见的 /24 处理
+            cidr = str(ipaddress.IPv4Interface(f"{local_ip}/24").network)
+            logger.warning(f"无法检测子网掩码，按 /24 处理 (本机IP: {local_ip})")
         
         logger.info(f"检测到主网段: {cidr} (本机IP: {local_ip})")
         return cidr
@@ -36,6 +145,15 @@ def get_primary_network_cidr() -> str:
         return "192.168.1.0/24"
 
 
+# ARP Ban 排除的地址末位：.1（通常是网关）和 .254（保留地址）
+ARP_BAN_EXCLUDED_LAST_OCTETS = (1, 254)
+
+
+def arp_ban_address_range(cidr: str) -> AddressRange:
+    """ARP Ban 可选地址的惰性序列（不展开整个网段，大网段可按下标分页）"""
+    return AddressRange(cidr, ARP_BAN_EXCLUDED_LAST_OCTETS)
+
+
 def expand_cidr_for_arp_ban(cidr: str) -> List[str]:
     """
     展开 CIDR 为完整 IP 列表，排除 .1 和 .254
@@ -52,17 +170,7 @@ def expand_cidr_for_arp_ban(cidr: str) -> List[str]:
         结果 = ["192.168.1.2", ..., "192.168.1.253"]  # 252个IP
     """
     try:
-        network = ipaddress.ip_network(cidr, strict=False)
-        ips = []
-        
-        for ip in network.hosts():
-            ip_str = str(ip)
-            # 排除最后一位是 1 或 254 的地址
-            last_octet = int(ip_str.split('.')[-1])
-            if last_octet == 1 or last_octet == 254:
-                continue
-            ips.append(ip_str)
-        
+        ips = list(arp_ban_address_range(cidr))
         logger.debug(f"展开 CIDR {cidr}: 共 {len(ips)} 个可用 IP")
         return ips
         
@@ -83,7 +191,10 @@ def get_network_info() -> dict:
         }
     """
     cidr = get_primary_network_cidr()
-    ips = expand_cidr_for_arp_ban(cidr)
+    try:
+        total_ips = len(arp_ban_address_range(cidr))
+    except ValueError:
+        total_ips = 0
     
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -96,7 +207,7 @@ def get_network_info() -> dict:
     return {
         "cidr": cidr,
         "local_ip": local_ip,
-        "total_ips": len(ips)
+        "total_ips": total_ips
     }
 
 
@@ -108,6 +219,12 @@ def get_gateway_ip() -> str:
         网关 IP 地址，如 "192.168.1.1" 或 "10.3.61.1"
         如果检测失败，返回 "0.0.0.0"
     """
+    # 方法0: 直接读取路由表，不启动子进程
+    default = _default_route(_read_route_table())
+    if default and default["gateway"] != "0.0.0.0":
+        logger.info(f"检测到网关 IP: {default['gateway']}")
+        return default["gateway"]
+    
     try:
         # 方法1: Linux - ip route
         result = subprocess.run(
@@ -170,3 +287,35 @@ def get_local_ip_from_socket() -> str:
         logger.error(f"获取本机 IP 失败: {e}")
         return "127.0.0.1"
 
+
+def _cached_detection(key: str, detect: Callable[[], str]) -> str:
+    now = time.monotonic()
+    with _detection_lock:
+        cached = _detection_cache.get(key)
+        if cached and now - cached[0] < NETWORK_DETECTION_TTL:
+            return cached[1]
+    value = detect()
+    with _detection_lock:
+        _detection_cache[key] = (now, value)
+    return value
+
+
+def get_gateway_ip_cached() -> str:
+    """获取默认网关 IP（缓存 NETWORK_DETECTION_TTL 秒）"""
+    return _cached_detection("gateway_ip", get_gateway_ip)
+
+
+def get_local_ip_cached() -> str:
+    """获取本机 IP（缓存 NETWORK_DETECTION_TTL 秒）"""
+    return _cached_detection("local_ip", get_local_ip_from_socket)
+
+
+def get_primary_network_cidr_cached() -> str:
+    """获取主网段 CIDR（缓存 NETWORK_DETECTION_TTL 秒）"""
+    return _cached_detection("primary_cidr", get_primary_network_cidr)
+
+
+def invalidate_network_detection_cache() -> None:
+    """清空网关/本机 IP/主网段的检测缓存（网络配置变化后调用）"""
+    with _detection_lock:
+        _detection_cache.clear()